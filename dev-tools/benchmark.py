@@ -0,0 +1,249 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import tempfile
+import statistics
+import importlib.util
+
+from contextlib import redirect_stdout
+
+"""
+ Benchmarks the hashing and the upload of release artifacts, offline: synthetic
+ artifacts are generated and uploaded to a local S3 stand-in (see standins.py).
+
+   $ python3 dev-tools/benchmark.py --sizes 1 16 128 --output baseline.json
+
+ Results are written as JSON and can be compared with a previous run: the
+ benchmark exits with 1 if a benchmark got slower than the tolerance allows.
+
+   $ python3 dev-tools/benchmark.py --sizes 1 16 128 --compare baseline.json --tolerance 0.2
+
+ Benchmarks:
+  - hash/<size>: compute_digests of one artifact with all the checksum algorithms
+  - checksums/all: generate_checksums of all the artifacts at the same time
+  - upload/<size>: upload of one artifact in a single request
+  - multipart/<size>: upload of one artifact in parts, for artifacts bigger than a part
+  - publish/all: publish_artifacts of all the artifacts and their checksums
+  - republish/all: publish_artifacts of the same files again, all skipped as unchanged
+  - latency/put: upload of an empty object
+
+ Uploads need boto, they are skipped if it is not installed. Benchmarks of the
+ baseline which did not run fail the comparison.
+"""
+env = os.environ
+
+MB = 1024 * 1024
+DEFAULT_SIZES = [1, 16, 128]
+MAX_SIZE = 2048
+# Size of the chunks written when generating artifacts
+GENERATE_CHUNK_SIZE = 4 * MB
+# Requests sent to measure the latency of an upload
+LATENCY_REQUESTS = 20
+BENCHMARK_BUCKET = 'benchmark'
+
+
+# Generate an artifact of random bytes. Artifacts of the same size
+# generated by a previous run are reused.
+def generate_artifact(work_dir, size_mb):
+    artifact = os.path.join(work_dir, 'artifact-%smb.zip' % size_mb)
+    if os.path.isfile(artifact) and os.path.getsize(artifact) == size_mb * MB:
+        return artifact
+    with open(artifact + '.tmp', 'wb') as file:
+        remaining = size_mb * MB
+        while remaining > 0:
+            chunk = os.urandom(min(GENERATE_CHUNK_SIZE, remaining))
+            file.write(chunk)
+            remaining -= len(chunk)
+    os.replace(artifact + '.tmp', artifact)
+    return artifact
+
+
+# Run function repeat times, returns the result of the benchmark. Its
+# output (ie. upload progress) is discarded.
+def measure(name, function, size, repeat):
+    runs = []
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            runs.append(time.perf_counter() - start)
+    median = statistics.median(runs)
+    result = {'name': name, 'bytes': size, 'runs': runs, 'best': min(runs), 'median': median,
+              'mb_per_s': size / MB / median if size and median else None}
+    print('  %-20s %10.4fs %10s' % (name, median, '%.1f MB/s' % result['mb_per_s'] if result['mb_per_s'] else ''))
+    return result
+
+
+def benchmark_hashing(build_release, artifacts, repeat):
+    results = []
+    for size_mb, artifact in artifacts:
+        results.append(measure('hash/%smb' % size_mb, lambda: build_release.compute_digests(artifact),
+                               size_mb * MB, repeat))
+    files = [artifact for _, artifact in artifacts]
+    results.append(measure('checksums/all', lambda: build_release.generate_checksums(*files),
+                           sum(size_mb for size_mb, _ in artifacts) * MB, repeat))
+    return results
+
+
+def benchmark_uploads(build_release, standins, artifacts, repeat, threads, part_size, latency):
+    tool = build_release.load_s3_tool()
+    server = standins.S3StandIn(latency=latency).start()
+    results = []
+    try:
+        build_release.S3_ENDPOINT = server.endpoint
+        build_release.S3_BUCKET = BENCHMARK_BUCKET
+        build_release.S3_UPLOAD_THREADS = threads
+        server.create_bucket(BENCHMARK_BUCKET)
+        conn = tool.connect(server.endpoint)
+        bucket = tool.existing_bucket(conn, BENCHMARK_BUCKET)
+
+        for size_mb, artifact in artifacts:
+            key = os.path.basename(artifact)
+            results.append(measure('upload/%smb' % size_mb,
+                                   lambda: check_results(tool.publish(conn, 'single', [(artifact, key)], bucket)),
+                                   size_mb * MB, repeat))
+            if size_mb * MB > part_size:
+                results.append(measure('multipart/%smb' % size_mb,
+                                       lambda: tool.multipart_upload_s3(conn, 'multipart', key, artifact, bucket,
+                                                                        part_size=part_size, threads=threads),
+                                       size_mb * MB, repeat))
+
+        files = build_release.generate_checksums(*[artifact for _, artifact in artifacts])
+        build_release.S3_SKIP_UNCHANGED = False
+        results.append(measure('publish/all', lambda: build_release.publish_artifacts(files, 'publish', dry_run=False),
+                               sum(os.path.getsize(file) for file in files), repeat))
+        build_release.S3_SKIP_UNCHANGED = True
+        results.append(measure('republish/all',
+                               lambda: build_release.publish_artifacts(files, 'publish', dry_run=False),
+                               sum(os.path.getsize(file) for file in files), repeat))
+
+        empty = os.path.join(os.path.dirname(artifacts[0][1]), 'empty')
+        open(empty, 'wb').close()
+        results.append(measure('latency/put', lambda: bucket.new_key('latency/empty').set_contents_from_filename(empty),
+                               0, LATENCY_REQUESTS))
+    finally:
+        server.stop()
+    return results
+
+
+def check_results(results):
+    for result in results:
+        if result['error']:
+            raise RuntimeError('Failed to upload %s: %s' % (result['file'], result['error']))
+
+
+# Compare with the results of a previous run. Returns the names of the
+# benchmarks whose median time grew more than tolerance, and of the
+# benchmarks of the baseline which did not run (ie. boto is missing).
+def compare(results, baseline, tolerance):
+    baseline = dict((result['name'], result) for result in baseline['results'])
+    current = set(result['name'] for result in results)
+    missing = [name for name in baseline if name not in current]
+    regressions = []
+    print(''.join(['-' for _ in range(80)]))
+    print('%-20s %12s %12s %8s' % ('Benchmark', 'Baseline', 'Current', 'Change'))
+    for result in results:
+        if result['name'] not in baseline:
+            continue
+        before = baseline[result['name']]['median']
+        change = result['median'] / before - 1 if before else 0
+        regressed = change > tolerance
+        if regressed:
+            regressions.append(result['name'])
+        print('%-20s %11.4fs %11.4fs %+7.1f%%%s' % (result['name'], before, result['median'], change * 100,
+                                                    ' SLOWER' if regressed else ''))
+    for name in missing:
+        print('%-20s %11.4fs %12s %8s MISSING' % (name, baseline[name]['median'], '-', '-'))
+    print(''.join(['-' for _ in range(80)]))
+    return regressions, missing
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the hashing and upload of release artifacts')
+    parser.add_argument('--sizes', '-s', metavar='MB', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Sizes in mb of the generated artifacts, from 1 to %s. Default is %s'
+                             % (MAX_SIZE, DEFAULT_SIZES))
+    parser.add_argument('--repeat', '-r', metavar='3', type=int, default=3,
+                        help='Number of runs of each benchmark')
+    parser.add_argument('--threads', '-t', metavar='4', type=int, default=4,
+                        help='Number of uploads at the same time')
+    parser.add_argument('--part_size', metavar='16', type=int, default=16,
+                        help='The size of each part in mb when uploading in parts')
+    parser.add_argument('--latency', metavar='0.0', type=float, default=0,
+                        help='Seconds the S3 stand-in waits before answering each request')
+    parser.add_argument('--work_dir', metavar='path', default=os.path.join(tempfile.gettempdir(), 'release_benchmark'),
+                        help='Directory of the generated artifacts, kept between runs')
+    parser.add_argument('--output', '-o', metavar='results.json', default=None,
+                        help='Writes the results to the given JSON file')
+    parser.add_argument('--compare', '-c', metavar='baseline.json', default=None,
+                        help='Compares the results with the ones of a previous run')
+    parser.add_argument('--tolerance', metavar='0.1', type=float, default=0.1,
+                        help='Part of the baseline time a benchmark can get slower by. Default is 0.1')
+    args = parser.parse_args()
+
+    for size_mb in args.sizes:
+        if not 1 <= size_mb <= MAX_SIZE:
+            parser.error('artifact sizes must be between 1 and %s mb' % MAX_SIZE)
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    env.setdefault('ES_RELEASE_LOG', os.path.join(args.work_dir, 'benchmark.log'))
+    # the stand-in does not check signatures, but boto needs credentials
+    env.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    env.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+    import build_release
+    import standins
+
+    print('Generating artifacts in %s' % args.work_dir)
+    artifacts = [(size_mb, generate_artifact(args.work_dir, size_mb)) for size_mb in sorted(set(args.sizes))]
+
+    print('Hashing')
+    results = benchmark_hashing(build_release, artifacts, args.repeat)
+    skipped = []
+    print('Uploading')
+    if importlib.util.find_spec('boto') is None:
+        print('  skipped: boto is not installed')
+        skipped.append('upload')
+    else:
+        results += benchmark_uploads(build_release, standins, artifacts, args.repeat, args.threads,
+                                     args.part_size * MB, args.latency)
+
+    report = {'created': datetime.datetime.now().isoformat(), 'python': platform.python_version(),
+              'platform': platform.platform(), 'cpus': os.cpu_count(),
+              'parameters': {'sizes': sorted(set(args.sizes)), 'repeat': args.repeat, 'threads': args.threads,
+                             'part_size': args.part_size, 'latency': args.latency},
+              'skipped': skipped, 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+        print('Results written to %s' % args.output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            regressions, missing = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print('Slower than the baseline: %s' % ', '.join(regressions))
+        if missing:
+            print('In the baseline but not run: %s' % ', '.join(missing))
+        if regressions or missing:
+            sys.exit(1)
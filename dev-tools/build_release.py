@@ -15,18 +15,34 @@
 # language governing permissions and limitations under the License.
 
 import re
+import atexit
 import tempfile
 import shutil
 import os
 import datetime
 import argparse
-import github3
 import smtplib
 import subprocess
 import sys
-
-from functools import partial
-
+import time
+import json
+import signal
+import fcntl
+import threading
+import base64
+import hashlib
+import sqlite3
+import importlib.util
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ElementTree
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from contextlib import closing, contextmanager
+from functools import partial, wraps
+
+from email import message_from_bytes
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
@@ -44,6 +60,38 @@ from os.path import dirname, abspath
 
    $ python3 dev_tools/build_release.py --publish --remote origin --disable_mail
 
+ Several plugins can be released at once with the '--batch' option. Each repository is
+ released by its own process, at most '--workers' (2 by default) of them running at the same
+ time. The release emails are sent at the end of the batch, all over the same SMTP connection:
+
+   $ python3 dev_tools/build_release.py --batch ../elasticsearch-cloud-azure ../elasticsearch-cloud-aws --workers 4
+
+ Several maintenance branches of a plugin can be released at once with the '--matrix' option. Each
+ branch is released in its own git worktree by its own process, leaving master untouched: the
+ README of master is updated once all the releases are done, in a single commit.
+
+   $ python3 dev_tools/build_release.py --matrix es-1.3 es-1.4 es-1.5 --workers 3
+
+ The steps done are recorded in a journal kept in the git directory. If a step fails, the
+ branches and artifacts are left as they are: '--resume' continues the release from its last
+ completed step, once the branches and artifacts are checked to be unchanged, and '--abort'
+ rolls it back.
+
+   $ python3 dev_tools/build_release.py --resume
+
+ Github issues are kept in a local index, synced with the issues updated since the previous
+ sync. The release notes of several versions can be generated from it with '--changelog',
+ for the given versions or all the versions labelled in the index:
+
+   $ python3 dev_tools/build_release.py --changelog 2.5.0 2.4.0
+
+ The first sync of a repository downloads all its issues, open and closed: one request per
+ 100 issues, counted in the Github rate limit. Deleted or transferred issues are never updated,
+ so they stay in the index until '--resync_issues' downloads all the issues again and drops
+ the others:
+
+   $ python3 dev_tools/build_release.py --changelog --resync_issues
+
  The script takes over almost all
  steps necessary for a release from a high level point of view it does the following things:
 
@@ -52,33 +100,61 @@ from os.path import dirname, abspath
   - check that github issues related to the version are closed
   - creates a version release branch & updates pom.xml to point to a release version rather than a snapshot
   - creates a master release branch & updates README.md to point to the latest release version for the given elasticsearch branch
-  - builds the artifacts
+  - runs the tests in parallel forks, unless the same sources already passed them
+  - builds the artifacts, or reuses the build of a previous run of the same sources
   - commits the new version and merges the version release branch into the source branch
   - merges the master release branch into the master branch
   - creates a tag and pushes branch and master to the specified origin (--remote)
+  - generates sha1, sha512 and md5 checksum files for the artifacts
   - publishes the releases to sonatype and S3
+  - checks the size and ETag of the files uploaded to S3, without downloading them
   - send a mail based on github issues fixed by this version
 
 Once it's done it will print all the remaining steps.
 
+ These steps are declared with their dependencies in release_steps(). Steps changing the git
+ working tree run one after the other; the others, like the GitHub checks, the checksums or the
+ S3 upload, run as soon as what they need is ready, at the same time as the Maven build.
+
  Prerequisites:
     - Python 3k for script execution
-    - Boto for S3 Upload ($ apt-get install python-boto or pip-3.3 install boto)
-    - github3 module (pip-3.3 install github3.py)
+    - Boto for S3 Upload, installed for the Python 3 interpreter running this script: uploads run in this process
+    ($ apt-get install python3-boto or pip3 install boto)
     - S3 keys exported via ENV Variables (AWS_ACCESS_KEY_ID,  AWS_SECRET_ACCESS_KEY)
+    - S3_BUCKET - Optional: default to 'download.elasticsearch.org'
+    - S3_ENDPOINT - Optional: a S3 compatible server to use instead of Amazon S3
+    - S3_VERIFY_THREADS - Optional: default to 16. Number of uploaded files checked at the same time
+    - S3_SKIP_UNCHANGED - Optional: default to true. Files are uploaded with their sha1 in their metadata: files
+    already on S3 with the same sha1, ie. when publishing again, are not uploaded again.
     - GITHUB (login/password) or key exported via ENV Variables (GITHUB_LOGIN,  GITHUB_PASSWORD or GITHUB_KEY)
     (see https://github.com/settings/applications#personal-access-tokens) - Optional: default to no authentication
-    - SMTP_HOST - Optional: default to localhost
+    - GITHUB_API_URL - Optional: default to https://api.github.com
+    - ES_RELEASE_GITHUB_CACHE_MAX_AGE - Optional: default to 3600. Github responses are cached in ES_RELEASE_CACHE_DIR
+    and revalidated with conditional requests. When the rate limit is almost reached, cached responses younger
+    than this number of seconds are used without asking Github.
+    - SMTP_SERVER - Optional: default to localhost
+    - SMTP_PORT - Optional: default to 25
+    - SMTP_USER / SMTP_PASSWORD - Optional: credentials of the SMTP server
+    - SMTP_STARTTLS - Optional: set to 'true' to use STARTTLS
     - MAIL_SENDER - Optional: default to 'david@pilato.fr': must be authorized to send emails to elasticsearch mailing list
-    - MAIL_TO - Optional: default to 'discuss%2Bannouncements@elastic.co'
+    - MAIL_TO - Optional: default to 'discuss%2Bannouncements@elastic.co'. Several recipients can be given,
+    separated by commas: the email is sent to each one over the same SMTP connection.
+    - ES_RELEASE_CACHE_DIR - Optional: default to ~/.cache/elasticsearch-release. Builds are cached there by
+    git tree hash, JDK and Maven versions: a release of the same sources reuses the build of the dry run.
+    Passed test runs are recorded there as well, by git tree hash and JDK version, and are not run again.
+    The maven command and the java and maven versions detected are kept there until PATH, JAVA_HOME or the
+    binaries change. The Github issues of each repository are indexed there as well.
+    - ES_RELEASE_TEST_FORKS - Optional: default to the number of cores. Number of parallel forks running the tests.
 """
 env = os.environ
 
 LOG = env.get('ES_RELEASE_LOG', '/tmp/elasticsearch_release.log')
-ROOT_DIR = abspath(os.path.join(abspath(dirname(__file__)), '../'))
+ROOT_DIR = env.get('ES_RELEASE_ROOT_DIR', abspath(os.path.join(abspath(dirname(__file__)), '../')))
 README_FILE = ROOT_DIR + '/README.md'
 POM_FILE = ROOT_DIR + '/pom.xml'
-DEV_TOOLS_DIR = ROOT_DIR + '/plugin_tools'
+DEV_TOOLS_DIR = abspath(os.path.join(abspath(dirname(__file__)), '../plugin_tools'))
+# When set, the release never waits for the user and uses default answers
+NON_INTERACTIVE = env.get('ES_RELEASE_NON_INTERACTIVE', 'false') == 'true'
 
 # console colors
 OKGREEN = '\033[92m'
@@ -90,13 +166,75 @@ FAIL = '\033[91m'
 # Utility methods (log and run)
 #
 ##########################################################
+# The LOG file holds one JSON record per line. Each record has a timestamp,
+# the phase of the release and an event: message, phase, command (started),
+# output (a line printed by the command) or result (exit code and duration)
+LOG_BUFFER_SIZE = 64 * 1024
+
+# Handle on the LOG file, kept open for the whole run
+log_file = None
+log_lock = threading.Lock()
+# Current phase of the release. Steps of the release pipeline
+# running in their own thread set their own phase.
+log_phase = 'init'
+log_thread_phase = threading.local()
+
+# Commands which can be interrupted if the release fails, by process id
+interruptible_commands = {}
+# Lock file taken by the git commands. The releases of a matrix, and the
+# trees of a worktree release, share the refs of their repository: their
+# git commands run one at a time.
+GIT_LOCK_FILE = env.get('ES_RELEASE_GIT_LOCK', None)
+
+
+# Write a record to the LOG file
+def log_record(event, **fields):
+    global log_file
+    phase = getattr(log_thread_phase, 'phase', log_phase)
+    record = {'timestamp': datetime.datetime.now().isoformat(), 'phase': phase, 'event': event}
+    record.update(fields)
+    line = json.dumps(record) + '\n'
+    with log_lock:
+        if log_file is None:
+            log_file = open(LOG, mode='a', encoding='utf-8', buffering=LOG_BUFFER_SIZE)
+            atexit.register(close_log)
+        log_file.write(line)
+
+
+# Write buffered records to the LOG file
+def flush_log():
+    with log_lock:
+        if log_file is not None:
+            log_file.flush()
+
+
+# Flush and close the LOG file
+def close_log():
+    global log_file
+    with log_lock:
+        if log_file is not None:
+            log_file.close()
+            log_file = None
+
+
+# Start a new phase of the release. Records
+# of the previous phase are flushed first.
+def set_phase(phase):
+    global log_phase
+    flush_log()
+    log_phase = phase
+    log_record('phase')
+    start_phase_span(phase)
+
+
 # Log a message
 def log(msg):
-    log_plain('\n%s' % msg)
+    log_plain(msg)
 
 
 # Purge the log file
 def purge_log():
+    close_log()
     try:
         os.remove(LOG)
     except FileNotFoundError:
@@ -105,48 +243,281 @@ def purge_log():
 
 # Log a message to the LOG file
 def log_plain(msg):
-    f = open(LOG, mode='ab')
-    f.write(msg.encode('utf-8'))
-    f.close()
+    log_record('message', message=msg)
 
 
-# Run a command and log it
-def run(command, quiet=False):
-    log('%s: RUN: %s\n' % (datetime.datetime.now(), command))
-    if os.system('%s >> %s 2>&1' % (command, LOG)):
+# Print the LOG file as plain text
+def print_log():
+    flush_log()
+    with open(LOG, encoding='utf-8') as file:
+        for line in file:
+            record = json.loads(line)
+            if record['event'] == 'output':
+                print(record['line'])
+            elif record['event'] == 'command':
+                print('%s: RUN: %s' % (record['timestamp'], record['command']))
+            elif record['event'] == 'result':
+                print('%s: exit code %s in %.1fs' % (record['timestamp'], record['exit_code'], record['duration']))
+            elif record['event'] == 'phase':
+                print('%s: PHASE: %s' % (record['timestamp'], record['phase']))
+            else:
+                print('%s: %s' % (record['timestamp'], record['message']))
+
+
+# Hold GIT_LOCK_FILE, if any, while running a git command. The lock is
+# taken by other processes and other threads of this process alike.
+@contextmanager
+def git_lock(command):
+    if GIT_LOCK_FILE is None or not command.startswith('git '):
+        yield
+        return
+    with open(GIT_LOCK_FILE, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Run a command and log it, with its output. Interruptible
+# commands are stopped if another step of the release fails.
+# cwd is the directory to run the command in, the current one by default.
+# name is the name of the command in the trace, the command by default.
+def run(command, quiet=False, interruptible=False, cwd=None, name=None):
+    log_record('command', command=command, cwd=cwd)
+    start = time.time()
+    with span(name or command, 'command'), git_lock(command):
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   start_new_session=interruptible, cwd=cwd)
+        if interruptible:
+            interruptible_commands[process.pid] = command
+        with process.stdout:
+            for line in process.stdout:
+                log_record('output', command=command, line=line.decode('utf-8', 'replace').rstrip('\n'))
+        exit_code = process.wait()
+        interruptible_commands.pop(process.pid, None)
+    log_record('result', command=command, duration=time.time() - start, exit_code=exit_code)
+    if exit_code:
         msg = '    FAILED: %s [see log %s]' % (command, LOG)
         if not quiet:
             print(msg)
         raise RuntimeError(msg)
 
+
+# Stop all the interruptible commands still running
+def interrupt_commands():
+    for pid, command in list(interruptible_commands.items()):
+        log('interrupting %s' % command)
+        try:
+            # the command runs in a shell: stop all the processes of its session
+            os.killpg(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+# Ask the user for some input. Returns an empty answer
+# (the default) when running non interactively
+def ask(prompt):
+    if NON_INTERACTIVE:
+        print(prompt)
+        return ''
+    return input(prompt)
+
+
+# Merge the given fields into the JSON result file if any
+def write_result(result_file, **fields):
+    if not result_file:
+        return
+    result = {}
+    if os.path.isfile(result_file):
+        with open(result_file, encoding='utf-8') as file:
+            result = json.load(file)
+    result.update(fields)
+    with open(result_file, 'w', encoding='utf-8') as file:
+        json.dump(result, file)
+
 ##########################################################
 #
-# Clean logs and check JAVA and Maven
+# Tracing
 #
 ##########################################################
-try:
-    purge_log()
-    JAVA_HOME = env['JAVA_HOME']
-except KeyError:
-    raise RuntimeError("""
+# Finished spans. Each one has a name, a category (phase, function
+# or command), its start and duration in seconds and its thread
+trace_spans = []
+trace_lock = threading.Lock()
+# Name and start of the current phase
+current_phase = None
+
+
+# Record a finished span
+def add_span(name, category, start, end):
+    with trace_lock:
+        trace_spans.append({'name': name, 'category': category, 'start': start,
+                            'duration': end - start, 'thread': threading.get_ident()})
+
+
+# Record a span around a block of code
+@contextmanager
+def span(name, category='function'):
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_span(name, category, start, time.time())
+
+
+# Decorator recording a span for each call of a function
+def traced(function):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with span(function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+# Phases follow each other: starting a phase ends the previous one
+def start_phase_span(phase):
+    global current_phase
+    now = time.time()
+    if current_phase is not None:
+        add_span(current_phase[0], 'phase', current_phase[1], now)
+    current_phase = (phase, now) if phase is not None else None
+
+
+# Export spans in the Chrome trace event format (chrome://tracing, Perfetto, speedscope)
+def export_trace(trace_file):
+    start_phase_span(None)
+    with trace_lock:
+        spans = list(trace_spans)
+    origin = min([s['start'] for s in spans] or [0])
+    events = [{'name': s['name'], 'cat': s['category'], 'ph': 'X', 'pid': os.getpid(), 'tid': s['thread'],
+               'ts': int((s['start'] - origin) * 1000000), 'dur': int(s['duration'] * 1000000)}
+              for s in spans]
+    with open(trace_file, 'w', encoding='utf-8') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+# Print the spans which took the most time, grouped by name.
+# Nested spans are included in the time of their parents.
+def print_trace_summary(top=15):
+    start_phase_span(None)
+    totals = {}
+    with trace_lock:
+        for s in trace_spans:
+            total = totals.setdefault((s['category'], s['name']), [0, 0])
+            total[0] += s['duration']
+            total[1] += 1
+    print(''.join(['-' for _ in range(80)]))
+    print('%-9s %-52s %5s %10s' % ('Category', 'Name', 'Calls', 'Time'))
+    for (category, name), (duration, calls) in sorted(totals.items(), key=lambda t: -t[1][0])[:top]:
+        if len(name) > 52:
+            # keep both ends: commands often only differ by their end
+            name = name[:24] + '...' + name[-25:]
+        print('%-9s %-52s %5s %9.1fs' % (category, name, calls, duration))
+    print(''.join(['-' for _ in range(80)]))
+
+
+##########################################################
+#
+# Check JAVA and Maven
+#
+##########################################################
+# Directory of the caches kept between releases
+CACHE_DIR = env.get('ES_RELEASE_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'elasticsearch-release'))
+# Results of the detection of the tools, kept between runs
+TOOLS_CACHE_FILE = os.path.join(CACHE_DIR, 'tools.json')
+
+# Tools detected by this run
+detected_tools = None
+tools_cache_lock = threading.Lock()
+
+
+def java_home():
+    try:
+        return env['JAVA_HOME']
+    except KeyError:
+        raise RuntimeError("""
   Please set JAVA_HOME in the env before running release tool
   On OSX use: export JAVA_HOME=`/usr/libexec/java_home -v '1.7*'`""")
 
-try:
-    MVN = 'mvn'
-    # make sure mvn3 is used if mvn3 is available
-    # some systems use maven 2 as default
-    run('mvn3 --version', quiet=True)
-    MVN = 'mvn3'
-except RuntimeError:
-    pass
-
 
 def java_exe():
-    path = JAVA_HOME
+    path = java_home()
     return 'export JAVA_HOME="%s" PATH="%s/bin:$PATH" JAVACMD="%s/bin/java"' % (path, path, path)
 
 
+# Returns the value cached for name, or detects it with detect(). Cached
+# values are detected again when the PATH, JAVA_HOME or one of the given
+# binaries changed. Nothing is cached if detect() raises an error.
+def cached_detection(name, binaries, detect):
+    stamps = [(binary, file_stamp(binary)) for binary in binaries if binary and os.path.exists(binary)]
+    key = hashlib.sha1(json.dumps([env.get('PATH', ''), env.get('JAVA_HOME', ''), stamps]).encode('utf-8')).hexdigest()
+    with tools_cache_lock:
+        cache = read_tools_cache()
+    if name in cache and cache[name]['key'] == key:
+        return cache[name]['value']
+
+    value = detect()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # read again: other detections may have updated the cache
+    with tools_cache_lock:
+        cache = read_tools_cache()
+        cache[name] = {'key': key, 'value': value}
+        fd, tmp_file = tempfile.mkstemp(dir=CACHE_DIR, prefix='.tools.')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(cache, file, indent=2)
+        os.replace(tmp_file, TOOLS_CACHE_FILE)
+    return value
+
+
+def read_tools_cache():
+    try:
+        with open(TOOLS_CACHE_FILE, encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+# Detects the maven command and the first line printed by
+# java -version and mvn --version
+def detect_tools():
+    mvn = 'mvn'
+    try:
+        # make sure mvn3 is used if mvn3 is available
+        # some systems use maven 2 as default
+        run('mvn3 --version', quiet=True)
+        mvn = 'mvn3'
+    except RuntimeError:
+        pass
+    java_version = os.popen('%s; java -version 2>&1' % java_exe()).read().strip().splitlines()
+    mvn_version = os.popen('%s; %s --version 2>&1' % (java_exe(), mvn)).read().strip().splitlines()
+    return {'mvn': mvn, 'java_version': java_version[0] if java_version else '',
+            'mvn_version': mvn_version[0] if mvn_version else ''}
+
+
+# The tools are detected on first use
+def tools():
+    global detected_tools
+    if detected_tools is None:
+        binaries = [shutil.which('mvn3'), shutil.which('mvn'), os.path.join(java_home(), 'bin', 'java')]
+        detected_tools = cached_detection('tools', binaries, detect_tools)
+    return detected_tools
+
+
+# Maven command: mvn3 if available else mvn
+def maven_command():
+    return tools()['mvn']
+
+
+# JAVA_HOME and MVN are only checked and detected when used
+def __getattr__(name):
+    if name == 'JAVA_HOME':
+        return java_home()
+    if name == 'MVN':
+        return maven_command()
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
 def verify_java_version(version):
     s = os.popen('%s; java -version 2>&1' % java_exe()).read()
     if ' version "%s.' % version not in s:
@@ -169,30 +540,119 @@ def release_branch(branchsource, version):
     return 'release_branch_%s_%s' % (branchsource, version)
 
 
+# A set of line rules applied to a file in a single pass. Rules are
+# applied in the order they were added, each one to the output of
+# the previous ones. The file is only replaced, with an atomic rename,
+# if a rule changed a line.
+#
+#   rewrite = FileRewrite(README_FILE)
+#   rewrite.replace('2.0.0-SNAPSHOT', '2.0.0')
+#   rewrite.sub(r'install elasticsearch/.+', 'install elasticsearch/plugin/2.0.0')
+#   matches = rewrite.commit()
+class FileRewrite(object):
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.rules = []
+        self.matches = None
+        self.modified = False
+
+    # Replace a literal string
+    def replace(self, literal, replacement):
+        def rule(line):
+            return line.replace(literal, replacement), literal in line
+        return self.add_rule('replace %s' % literal, rule)
+
+    # Replace what a regular expression matches
+    def sub(self, pattern, replacement):
+        regex = re.compile(pattern)
+
+        def rule(line):
+            new_line, count = regex.subn(replacement, line)
+            return new_line, count > 0
+        return self.add_rule('sub %s' % pattern, rule)
+
+    # Replace whole lines matching a regular expression
+    def replace_line(self, pattern, replacement):
+        regex = re.compile(pattern)
+
+        def rule(line):
+            matched = regex.search(line) is not None
+            return replacement if matched else line, matched
+        return self.add_rule('replace line matching %s' % pattern, rule)
+
+    # Replace whole lines containing a literal string
+    def replace_line_containing(self, literal, replacement):
+        def rule(line):
+            matched = literal in line
+            return replacement if matched else line, matched
+        return self.add_rule('replace line containing %s' % literal, rule)
+
+    # Apply a callback returning the new line
+    def apply(self, line_callback):
+        def rule(line):
+            new_line = line_callback(line)
+            return new_line, new_line != line
+        return self.add_rule('apply %s' % getattr(line_callback, '__name__', line_callback), rule)
+
+    def add_rule(self, description, rule):
+        if self.matches is not None:
+            raise RuntimeError('Rewrite of %s already committed' % self.file_path)
+        self.rules.append((description, rule))
+        return self
+
+    # Apply all the rules. Returns the number of lines each rule matched
+    def commit(self):
+        if self.matches is not None:
+            return self.matches
+        counts = [0] * len(self.rules)
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        # the temporary file must be on the same file system for the rename to be atomic
+        fh, abs_path = tempfile.mkstemp(dir=directory, prefix='.%s.' % os.path.basename(self.file_path))
+        try:
+            with open(fh, 'w', encoding='utf-8') as new_file:
+                with open(self.file_path, encoding='utf-8') as old_file:
+                    for line in old_file:
+                        new_line = line
+                        for index, (_, rule) in enumerate(self.rules):
+                            new_line, matched = rule(new_line)
+                            if matched:
+                                counts[index] += 1
+                        self.modified = self.modified or (new_line != line)
+                        new_file.write(new_line)
+            if self.modified:
+                shutil.copymode(self.file_path, abs_path)
+                os.replace(abs_path, self.file_path)
+                invalidate_pom(self.file_path)
+        finally:
+            if not self.modified:
+                # nothing to do - just remove the tmp file
+                os.remove(abs_path)
+
+        self.matches = [(description, count) for (description, _), count in zip(self.rules, counts)]
+        log('rewrite %s: %s' % (self.file_path, ', '.join('%s [%s]' % match for match in self.matches)))
+        return self.matches
+
+
+# Run the rules added by add_rules in the given rewrite. When given
+# a file path instead, they are applied right away to the file.
+def apply_rules(target, add_rules):
+    if isinstance(target, FileRewrite):
+        add_rules(target)
+        return target
+    rewrite = FileRewrite(target)
+    add_rules(rewrite)
+    rewrite.commit()
+    return rewrite
+
+
 # Reads the given file and applies the
 # callback to it. If the callback changed
 # a line the given file is replaced with
 # the modified input.
 def process_file(file_path, line_callback):
-    fh, abs_path = tempfile.mkstemp()
-    modified = False
-    with open(abs_path, 'w', encoding='utf-8') as new_file:
-        with open(file_path, encoding='utf-8') as old_file:
-            for line in old_file:
-                new_line = line_callback(line)
-                modified = modified or (new_line != line)
-                new_file.write(new_line)
-    os.close(fh)
-    if modified:
-        #Remove original file
-        os.remove(file_path)
-        #Move new file
-        shutil.move(abs_path, file_path)
-        return True
-    else:
-        # nothing to do - just remove the tmp file
-        os.remove(abs_path)
-        return False
+    rewrite = FileRewrite(file_path).apply(line_callback)
+    rewrite.commit()
+    return rewrite.modified
 
 
 # Split a version x.y.z as an array of digits [x,y,z]
@@ -218,25 +678,18 @@ def get_doc_anchor(release, esversion):
 
 
 # Moves the pom.xml file from a snapshot to a release
+# pom is the path of the file or a FileRewrite of it
 def remove_maven_snapshot(pom, release):
     pattern = '<version>%s-SNAPSHOT</version>' % release
     replacement = '<version>%s</version>' % release
-
-    def callback(line):
-        return line.replace(pattern, replacement)
-
-    process_file(pom, callback)
+    return apply_rules(pom, lambda rewrite: rewrite.replace(pattern, replacement))
 
 
 # Moves the pom.xml file to the next snapshot
 def add_maven_snapshot(pom, release, snapshot):
     pattern = '<version>%s</version>' % release
     replacement = '<version>%s-SNAPSHOT</version>' % snapshot
-
-    def callback(line):
-        return line.replace(pattern, replacement)
-
-    process_file(pom, callback)
+    return apply_rules(pom, lambda rewrite: rewrite.replace(pattern, replacement))
 
 
 # Moves the README.md file from a snapshot to a release version. Doc looks like:
@@ -248,15 +701,8 @@ def update_documentation_in_released_branch(readme_file, release, esversion):
     es_digits = split_version_to_digits(esversion)
     replacement = '## Version %s for Elasticsearch: %s.%s\n' % (
         release, es_digits[0], es_digits[1])
-
-    def callback(line):
-        # If we find pattern, we replace its content
-        if re.search(pattern, line) is not None:
-            return replacement
-        else:
-            return line
-
-    process_file(readme_file, callback)
+    # If we find pattern, we replace its content
+    return apply_rules(readme_file, lambda rewrite: rewrite.replace_line(pattern, replacement))
 
 
 # Moves the README.md file from a snapshot to a release (documentation link)
@@ -267,63 +713,15 @@ def update_documentation_to_released_version(readme_file, repo_url, release, bra
     pattern = '%s' % branch
     replacement = '|    %s              |     %s         | [%s](%stree/v%s/%s)                  |\n' % (
         branch, release, release, repo_url, release, get_doc_anchor(release, esversion))
-
-    def callback(line):
-        # If we find pattern, we replace its content
-        if line.find(pattern) >= 0:
-            return replacement
-        else:
-            return line
-
-    process_file(readme_file, callback)
+    # If we find pattern, we replace its content
+    return apply_rules(readme_file, lambda rewrite: rewrite.replace_line_containing(pattern, replacement))
 
 
 # Update installation instructions in README.md file
 def set_install_instructions(readme_file, artifact_name, release):
     pattern = 'bin/plugin -?install elasticsearch/%s/.+' % artifact_name
     replacement = 'bin/plugin install elasticsearch/%s/%s' % (artifact_name, release)
-
-    def callback(line):
-        return re.sub(pattern, replacement, line)
-
-    process_file(readme_file, callback)
-
-
-# Checks the pom.xml for the release version. <version>2.0.0-SNAPSHOT</version>
-# This method fails if the pom file has no SNAPSHOT version set ie.
-# if the version is already on a release version we fail.
-# Returns the next version string ie. 0.90.7
-def find_release_version(src_branch):
-    git_checkout(src_branch)
-    with open(POM_FILE, encoding='utf-8') as file:
-        for line in file:
-            match = re.search(r'<version>(.+)-SNAPSHOT</version>', line)
-            if match:
-                return match.group(1)
-        raise RuntimeError('Could not find release version in branch %s' % src_branch)
-
-
-# extract a value from pom.xml after a given line
-def find_from_pom(tag, first_line=None):
-    with open(POM_FILE, encoding='utf-8') as file:
-        previous_line_matched = False
-        if first_line is None:
-            previous_line_matched = True
-        for line in file:
-            if previous_line_matched:
-                match = re.search(r'<%s>(.+)</%s>' % (tag, tag), line)
-                if match:
-                    return match.group(1)
-
-            if first_line is not None:
-                match = re.search(r'%s' % first_line, line)
-                if match:
-                    previous_line_matched = True
-
-        if first_line is not None:
-            raise RuntimeError('Could not find %s in pom.xml file after %s' % (tag, first_line))
-        else:
-            raise RuntimeError('Could not find %s in pom.xml file' % tag)
+    return apply_rules(readme_file, lambda rewrite: rewrite.sub(pattern, replacement))
 
 
 # Get artifacts which have been generated in target/releases
@@ -335,18 +733,56 @@ def get_artifacts(artifact_id, release):
     return artifact_path
 
 
-# Generates sha1 for a file
+# Checksum files generated next to each artifact, ie. artifact.zip.sha1.txt
+CHECKSUM_ALGORITHMS = ['sha1', 'sha512', 'md5']
+# Size of the chunks read when computing checksums
+CHECKSUM_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+# Computes all the digests of a file reading it only once.
+# Returns the hex digests by algorithm name
+def compute_digests(file_path, algorithms=CHECKSUM_ALGORITHMS):
+    digests = [hashlib.new(algorithm) for algorithm in algorithms]
+    chunk = bytearray(CHECKSUM_CHUNK_SIZE)
+    view = memoryview(chunk)
+    with open(file_path, 'rb', buffering=0) as file:
+        size = file.readinto(chunk)
+        while size:
+            for digest in digests:
+                digest.update(view[:size])
+            size = file.readinto(chunk)
+    return dict((algorithm, digest.hexdigest()) for algorithm, digest in zip(algorithms, digests))
+
+
+# Computes the digests of several files at the same time. hashlib
+# releases the GIL while hashing so threads run on all the cores.
+# Returns the digests by file, in the given order
+def hash_artifacts(files, algorithms=CHECKSUM_ALGORITHMS):
+    with ThreadPoolExecutor(max_workers=max(1, min(len(files), os.cpu_count() or 1))) as executor:
+        return dict(zip(files, executor.map(partial(compute_digests, algorithms=algorithms), files)))
+
+
+# Writes a checksum file per digest next to the given file, using
+# the same format as shasum. Returns the checksum files.
+def write_checksum_files(release_file, digests):
+    checksum_files = []
+    for algorithm, digest in digests.items():
+        checksum_file = '%s.%s.txt' % (release_file, algorithm)
+        with open(checksum_file, 'w', encoding='utf-8') as file:
+            file.write('%s  %s\n' % (digest, os.path.basename(release_file)))
+        checksum_files.append(checksum_file)
+    return checksum_files
+
+
+# Generates sha1, sha512 and md5 checksums for the given files
 # and returns the checksum files as well
 # as the given files in a list
-def generate_checksums(release_file):
+@traced
+def generate_checksums(*release_files):
     res = []
-    directory = os.path.dirname(release_file)
-    file = os.path.basename(release_file)
-    checksum_file = '%s.sha1.txt' % file
-
-    if os.system('cd %s; shasum %s > %s' % (directory, file, checksum_file)):
-        raise RuntimeError('Failed to generate checksum for file %s' % release_file)
-    res += [os.path.join(directory, checksum_file), release_file]
+    for release_file, digests in hash_artifacts(release_files).items():
+        log('checksums of %s: %s' % (release_file, digests))
+        res += write_checksum_files(release_file, digests) + [release_file]
     return res
 
 
@@ -375,6 +811,170 @@ def format_issues_html(issues, title='Fix'):
     return response
 
 
+##########################################################
+#
+# Maven POM model
+#
+##########################################################
+# Elements read from the project and from its parent
+POM_COORDINATES = ['groupId', 'artifactId', 'version', 'packaging', 'name', 'description', 'url']
+
+# Parsed pom files by path, with the stamp of the parsed content
+pom_cache = {}
+
+
+# Model of a pom.xml file: project coordinates, parent
+# coordinates, properties and modules
+class Pom(object):
+    def __init__(self, project, parent, properties, modules):
+        self.project = project
+        self.parent = parent
+        self.properties = properties
+        self.modules = modules
+
+    # Coordinates the project inherits from its parent if not set
+    def coordinate(self, name):
+        value = self.project.get(name)
+        if value is None and name in ('groupId', 'version'):
+            value = self.parent.get(name)
+        return self.resolve(value)
+
+    @property
+    def artifact_id(self):
+        return self.coordinate('artifactId')
+
+    @property
+    def version(self):
+        return self.coordinate('version')
+
+    # Replace ${...} references with project coordinates or properties
+    def resolve(self, value, seen=()):
+        if value is None:
+            return None
+
+        def replace(match):
+            name = match.group(1)
+            if name in seen:
+                raise RuntimeError('Cyclic reference to ${%s} in pom.xml file' % name)
+            raw = self.raw_value(name)
+            return match.group(0) if raw is None else self.resolve(raw, seen + (name,))
+
+        return re.sub(r'\$\{([^}]+)\}', replace, value)
+
+    # The unresolved value of a ${name} reference
+    def raw_value(self, name):
+        for prefix in ('project.parent.', 'parent.'):
+            if name.startswith(prefix):
+                return self.parent.get(name[len(prefix):])
+        for prefix in ('project.', 'pom.'):
+            if name.startswith(prefix) and name[len(prefix):] in POM_COORDINATES:
+                return self.project.get(name[len(prefix):]) or self.parent.get(name[len(prefix):])
+        return self.properties.get(name)
+
+    # Get a project coordinate or a property, resolved. None if missing
+    def get(self, name):
+        if name in POM_COORDINATES:
+            return self.coordinate(name)
+        return self.resolve(self.properties.get(name))
+
+
+# Remove the namespace of a tag: {http://maven.apache.org/POM/4.0.0}version gives version
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+# Parse a pom.xml file with a streaming parser, only
+# keeping the elements the model needs
+def parse_pom(pom_file):
+    project, parent, properties, modules = {}, {}, {}, []
+    path = []
+    for event, element in ElementTree.iterparse(pom_file, events=('start', 'end')):
+        if event == 'start':
+            path.append(local_name(element.tag))
+            continue
+        value = ' '.join((element.text or '').split())
+        if len(path) == 2 and path[1] in POM_COORDINATES:
+            project[path[1]] = value
+        elif len(path) == 3 and path[1] == 'parent':
+            parent[path[2]] = value
+        elif len(path) == 3 and path[1] == 'properties' and len(element) == 0:
+            properties[path[2]] = value
+        elif len(path) == 3 and path[1] == 'modules':
+            modules.append(value)
+        path.pop()
+        if len(path) == 1:
+            # done with this child of project: free it
+            element.clear()
+    return Pom(project, parent, properties, modules)
+
+
+# Stamp of a file, cheap to compute: size and modification time
+def file_stamp(file_path):
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+# Get the model of a pom.xml file, POM_FILE by default. It is only parsed
+# again if its content changed since the last call.
+def read_pom(pom_file=None):
+    pom_file = abspath(pom_file or POM_FILE)
+    stamp = file_stamp(pom_file)
+    cached = pom_cache.get(pom_file)
+    if cached and cached['stamp'] == stamp:
+        return cached['pom']
+
+    with open(pom_file, 'rb') as file:
+        sha1 = hashlib.sha1(file.read()).hexdigest()
+    if not cached or cached['sha1'] != sha1:
+        cached = {'pom': parse_pom(pom_file), 'sha1': sha1}
+        pom_cache[pom_file] = cached
+    cached['stamp'] = stamp
+    return cached['pom']
+
+
+# Forget the model of a file we just rewrote
+def invalidate_pom(file_path):
+    pom_cache.pop(abspath(file_path), None)
+
+
+# Checks the pom.xml for the release version. <version>2.0.0-SNAPSHOT</version>
+# This method fails if the pom file has no SNAPSHOT version set ie.
+# if the version is already on a release version we fail.
+# Returns the next version string ie. 0.90.7
+def find_release_version(src_branch):
+    git_checkout(src_branch)
+    version = read_pom().version
+    if version and version.endswith('-SNAPSHOT'):
+        return version[:-len('-SNAPSHOT')]
+    raise RuntimeError('Could not find release version in branch %s' % src_branch)
+
+
+# extract a value (project coordinate or property) from pom.xml
+# When first_line matches the parent artifactId, the value is read from the parent.
+# Otherwise it is the first <tag> found after a line matching first_line.
+def find_from_pom(tag, first_line=None):
+    pom = read_pom()
+    if first_line is None:
+        value = pom.get(tag)
+        if value is None:
+            raise RuntimeError('Could not find %s in pom.xml file' % tag)
+        return value
+
+    parent_artifact = '<artifactId>%s</artifactId>' % pom.parent.get('artifactId')
+    if re.search(first_line, parent_artifact) and pom.parent.get(tag) is not None:
+        return pom.resolve(pom.parent.get(tag))
+    with open(POM_FILE, encoding='utf-8') as file:
+        previous_line_matched = False
+        for line in file:
+            if previous_line_matched:
+                match = re.search(r'<%s>(.+)</%s>' % (tag, tag), line)
+                if match:
+                    return match.group(1)
+            elif re.search(first_line, line):
+                previous_line_matched = True
+    raise RuntimeError('Could not find %s in pom.xml file after %s' % (tag, first_line))
+
+
 ##########################################################
 #
 # GIT commands
@@ -385,12 +985,29 @@ def get_head_hash():
     return os.popen('git rev-parse --verify HEAD 2>&1').read().strip()
 
 
+# Returns the hash of the tree of the current git HEAD revision.
+# Commits with identical files have the same tree hash.
+def get_tree_hash():
+    return os.popen('git rev-parse --verify HEAD^{tree} 2>&1').read().strip()
+
+
+# Returns the hash of the last commit of a branch
+def get_branch_hash(branch):
+    return os.popen('git rev-parse --verify %s 2>&1' % branch).read().strip()
+
+
+# Returns the hash a branch or tag points to, or '' if it does not exist
+def get_ref_hash(ref):
+    return os.popen('git rev-parse --verify --quiet %s 2>/dev/null' % ref).read().strip()
+
+
 # Returns the name of the current branch
 def get_current_branch():
     return os.popen('git rev-parse --abbrev-ref HEAD  2>&1').read().strip()
 
 
 # runs get fetch on the given remote
+@traced
 def fetch(remote):
     run('git fetch %s' % remote)
 
@@ -399,16 +1016,17 @@ def fetch(remote):
 # and rebases the source branch from the remote before creating
 # the release branch. Note: This fails if the source branch
 # doesn't exist on the provided remote.
-def create_release_branch(remote, src_branch, release):
-    git_checkout(src_branch)
-    run('git pull --rebase %s %s' % (remote, src_branch))
-    run('git checkout -b %s' % (release_branch(src_branch, release)))
+@traced
+def create_release_branch(remote, src_branch, release, cwd=None):
+    git_checkout(src_branch, cwd=cwd)
+    run('git pull --rebase %s %s' % (remote, src_branch), cwd=cwd)
+    run('git checkout -b %s' % (release_branch(src_branch, release)), cwd=cwd)
 
 
 # Stages the given files for the next git commit
-def add_pending_files(*files):
+def add_pending_files(*files, cwd=None):
     for file in files:
-        run('git add %s' % file)
+        run('git add %s' % file, cwd=cwd)
 
 
 # Executes a git commit with 'release [version]' as the commit message
@@ -417,8 +1035,8 @@ def commit_release(artifact_id, release):
 
 
 # Commit documentation changes on the master branch
-def commit_master(release):
-    run('git commit -m "update documentation with release %s"' % release)
+def commit_master(release, cwd=None):
+    run('git commit -m "update documentation with release %s"' % release, cwd=cwd)
 
 
 # Commit next snapshot files
@@ -432,23 +1050,38 @@ def tag_release(release):
 
 
 # Checkout a given branch
-def git_checkout(branch):
-    run('git checkout %s' % branch)
+def git_checkout(branch, cwd=None):
+    run('git checkout %s' % branch, cwd=cwd)
 
 
 # Merge the release branch with the actual branch
-def git_merge(src_branch, release_version):
-    git_checkout(src_branch)
-    run('git merge %s' % release_branch(src_branch, release_version))
+def git_merge(src_branch, release_version, cwd=None):
+    git_checkout(src_branch, cwd=cwd)
+    run('git merge %s' % release_branch(src_branch, release_version), cwd=cwd)
+
+
+# Creates a worktree in a new temporary directory, with
+# the given branch checked out. Returns its path.
+def add_worktree(branch):
+    path = tempfile.mkdtemp(prefix='release_worktree_')
+    run('git worktree add %s %s' % (path, branch))
+    return path
+
+
+# Removes a worktree created by add_worktree
+def remove_worktree(path):
+    run('git worktree remove --force %s' % path)
+    shutil.rmtree(path, ignore_errors=True)
 
 
-# Push the actual branch and master branch
-def git_push(remote, src_branch, release_version, dry_run):
+# Push the actual branch and master branch, unless master is False
+def git_push(remote, src_branch, release_version, dry_run, master=True):
+    branches = '%s master' % src_branch if master else src_branch
     if not dry_run:
-        run('git push %s %s master' % (remote, src_branch))  # push the commit and the master
+        run('git push %s %s' % (remote, branches))  # push the commit and the master
         run('git push %s v%s' % (remote, release_version))  # push the tag
     else:
-        print('  dryrun [True] -- skipping push to remote %s %s master' % (remote, src_branch))
+        print('  dryrun [True] -- skipping push to remote %s %s' % (remote, branches))
 
 
 ##########################################################
@@ -456,23 +1089,166 @@ def git_push(remote, src_branch, release_version, dry_run):
 # Maven commands
 #
 ##########################################################
+# Local repository of maven, the one of the maven settings if not set.
+# The releases of a matrix each get their own: maven does not support
+# builds using the same local repository at the same time.
+MAVEN_REPO_LOCAL = env.get('ES_RELEASE_MAVEN_REPO_LOCAL', None)
+# Repository the releases are deployed to, the one of the sonatype parent pom
+SONATYPE_REPOSITORY_ID = 'sonatype-nexus-staging'
+SONATYPE_STAGING_URL = env.get('SONATYPE_STAGING_URL', 'https://oss.sonatype.org/service/local/staging/deploy/maven2/')
+
+
 # Run a given maven command
 def run_mvn(*cmd):
+    repo_local = ' -Dmaven.repo.local=%s' % MAVEN_REPO_LOCAL if MAVEN_REPO_LOCAL else ''
     for c in cmd:
-        run('%s; %s -f %s %s' % (java_exe(), MVN, POM_FILE, c))
+        run('%s; %s -f %s%s %s' % (java_exe(), maven_command(), POM_FILE, repo_local, c), interruptible=True,
+            name='%s %s' % (maven_command(), c))
 
 
 # Run deploy or package depending on dry_run
 # Default to run mvn package
 # When run_tests=True a first mvn clean test is run
-def build_release(run_tests=False, dry_run=True):
+# When clean=False the classes compiled by a previous run are reused
+@traced
+def build_release(run_tests=False, dry_run=True, clean=True):
     target = 'deploy'
     tests = '-DskipTests'
     if run_tests:
         tests = ''
     if dry_run:
         target = 'package'
-    run_mvn('clean %s %s' % (target, tests))
+    if clean:
+        target = 'clean ' + target
+    run_mvn('%s %s' % (target, tests))
+
+
+# Run the test suite split over forks running in parallel. Plugins built
+# on elasticsearch-parent run their tests with the randomizedtesting
+# junit4 runner (tests.jvms), the others with surefire (forkCount).
+@traced
+def run_test_suite(forks=1):
+    run_mvn('clean test -Dtests.jvms=%d -DforkCount=%d -DreuseForks=true' % (forks, forks))
+
+
+# Deploy an artifact restored from the artifact cache as is: nothing
+# is compiled or packaged again, so sonatype gets the verified bytes.
+@traced
+def deploy_cached_build(artifact):
+    run_mvn('deploy:deploy-file -DpomFile=%s -Dfile=%s -Dpackaging=zip -DrepositoryId=%s -Durl=%s'
+            % (POM_FILE, artifact, SONATYPE_REPOSITORY_ID, SONATYPE_STAGING_URL))
+
+
+##########################################################
+#
+# Build artifact cache
+#
+##########################################################
+ARTIFACT_CACHE_DIR = os.path.join(CACHE_DIR, 'artifacts')
+# Number of builds kept in the artifact cache
+ARTIFACT_CACHE_ENTRIES = int(env.get('ES_RELEASE_ARTIFACT_CACHE_ENTRIES', '5'))
+
+
+# First line printed by java -version and mvn --version
+def tool_versions():
+    return {'java': tools()['java_version'], 'mvn': tools()['mvn_version']}
+
+
+# Key of the build of the current commit: its tree hash and the versions
+# of the JDK and of Maven. Builds with the same key give the same artifacts.
+def artifact_cache_key():
+    key = dict(tool_versions(), tree=get_tree_hash())
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Find a cached build for the given key. The cached artifact is checked
+# against its recorded digest. Builds done without tests can not be used
+# when tests are required. Returns the directory of the entry or None.
+def lookup_artifact_cache(key, artifact_name, run_tests):
+    entry = os.path.join(ARTIFACT_CACHE_DIR, key)
+    try:
+        with open(os.path.join(entry, 'manifest.json'), encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    if run_tests and not manifest['tests']:
+        log('cached build %s was done without tests' % key)
+        return None
+    artifact = os.path.join(entry, 'target', 'releases', artifact_name)
+    if not os.path.isfile(artifact) or compute_digests(artifact, ['sha1'])['sha1'] != manifest['sha1']:
+        log('cached build %s is corrupted: removing it' % key)
+        shutil.rmtree(entry, ignore_errors=True)
+        return None
+    return entry
+
+
+# Save the target directory of a build in the artifact cache
+def store_artifact_cache(key, artifact, run_tests):
+    os.makedirs(ARTIFACT_CACHE_DIR, exist_ok=True)
+    entry = os.path.join(ARTIFACT_CACHE_DIR, key)
+    tmp_entry = tempfile.mkdtemp(dir=ARTIFACT_CACHE_DIR, prefix='.%s.' % key)
+    try:
+        shutil.copytree(os.path.join(ROOT_DIR, 'target'), os.path.join(tmp_entry, 'target'), symlinks=True)
+        manifest = {'tests': run_tests, 'sha1': compute_digests(artifact, ['sha1'])['sha1'],
+                    'created': datetime.datetime.now().isoformat()}
+        with open(os.path.join(tmp_entry, 'manifest.json'), 'w', encoding='utf-8') as file:
+            json.dump(manifest, file)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.rename(tmp_entry, entry)
+    finally:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    # only keep the most recent builds
+    entries = [os.path.join(ARTIFACT_CACHE_DIR, name) for name in os.listdir(ARTIFACT_CACHE_DIR)
+               if not name.startswith('.')]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for old_entry in entries[ARTIFACT_CACHE_ENTRIES:]:
+        shutil.rmtree(old_entry, ignore_errors=True)
+
+
+# Replace the target directory with the one of a cached build
+def restore_artifact_cache(entry):
+    target = os.path.join(ROOT_DIR, 'target')
+    shutil.rmtree(target, ignore_errors=True)
+    shutil.copytree(os.path.join(entry, 'target'), target, symlinks=True)
+    # mark the entry as recently used
+    os.utime(entry)
+
+
+##########################################################
+#
+# Test result cache
+#
+##########################################################
+TEST_CACHE_DIR = os.path.join(CACHE_DIR, 'tests')
+# Number of JVMs running the test suite
+TEST_FORKS = int(env.get('ES_RELEASE_TEST_FORKS', os.cpu_count() or 1))
+
+
+# Key of a test run: the sources and the JDK running them
+def test_cache_key():
+    key = {'tree': get_tree_hash(), 'java': tool_versions()['java']}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Returns the result of a passed test run of the same sources or None
+def lookup_test_cache(key):
+    try:
+        with open(os.path.join(TEST_CACHE_DIR, key + '.json'), encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# Only passed runs are recorded: a failed suite is always run again
+def store_test_cache(key, forks, duration):
+    os.makedirs(TEST_CACHE_DIR, exist_ok=True)
+    result = {'tree': get_tree_hash(), 'java': tool_versions()['java'], 'forks': forks,
+              'duration': duration, 'passed': datetime.datetime.now().isoformat()}
+    fd, tmp_file = tempfile.mkstemp(dir=TEST_CACHE_DIR, prefix='.%s.' % key)
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+        json.dump(result, file)
+    os.replace(tmp_file, os.path.join(TEST_CACHE_DIR, key + '.json'))
 
 
 ##########################################################
@@ -480,16 +1256,106 @@ def build_release(run_tests=False, dry_run=True):
 # Amazon S3 publish commands
 #
 ##########################################################
-# Upload files to S3
+S3_BUCKET = env.get('S3_BUCKET', 'download.elasticsearch.org')
+# Use a S3 compatible server instead of Amazon S3, like http://localhost:9000
+S3_ENDPOINT = env.get('S3_ENDPOINT', None)
+S3_UPLOAD_THREADS = int(env.get('S3_UPLOAD_THREADS', '4'))
+# Number of uploads checked at the same time, with a HEAD request each
+S3_VERIFY_THREADS = int(env.get('S3_VERIFY_THREADS', '16'))
+# Files already on S3 with the same sha1 (kept in the metadata of the
+# objects) are not uploaded again
+S3_SKIP_UNCHANGED = env.get('S3_SKIP_UNCHANGED', 'true') == 'true'
+
+# upload-s3.py module, loaded on first use
+s3_tool = None
+
+
+# Load upload-s3.py in this process, so boto must be installed for this
+# interpreter. It can not be imported by name.
+def load_s3_tool():
+    global s3_tool
+    if s3_tool is None:
+        location = os.path.dirname(os.path.realpath(__file__))
+        spec = importlib.util.spec_from_file_location('upload_s3', os.path.join(location, 'upload-s3.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        s3_tool = module
+    return s3_tool
+
+
+# Digest of a file, read from the checksum file generated next to it if
+# there is one: artifacts are not hashed again
+def local_digest(file_path, algorithm):
+    checksum_file = '%s.%s.txt' % (file_path, algorithm)
+    if os.path.isfile(checksum_file):
+        with open(checksum_file, encoding='utf-8') as file:
+            return file.read().split()[0]
+    return compute_digests(file_path, [algorithm])[algorithm]
+
+
+# Upload files to S3, all at the same time over a single connection. The
+# sha1 of each file is stored with it: unless S3_SKIP_UNCHANGED is false,
+# the files already uploaded with the same sha1 are skipped.
+# Returns the upload result of each file (key, size, seconds, skipped, error)
+@traced
 def publish_artifacts(artifacts, base='elasticsearch/elasticsearch', dry_run=True):
-    location = os.path.dirname(os.path.realpath(__file__))
-    for artifact in artifacts:
-        if dry_run:
+    if dry_run:
+        for artifact in artifacts:
             print('Skip Uploading %s to Amazon S3 in %s' % (artifact, base))
+        return []
+
+    tool = load_s3_tool()
+    files = [(os.path.abspath(artifact), os.path.basename(artifact)) for artifact in artifacts]
+    digests = dict((file, local_digest(file, 'sha1')) for file, _ in files)
+    conn = tool.connect(S3_ENDPOINT)
+    try:
+        results = tool.publish(conn, base, files, S3_BUCKET, threads=S3_UPLOAD_THREADS, digests=digests,
+                               skip_unchanged=S3_SKIP_UNCHANGED)
+    finally:
+        tool.close_connection(conn)
+    for result in results:
+        if result['error']:
+            print('    FAILED uploading %s to Amazon S3: %s' % (result['file'], result['error']))
+        elif result['skipped']:
+            print('  Skipped %s: already on Amazon S3 %s/%s with the same sha1'
+                  % (result['file'], S3_BUCKET, result['key']))
         else:
-            print('Uploading %s to Amazon S3' % artifact)
-            # requires boto to be installed but it is not available on python3k yet so we use a dedicated tool
-            run('python %s/upload-s3.py --file %s --path %s' % (location, os.path.abspath(artifact), base))
+            print('  Uploaded %s to Amazon S3 %s/%s (%s bytes in %.1fs)'
+                  % (result['file'], S3_BUCKET, result['key'], result['size'], result['seconds']))
+        log('S3 upload %s' % json.dumps(result))
+    failed = [result['file'] for result in results if result['error']]
+    if failed:
+        raise RuntimeError('Failed to upload %s to Amazon S3 [see log %s]' % (', '.join(failed), LOG))
+    return results
+
+
+# Check that the uploaded files are on S3 with the size and the ETag of
+# the local files, without downloading them. Stops at the first file
+# that does not match and raises an error listing the mismatches.
+@traced
+def verify_published_artifacts(artifacts, base='elasticsearch/elasticsearch', dry_run=True):
+    if dry_run:
+        for artifact in artifacts:
+            print('Skip checking %s on Amazon S3 in %s' % (artifact, base))
+        return []
+
+    tool = load_s3_tool()
+    files = [(os.path.abspath(artifact), os.path.basename(artifact), local_digest(artifact, 'md5')) for artifact in artifacts]
+    conn = tool.connect(S3_ENDPOINT)
+    try:
+        results = tool.verify(conn, base, files, S3_BUCKET, threads=S3_VERIFY_THREADS)
+    finally:
+        tool.close_connection(conn)
+    for result in results:
+        log('S3 verify %s' % json.dumps(result))
+        if not result['error']:
+            print('  Checked %s/%s (%s bytes, ETag %s)' % (S3_BUCKET, result['key'], result['size'], result['etag']))
+    failed = [result for result in results if result['error']]
+    if failed:
+        raise RuntimeError('Uploaded files do not match the local ones:\n%s'
+                           % '\n'.join('    %s/%s: %s' % (S3_BUCKET, result['key'], result['error'])
+                                        for result in failed))
+    return results
 
 
 ##########################################################
@@ -497,24 +1363,310 @@ def publish_artifacts(artifacts, base='elasticsearch/elasticsearch', dry_run=Tru
 # Email and Github Management
 #
 ##########################################################
-# Create a Github repository instance to access issues
+# A Github repository: owner is the login of its owner
+Repository = namedtuple('Repository', ['owner', 'name', 'html_url'])
+
+
+# Get the Github repository to access issues. Moved repositories
+# are followed to their new name. The credentials are used for all the
+# requests about the repository.
+@traced
 def get_github_repository(reponame,
                           login=env.get('GITHUB_LOGIN', None),
                           password=env.get('GITHUB_PASSWORD', None),
                           key=env.get('GITHUB_KEY', None)):
-    if login:
-        g = github3.login(login, password)
-    elif key:
-        g = github3.login(token=key)
-    else:
-        g = github3.GitHub()
+    credentials = {'login': login, 'password': password, 'key': key}
+    body, _ = github_get('/repos/elastic/%s' % reponame, credentials=credentials)
+    repository = Repository(body['owner']['login'], body['name'], body['html_url'])
+    github_credentials[(repository.owner, repository.name)] = credentials
+    return repository
+
+
+##########################################################
+#
+# Github API client
+#
+##########################################################
+GITHUB_API_URL = env.get('GITHUB_API_URL', 'https://api.github.com')
+# Maximum page size allowed by the Github API
+GITHUB_PAGE_SIZE = 100
+# Number of pages fetched at the same time
+GITHUB_FETCH_THREADS = 8
+# Responses of the Github API, kept between runs. They are revalidated
+# with conditional requests, which do not count in the rate limit.
+GITHUB_CACHE_DIR = os.path.join(CACHE_DIR, 'github')
+# When the rate limit is almost reached, cached responses younger than
+# this number of seconds are used without asking Github
+GITHUB_CACHE_MAX_AGE = int(env.get('ES_RELEASE_GITHUB_CACHE_MAX_AGE', '3600'))
+# Requests kept for the rest of the release when the rate limit is low
+GITHUB_RATE_LIMIT_RESERVE = 10
+# Longest wait, in seconds, for the rate limit to be reset
+GITHUB_RATE_LIMIT_MAX_WAIT = 300
+# Headers of the responses kept in the cache
+GITHUB_CACHED_HEADERS = ['Link', 'ETag', 'Last-Modified']
+
+Issue = namedtuple('Issue', ['number', 'title', 'html_url', 'state', 'labels'])
+
+# Rate limit given by the last response of the Github API
+github_rate_limit = {'remaining': None, 'reset': None}
+github_rate_limit_lock = threading.Lock()
+
+# Credentials given to get_github_repository, by repository owner and name
+github_credentials = {}
+
+# Repositories whose issue index is already synced during this run
+synced_issue_indexes = set()
+# Download all the issues on the first sync of each index during this
+# run, dropping the issues Github does not return anymore
+RESYNC_ISSUES = False
+synced_issue_indexes_lock = threading.Lock()
+
+
+# Headers sent with each Github API request, authenticated with the
+# login / password or key of credentials. Without credentials,
+# GITHUB_LOGIN / GITHUB_PASSWORD or GITHUB_KEY are used.
+def github_headers(credentials=None):
+    if credentials is None:
+        credentials = {'login': env.get('GITHUB_LOGIN', None), 'password': env.get('GITHUB_PASSWORD', None),
+                       'key': env.get('GITHUB_KEY', None)}
+    headers = {'Accept': 'application/vnd.github.v3+json', 'User-Agent': 'elasticsearch-plugins-script'}
+    if credentials.get('login'):
+        basic = '%s:%s' % (credentials['login'], credentials.get('password') or '')
+        headers['Authorization'] = 'Basic %s' % base64.b64encode(basic.encode('utf-8')).decode('ascii')
+    elif credentials.get('key'):
+        headers['Authorization'] = 'token %s' % credentials['key']
+    return headers
+
+
+# Cached responses are kept per url and credentials: private
+# repositories are not visible anonymously
+def github_cache_file(url, headers):
+    key = hashlib.sha1(('%s %s' % (url, headers.get('Authorization', ''))).encode('utf-8')).hexdigest()
+    return os.path.join(GITHUB_CACHE_DIR, key + '.json')
+
+
+def read_github_cache(cache_file):
+    try:
+        with open(cache_file, encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_github_cache(cache_file, cached):
+    os.makedirs(GITHUB_CACHE_DIR, exist_ok=True)
+    fd, tmp_file = tempfile.mkstemp(dir=GITHUB_CACHE_DIR, prefix='.github.')
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+        json.dump(cached, file)
+    os.replace(tmp_file, cache_file)
+
+
+def update_github_rate_limit(headers):
+    if headers.get('X-RateLimit-Remaining') is not None:
+        with github_rate_limit_lock:
+            github_rate_limit['remaining'] = int(headers.get('X-RateLimit-Remaining'))
+            github_rate_limit['reset'] = int(headers.get('X-RateLimit-Reset', '0'))
+
+
+# Seconds until the rate limit is reset, if the rate limit is almost reached
+def github_rate_limit_wait():
+    with github_rate_limit_lock:
+        if github_rate_limit['remaining'] is None or github_rate_limit['remaining'] > GITHUB_RATE_LIMIT_RESERVE:
+            return 0
+        return max(1, github_rate_limit['reset'] - time.time())
+
+
+# Get a path from the Github API. Returns the decoded JSON body and the
+# headers of the response. Responses are cached and revalidated. When the
+# rate limit is almost reached, fresh enough cached responses are used as
+# is, else we wait for the rate limit to be reset if it is soon enough.
+# When the rate limit is exceeded, a cached response is used, however old.
+def github_get(path, params=None, credentials=None):
+    url = '%s%s' % (GITHUB_API_URL, path)
+    if params:
+        url += '?' + urllib.parse.urlencode(params)
+    headers = github_headers(credentials)
+    cache_file = github_cache_file(url, headers)
+    cached = read_github_cache(cache_file)
+
+    wait = github_rate_limit_wait()
+    if wait and cached and time.time() - cached['fetched'] < GITHUB_CACHE_MAX_AGE:
+        log('github rate limit almost reached: using cached %s' % url)
+        return cached['body'], cached['headers']
+    if wait and wait <= GITHUB_RATE_LIMIT_MAX_WAIT:
+        log('github rate limit almost reached: waiting %.0fs' % wait)
+        time.sleep(wait)
+
+    if cached:
+        if cached['headers'].get('ETag'):
+            headers['If-None-Match'] = cached['headers']['ETag']
+        if cached['headers'].get('Last-Modified'):
+            headers['If-Modified-Since'] = cached['headers']['Last-Modified']
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+            update_github_rate_limit(response.headers)
+            body = json.loads(response.read().decode('utf-8'))
+            cached = {'url': url, 'fetched': time.time(), 'body': body,
+                      'headers': dict((name, response.headers.get(name)) for name in GITHUB_CACHED_HEADERS
+                                      if response.headers.get(name))}
+    except urllib.error.HTTPError as e:
+        update_github_rate_limit(e.headers)
+        if e.code == 304:
+            # not modified
+            cached['fetched'] = time.time()
+        elif e.code in (403, 429) and e.headers.get('X-RateLimit-Remaining') == '0' and cached:
+            log('github rate limit exceeded: using cached %s' % url)
+            return cached['body'], cached['headers']
+        else:
+            raise
+    write_github_cache(cache_file, cached)
+    return cached['body'], cached['headers']
+
 
-    return g.repository("elastic", reponame)
+# Find the number of the last page in the Link header of
+# a paginated Github response. Returns 1 if there is only one page
+def github_last_page(headers):
+    for link in (headers.get('Link') or '').split(','):
+        match = re.search(r'[?&]page=(\d+)[^>]*>; rel="last"', link)
+        if match:
+            return int(match.group(1))
+    return 1
+
+
+##########################################################
+#
+# Github issue index
+#
+##########################################################
+# Issues of each repository are kept in a SQLite database. Only the
+# issues updated since the last sync are downloaded.
+ISSUE_INDEX_DIR = os.path.join(CACHE_DIR, 'issues')
+ISSUE_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS issues (number INTEGER PRIMARY KEY, title TEXT, html_url TEXT, state TEXT,
+                                   updated_at TEXT);
+CREATE TABLE IF NOT EXISTS labels (number INTEGER, name TEXT, PRIMARY KEY (number, name));
+CREATE TABLE IF NOT EXISTS sync (name TEXT PRIMARY KEY, value TEXT);
+CREATE INDEX IF NOT EXISTS labels_by_name ON labels (name);
+CREATE INDEX IF NOT EXISTS issues_by_state ON issues (state);
+"""
+# Version labels, like 2.5.0 or v2.5.0
+VERSION_LABEL = re.compile(r'^v?(\d+(\.\d+)+)$')
+
+
+def issue_index_file(repository):
+    return os.path.join(ISSUE_INDEX_DIR, '%s_%s.sqlite' % (repository.owner, repository.name))
+
+
+def open_issue_index(repository):
+    os.makedirs(ISSUE_INDEX_DIR, exist_ok=True)
+    db = sqlite3.connect(issue_index_file(repository), timeout=60)
+    db.executescript(ISSUE_INDEX_SCHEMA)
+    return db
+
+
+# Download the issues updated since the last sync, whatever their state
+# or labels, and store them in the index. The first page tells how many
+# pages there are, the others are fetched concurrently. Github returns the
+# issues updated at the 'since' time as well: the last ones are fetched
+# again, but none is missed. A full sync downloads all the issues and
+# removes the deleted and transferred ones from the index.
+@traced
+def sync_issue_index(repository, full=False):
+    with closing(open_issue_index(repository)) as db:
+        row = db.execute("SELECT value FROM sync WHERE name = 'since'").fetchone()
+        since = row[0] if row and not full else None
+        path = '/repos/%s/%s/issues' % (repository.owner, repository.name)
+
+        def get_page(page):
+            params = {'state': 'all', 'sort': 'updated', 'direction': 'asc', 'per_page': GITHUB_PAGE_SIZE,
+                      'page': page}
+            if since:
+                params['since'] = since
+            return github_get(path, params, github_credentials.get((repository.owner, repository.name)))
+
+        first_page, headers = get_page(1)
+        pages = [first_page]
+        with ThreadPoolExecutor(max_workers=GITHUB_FETCH_THREADS) as executor:
+            pages += [body for body, _ in executor.map(get_page, range(2, github_last_page(headers) + 1))]
+
+        issues = [issue for page in pages for issue in page]
+        with db:
+            if full:
+                db.execute('DELETE FROM issues')
+                db.execute('DELETE FROM labels')
+            for issue in issues:
+                db.execute('INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?, ?)',
+                           (issue['number'], issue['title'], issue['html_url'], issue['state'],
+                            issue.get('updated_at')))
+                db.execute('DELETE FROM labels WHERE number = ?', (issue['number'],))
+                db.executemany('INSERT OR IGNORE INTO labels VALUES (?, ?)',
+                               [(issue['number'], label['name']) for label in issue.get('labels', [])])
+            updated = [issue['updated_at'] for issue in issues if issue.get('updated_at')]
+            if updated:
+                db.execute("INSERT OR REPLACE INTO sync VALUES ('since', ?)", (max(updated),))
+        log('synced %s issues of %s/%s updated since %s in %s pages'
+            % (len(issues), repository.owner, repository.name, since or 'ever', len(pages)))
+
+
+# Issues of the index labelled with the given label, latest first
+def indexed_issues(repository, label):
+    with closing(open_issue_index(repository)) as db:
+        issues = db.execute('SELECT issues.number, title, html_url, state FROM issues'
+                            ' JOIN labels ON labels.number = issues.number'
+                            ' WHERE labels.name = ? ORDER BY issues.number DESC', (label,)).fetchall()
+        labels = {}
+        for number, name in db.execute('SELECT others.number, others.name FROM labels'
+                                       ' JOIN labels AS others ON others.number = labels.number'
+                                       ' WHERE labels.name = ?', (label,)):
+            labels.setdefault(number, []).append(name)
+    return [Issue(number, title, html_url, state, labels.get(number, []))
+            for number, title, html_url, state in issues]
+
+
+# Version labels of the index, latest version first
+def indexed_versions(repository):
+    with closing(open_issue_index(repository)) as db:
+        names = [name for name, in db.execute('SELECT DISTINCT name FROM labels')]
+    versions = [name for name in names if VERSION_LABEL.match(name)]
+    return sorted(versions, key=lambda name: [int(part) for part in VERSION_LABEL.match(name).group(1).split('.')],
+                  reverse=True)
+
+
+# Sync the issue index on first use in a run, or again if refresh is set.
+# With RESYNC_ISSUES, the first sync is a full one.
+def ensure_issue_index(repository, refresh=False):
+    key = (repository.owner, repository.name)
+    with synced_issue_indexes_lock:
+        if refresh or key not in synced_issue_indexes:
+            sync_issue_index(repository, full=RESYNC_ISSUES and key not in synced_issue_indexes)
+            synced_issue_indexes.add(key)
+
+
+# Get all issues labelled with the given version, whatever their state, from
+# the issue index.
+@traced
+def collect_issues(repository, version, refresh=False):
+    ensure_issue_index(repository, refresh)
+    return indexed_issues(repository, version)
+
+
+# Split issues in buckets, one per severity label. Only issues
+# in the given state are kept.
+def bucket_issues(issues, severities, state='closed'):
+    buckets = dict((severity, []) for severity in severities)
+    for issue in issues:
+        if issue.state != state:
+            continue
+        for severity in severities:
+            if severity in issue.labels:
+                buckets[severity].append(issue)
+    return buckets
 
 
 # Check if there are some remaining open issues and fails
+@traced
 def check_opened_issues(version, repository, reponame):
-    opened_issues = [i for i in repository.iter_issues(state='open', labels='%s' % version)]
+    opened_issues = [i for i in collect_issues(repository, version, refresh=True) if i.state == 'open']
     if len(opened_issues) > 0:
         raise NameError(
             'Some issues [%s] are still opened. Check https://github.com/elasticsearch/%s/issues?labels=%s&state=open'
@@ -526,8 +1678,24 @@ def check_opened_issues(version, repository, reponame):
 def list_issues(version,
                 repository,
                 severity='bug'):
-    issues = [i for i in repository.iter_issues(state='closed', labels='%s,%s' % (severity, version))]
-    return issues
+    return bucket_issues(collect_issues(repository, version), [severity])[severity]
+
+
+# Generate the release notes of several versions from the issue index, latest
+# version first. All the versions labelled in the index are used if none are given.
+@traced
+def generate_changelog(repository, versions=None,
+                       severities=(('bug', 'Fix'), ('update', 'Update'), ('new', 'New'), ('doc', 'Doc'))):
+    ensure_issue_index(repository)
+    versions = versions or indexed_versions(repository)
+    changelog = ''
+    for version in versions:
+        buckets = bucket_issues(indexed_issues(repository, version), [label for label, _ in severities])
+        changelog += '%s\n%s\n\n' % (version, ''.join(['=' for _ in version]))
+        for label, title in severities:
+            changelog += format_issues_plain(buckets[label], title)
+        changelog += '\n'
+    return changelog
 
 
 def read_email_template(format='html'):
@@ -538,23 +1706,31 @@ def read_email_template(format='html'):
     return data
 
 
-# Read template messages
-template_email_html = read_email_template('html')
-template_email_txt = read_email_template('txt')
+# Template messages, read on first use
+email_templates = {}
+
+
+def email_template(format='html'):
+    if format not in email_templates:
+        email_templates[format] = read_email_template(format)
+    return email_templates[format]
 
 
 # Get issues from github and generates a Plain/HTML Multipart email
+@traced
 def prepare_email(artifact_id, release_version, repository,
                   artifact_name, artifact_description, project_url,
                   severity_labels_bug='bug',
                   severity_labels_update='update',
                   severity_labels_new='new',
                   severity_labels_doc='doc'):
-    ## Get bugs from github
-    issues_bug = list_issues(release_version, repository, severity=severity_labels_bug)
-    issues_update = list_issues(release_version, repository, severity=severity_labels_update)
-    issues_new = list_issues(release_version, repository, severity=severity_labels_new)
-    issues_doc = list_issues(release_version, repository, severity=severity_labels_doc)
+    ## Get bugs from github: all issues of the version are collected at once
+    buckets = bucket_issues(collect_issues(repository, release_version),
+                            [severity_labels_bug, severity_labels_update, severity_labels_new, severity_labels_doc])
+    issues_bug = buckets[severity_labels_bug]
+    issues_update = buckets[severity_labels_update]
+    issues_new = buckets[severity_labels_new]
+    issues_doc = buckets[severity_labels_doc]
 
     ## Format content to plain text
     plain_issues_bug = format_issues_plain(issues_bug, 'Fix')
@@ -578,27 +1754,27 @@ def prepare_email(artifact_id, release_version, repository,
 
     msg = MIMEMultipart('alternative')
     msg['Subject'] = '[ANN] %s %s released' % (artifact_name, release_version)
-    text = template_email_txt % {'release_version': release_version,
-                                 'artifact_id': artifact_id,
-                                 'artifact_name': artifact_name,
-                                 'artifact_description': artifact_description,
-                                 'project_url': project_url,
-                                 'empty_message': plain_empty_message,
-                                 'issues_bug': plain_issues_bug,
-                                 'issues_update': plain_issues_update,
-                                 'issues_new': plain_issues_new,
-                                 'issues_doc': plain_issues_doc}
-
-    html = template_email_html % {'release_version': release_version,
-                                  'artifact_id': artifact_id,
-                                  'artifact_name': artifact_name,
-                                  'artifact_description': artifact_description,
-                                  'project_url': project_url,
-                                  'empty_message': html_empty_message,
-                                  'issues_bug': html_issues_bug,
-                                  'issues_update': html_issues_update,
-                                  'issues_new': html_issues_new,
-                                  'issues_doc': html_issues_doc}
+    text = email_template('txt') % {'release_version': release_version,
+                                    'artifact_id': artifact_id,
+                                    'artifact_name': artifact_name,
+                                    'artifact_description': artifact_description,
+                                    'project_url': project_url,
+                                    'empty_message': plain_empty_message,
+                                    'issues_bug': plain_issues_bug,
+                                    'issues_update': plain_issues_update,
+                                    'issues_new': plain_issues_new,
+                                    'issues_doc': plain_issues_doc}
+
+    html = email_template('html') % {'release_version': release_version,
+                                     'artifact_id': artifact_id,
+                                     'artifact_name': artifact_name,
+                                     'artifact_description': artifact_description,
+                                     'project_url': project_url,
+                                     'empty_message': html_empty_message,
+                                     'issues_bug': html_issues_bug,
+                                     'issues_update': html_issues_update,
+                                     'issues_new': html_issues_new,
+                                     'issues_doc': html_issues_doc}
 
     # Record the MIME types of both parts - text/plain and text/html.
     part1 = MIMEText(text, 'plain')
@@ -613,24 +1789,183 @@ def prepare_email(artifact_id, release_version, repository,
     return msg
 
 
+# The message is serialized once: the same bytes are saved on disk,
+# printed in dry run mode and sent to each recipient
+@traced
 def send_email(msg,
                dry_run=True,
                mail=True,
                sender=env.get('MAIL_SENDER'),
-               to=env.get('MAIL_TO', 'discuss%2Bannouncements@elastic.co'),
-               smtp_server=env.get('SMTP_SERVER', 'localhost')):
+               to=env.get('MAIL_TO', 'discuss%2Bannouncements@elastic.co')):
+    recipients = mail_recipients(to)
     msg['From'] = 'Elasticsearch Team <%s>' % sender
-    msg['To'] = 'Elasticsearch Announcement List <%s>' % to
+    # each recipient gets a copy addressed to it only, see dispatch_emails
+    msg['To'] = ', '.join(list_address(recipient) for recipient in recipients)
+    data = msg.as_bytes()
     # save mail on disk
-    with open(ROOT_DIR + '/target/email.txt', 'w') as email_file:
-        email_file.write(msg.as_string())
+    with open(ROOT_DIR + '/target/email.txt', 'wb') as email_file:
+        email_file.write(data)
     if mail and not dry_run:
-        s = smtplib.SMTP(smtp_server, 25)
-        s.sendmail(sender, to, msg.as_string())
-        s.quit()
+        dispatch_emails([data], recipients, sender)
     else:
         print('generated email: open %s/target/email.txt' % ROOT_DIR)
-        print(msg.as_string())
+        print(data.decode('utf-8'))
+
+
+##########################################################
+#
+# Announcement dispatcher
+#
+##########################################################
+SMTP_SERVER = env.get('SMTP_SERVER', 'localhost')
+SMTP_PORT = int(env.get('SMTP_PORT', '25'))
+# Optional authentication, and STARTTLS
+SMTP_USER = env.get('SMTP_USER', None)
+SMTP_PASSWORD = env.get('SMTP_PASSWORD', None)
+SMTP_STARTTLS = env.get('SMTP_STARTTLS', 'false') == 'true'
+SMTP_TIMEOUT = 60
+# Attempts to deliver a message to a recipient, and seconds waited
+# before the first retry, doubled for each other one
+SMTP_ATTEMPTS = 3
+SMTP_RETRY_DELAY = 2
+
+
+# MAIL_TO can list several recipients, separated by commas
+def mail_recipients(to):
+    return [recipient.strip() for recipient in to.split(',') if recipient.strip()]
+
+
+# Address of a recipient in the To header
+def list_address(recipient):
+    return 'Elasticsearch Announcement List <%s>' % recipient
+
+
+# A serialized message without its To header, parsed and serialized once
+# for all the recipients: see addressed_to
+def without_to(data):
+    message = message_from_bytes(data)
+    del message['To']
+    return message.as_bytes()
+
+
+# A message serialized by without_to, with a To header set to the given recipient only
+def addressed_to(data, recipient):
+    return ('To: %s\n' % list_address(recipient)).encode('utf-8') + data
+
+
+# Lost connections and network errors: SMTP errors are OSErrors as well
+def is_connection_error(error):
+    return isinstance(error, smtplib.SMTPServerDisconnected) or not isinstance(error, smtplib.SMTPException)
+
+
+# Errors worth retrying: lost connections and 4xx answers of the server
+def is_transient_smtp_error(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return is_connection_error(error)
+
+
+# Sends serialized messages over a single SMTP connection, opened on first
+# use and opened again if lost. Each message is sent to each recipient on
+# its own, so a refused recipient does not prevent the others to get it.
+# Settings not given are the SMTP_* ones.
+class MailDispatcher:
+    def __init__(self, sender, server=None, port=None, user=None, password=None, starttls=None, attempts=None,
+                 retry_delay=None):
+        self.sender = sender
+        self.server = server or SMTP_SERVER
+        self.port = port or SMTP_PORT
+        self.user = user or SMTP_USER
+        self.password = password or SMTP_PASSWORD
+        self.starttls = SMTP_STARTTLS if starttls is None else starttls
+        self.attempts = attempts or SMTP_ATTEMPTS
+        self.retry_delay = SMTP_RETRY_DELAY if retry_delay is None else retry_delay
+        self.smtp = None
+        self.connections = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def connect(self):
+        if self.smtp is None:
+            smtp = smtplib.SMTP(self.server, self.port, timeout=SMTP_TIMEOUT)
+            try:
+                if self.starttls:
+                    smtp.starttls()
+                if self.user:
+                    smtp.login(self.user, self.password or '')
+            except BaseException:
+                smtp.close()
+                raise
+            self.smtp = smtp
+            self.connections += 1
+            log('connected to smtp server %s:%s' % (self.server, self.port))
+        return self.smtp
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except smtplib.SMTPException:
+                self.smtp.close()
+            self.smtp = None
+
+    # Send data to a recipient. Returns the result of the delivery: its
+    # duration, number of attempts and the error that made it fail if any.
+    def send(self, data, recipient):
+        result = {'recipient': recipient, 'attempts': 0, 'error': None}
+        start = time.time()
+        while True:
+            result['attempts'] += 1
+            try:
+                self.connect().sendmail(self.sender, [recipient], data)
+                break
+            except OSError as e:
+                if is_connection_error(e) and self.smtp is not None:
+                    self.smtp.close()
+                    self.smtp = None
+                elif self.smtp is not None:
+                    try:
+                        self.smtp.rset()
+                    except OSError:
+                        self.smtp.close()
+                        self.smtp = None
+                if result['attempts'] >= self.attempts or not is_transient_smtp_error(e):
+                    result['error'] = '%s: %s' % (type(e).__name__, e)
+                    break
+                delay = self.retry_delay * 2 ** (result['attempts'] - 1)
+                log('sending email to %s failed (%s): retrying in %ss' % (recipient, e, delay))
+                time.sleep(delay)
+        result['seconds'] = time.time() - start
+        return result
+
+
+# Send serialized messages to all recipients over one connection, each
+# copy addressed to its recipient. Prints and logs each delivery. Raises
+# a RuntimeError if one failed.
+def dispatch_emails(messages, recipients, sender):
+    results = []
+    with MailDispatcher(sender) as dispatcher:
+        for data in messages:
+            data = without_to(data)
+            for recipient in recipients:
+                result = dispatcher.send(addressed_to(data, recipient), recipient)
+                if result['error']:
+                    print('    FAILED sending email to %s: %s' % (recipient, result['error']))
+                else:
+                    print('  Sent email to %s in %.1fs (%s attempts)' % (recipient, result['seconds'],
+                                                                      result['attempts']))
+                log('email delivery %s' % json.dumps(result))
+                results.append(result)
+    failed = [result['recipient'] for result in results if result['error']]
+    if failed:
+        raise RuntimeError('Failed to send email to %s [see log %s]' % (', '.join(sorted(set(failed))), LOG))
+    return results
 
 
 def print_sonatype_notice():
@@ -683,59 +2018,721 @@ def check_email_settings():
 
 def check_command_exists(name, cmd):
     try:
-        print('%s' % cmd)
         subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT)
     except subprocess.CalledProcessError:
         raise RuntimeError('Could not run command %s - please make sure it is installed' % (name))
 
 
-def run_and_print(text, run_function):
+def check_env_var(env_var):
+    if env_var not in env:
+        raise RuntimeError('Could not find "%s" in the env variables' % env_var)
+
+
+# A check of the environment. Its function raises a RuntimeError if the
+# check fails. Its result is cached until PATH, JAVA_HOME or one of its
+# binaries change, unless binaries is None.
+Probe = namedtuple('Probe', ['name', 'text', 'function', 'binaries'])
+# Number of checks run at the same time
+CHECK_THREADS = 8
+
+
+def probe(name, text, function, binaries=None):
+    return Probe(name, text, function, binaries)
+
+
+# Paths of the given commands found in the PATH
+def which(*commands):
+    return [shutil.which(command) for command in commands]
+
+
+# Path of the given python module, if installed
+def module_path(name):
+    spec = importlib.util.find_spec(name)
+    return spec.origin if spec is not None else None
+
+
+# boto is needed by this interpreter: upload-s3.py is loaded in this process
+def check_boto():
+    if importlib.util.find_spec('boto') is None:
+        raise RuntimeError('boto is not installed for %s' % sys.executable)
+
+
+# Run a check, or get its cached result. Only passed checks are cached.
+def run_probe(probe):
+    start = time.time()
+    checked = []
+
+    def check():
+        checked.append(probe.name)
+        probe.function()
+        return {'ok': True, 'error': None}
+
     try:
-        print(text, end='')
-        run_function()
-        print(OKGREEN + 'OK' + ENDC)
+        if probe.binaries is None:
+            result = check()
+        else:
+            result = cached_detection('check_%s' % probe.name, probe.binaries, check)
+    except RuntimeError as e:
+        result = {'ok': False, 'error': str(e)}
+    return dict(result, name=probe.name, cached=not checked, seconds=time.time() - start)
+
+
+def environment_probes():
+    java = os.path.join(env.get('JAVA_HOME', ''), 'bin', 'java')
+    return [
+        probe('aws_secret_access_key', 'Checking for AWS env configuration AWS_SECRET_ACCESS_KEY_ID...     ',
+              partial(check_env_var, 'AWS_SECRET_ACCESS_KEY')),
+        probe('aws_access_key_id', 'Checking for AWS env configuration AWS_ACCESS_KEY_ID...            ',
+              partial(check_env_var, 'AWS_ACCESS_KEY_ID')),
+        # probe('sonatype_username', 'Checking for SONATYPE env configuration SONATYPE_USERNAME...       ',
+        #       partial(check_env_var, 'SONATYPE_USERNAME')),
+        # probe('gpg_key_id', 'Checking for GPG env configuration GPG_KEY_ID...                   ',
+        #       partial(check_env_var, 'GPG_KEY_ID')),
+        probe('gpg', 'Checking command: gpg...            ',
+              partial(check_command_exists, 'gpg', 'gpg --version'), which('gpg')),
+        probe('expect', 'Checking command: expect...         ',
+              partial(check_command_exists, 'expect', 'expect -v'), which('expect')),
+        probe('s3cmd', 'Checking command: s3cmd...          ',
+              partial(check_command_exists, 's3cmd', 's3cmd --version'), which('s3cmd')),
+        probe('python_boto', 'Testing python3 boto dependency...  ',
+              check_boto, [sys.executable, module_path('boto')]),
+        probe('java_version', 'Checking java version...            ',
+              partial(verify_java_version, '1.7'), [java]),
+        probe('mvn_java_version', 'Checking java mvn version...        ',
+              lambda: verify_mvn_java_version('1.7', maven_command()), which('mvn3', 'mvn') + [java]),
+    ]
+
+
+# Run the checks at the same time and print their results in order.
+# Returns their results, ie. to write a report.
+def check_environment_and_commandline_tools():
+    probes = environment_probes()
+    results = []
+    with ThreadPoolExecutor(max_workers=CHECK_THREADS) as executor:
+        for check, result in zip(probes, executor.map(run_probe, probes)):
+            status = OKGREEN + 'OK' + ENDC if result['ok'] else FAIL + 'NOT OK' + ENDC
+            print('%s%s%s' % (check.text, status, ' (cached)' if result['cached'] else ''))
+            results.append(result)
+    return results
+
+
+##########################################################
+#
+# Release pipeline
+#
+##########################################################
+# A step of the release. It starts once all the steps it depends on are
+# done, and never runs at the same time as another step needing one of
+# its resources. The function of the step gets the release context.
+Step = namedtuple('Step', ['name', 'function', 'depends', 'resources'])
+# Resource of the steps changing the git working tree
+WORKING_TREE = 'working_tree'
+# Resource of the steps changing the master worktree (worktree mode)
+MASTER_WORKTREE = 'master_worktree'
+# Steps changing the master branch
+MASTER_STEPS = ('master_documentation', 'merge_master')
+
+
+def step(name, function, depends=(), resources=()):
+    return Step(name, function, tuple(depends), tuple(resources))
+
+
+# Run a step in the thread of the scheduler
+def run_step(step, context):
+    log_thread_phase.phase = step.name
+    log_record('phase')
+    try:
+        with span(step.name, 'step'):
+            step.function(context)
+    finally:
+        flush_log()
+        del log_thread_phase.phase
+
+
+# Run the steps of the release, each one as soon as its dependencies are
+# done and its resources are free: independent steps run at the same time.
+# If a step fails no other step is started, the interruptible commands
+# are stopped and the error of the step is raised once the running steps
+# are done. Steps in done (ie. by a previous run) are skipped, and
+# on_step_done is called with the names of the steps done after each
+# step. Returns the names of the steps done.
+def run_pipeline(steps, context, workers=4, done=(), on_step_done=None):
+    names = set(s.name for s in steps)
+    for s in steps:
+        missing = [name for name in s.depends if name not in names]
+        if missing:
+            raise RuntimeError('Step %s depends on unknown steps %s' % (s.name, missing))
+
+    done = set(done)
+    pending = [s for s in steps if s.name not in done]
+    running = {}
+    busy = set()
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            if not errors:
+                for s in list(pending):
+                    if all(name in done for name in s.depends) and not busy.intersection(s.resources):
+                        pending.remove(s)
+                        busy.update(s.resources)
+                        running[executor.submit(run_step, s, context)] = s
+            if not running:
+                if not errors:
+                    raise RuntimeError('Steps %s can not run: cyclic dependencies' % [s.name for s in pending])
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                s = running.pop(future)
+                busy.difference_update(s.resources)
+                try:
+                    future.result()
+                    done.add(s.name)
+                    log('step %s done' % s.name)
+                    if on_step_done is not None:
+                        on_step_done(done)
+                except BaseException as e:
+                    log('step %s failed: %s' % (s.name, e))
+                    if not errors:
+                        interrupt_commands()
+                    errors.append(e)
+    if errors:
+        raise errors[0]
+    return done
+
+
+# Commit the release version in the version release branch
+def step_release_commit(context):
+    pending_files = [POM_FILE, README_FILE]
+    remove_maven_snapshot(POM_FILE, context['release_version'])
+    update_documentation_in_released_branch(README_FILE, context['release_version'],
+                                            context['elasticsearch_version'])
+    print('  Done removing snapshot version')
+    add_pending_files(*pending_files)  # expects var args use * to expand
+    commit_release(context['artifact_id'], context['release_version'])
+    print('  Committed release version [%s]' % context['release_version'])
+    print(''.join(['-' for _ in range(80)]))
+    print('Building Release candidate')
+    ask('Press Enter to continue...')
+
+
+def step_github(context):
+    context['repository'] = get_github_repository(context['artifact_id'])
+
+
+def step_open_issues(context):
+    print('  Checking github issues')
+    check_opened_issues(context['release_version'], context['repository'], context['artifact_id'])
+
+
+# Run the tests before building, unless the same sources already
+# passed them with the same JDK.
+def step_test(context):
+    context['tests_compiled'] = False
+    if not context['run_tests']:
+        return
+    key = test_cache_key()
+    passed = lookup_test_cache(key)
+    if passed is not None:
+        print('  Tests already passed on this tree at %s: skipping them' % passed['passed'])
+        return
+    print('  Running tests in %d forks' % TEST_FORKS)
+    start = time.time()
+    run_test_suite(TEST_FORKS)
+    store_test_cache(key, TEST_FORKS, time.time() - start)
+    context['tests_compiled'] = True
+
+
+# Build the release, or reuse the build of a previous run (usually the
+# dry run) of the same sources with the same JDK and Maven.
+def step_build(context):
+    key = artifact_cache_key()
+    artifact_name = '%s-%s.zip' % (context['artifact_id'], context['release_version'])
+    entry = lookup_artifact_cache(key, artifact_name, context['run_tests'])
+    if entry is None:
+        if not context['dry_run']:
+            print('  Running maven builds now and publish to sonatype - run-tests [%s]' % context['run_tests'])
+        else:
+            print('  Running maven builds now run-tests [%s]' % context['run_tests'])
+        # tests already passed in the test step
+        build_release(dry_run=context['dry_run'], clean=not context['tests_compiled'])
+        context['artifact'] = get_artifacts(context['artifact_id'], context['release_version'])
+        store_artifact_cache(key, context['artifact'], context['run_tests'])
+        return
+
+    print('  Reusing verified build %s' % key)
+    restore_artifact_cache(entry)
+    context['artifact'] = get_artifacts(context['artifact_id'], context['release_version'])
+    if not context['dry_run']:
+        print('  Publishing cached build to sonatype')
+        deploy_cached_build(context['artifact'])
+
+
+def step_checksums(context):
+    context['artifact_and_checksums'] = generate_checksums(context['artifact'])
+
+
+# Update the documentation in the master release branch. In worktree
+# mode it is checked out in its own worktree, else in the working tree.
+def step_master_documentation(context):
+    worktree = context.get('master_worktree')
+    if worktree is None:
+        git_checkout(release_branch('master', context['release_version']))
+    readme = FileRewrite(os.path.join(worktree or ROOT_DIR, 'README.md'))
+    update_documentation_to_released_version(readme, context['project_url'], context['release_version'],
+                                             context['src_branch'], context['elasticsearch_version'])
+    set_install_instructions(readme, context['artifact_id'], context['release_version'])
+    readme.commit()
+    add_pending_files('pom.xml', 'README.md', cwd=worktree or ROOT_DIR)
+    commit_master(context['release_version'], cwd=worktree)
+
+
+def step_confirm(context):
+    print(''.join(['-' for _ in range(80)]))
+    print('Finish Release -- dry_run: %s' % context['dry_run'])
+    ask('Press Enter to continue...')
+
+
+def step_merge_release(context):
+    print('  merge release branch')
+    git_merge(context['src_branch'], context['release_version'])
+    print('  tag')
+    tag_release(context['release_version'])
+
+
+def step_next_snapshot(context):
+    add_maven_snapshot(POM_FILE, context['release_version'], context['snapshot_version'])
+    update_documentation_in_released_branch(README_FILE, '%s-SNAPSHOT' % context['snapshot_version'],
+                                            context['elasticsearch_version'])
+    add_pending_files(POM_FILE, README_FILE)
+    commit_snapshot()
+
+
+def step_merge_master(context):
+    print('  merge master branch')
+    git_merge('master', context['release_version'], cwd=context.get('master_worktree'))
+
+
+def step_push(context):
+    print('  push to %s %s -- dry_run: %s' % (context['remote'], context['src_branch'], context['dry_run']))
+    git_push(context['remote'], context['src_branch'], context['release_version'], context['dry_run'],
+             master=not context.get('skip_master'))
+
+
+def step_publish(context):
+    print('  publish artifacts to S3 -- dry_run: %s' % context['dry_run'])
+    publish_artifacts(context['artifact_and_checksums'], base='elasticsearch/%s' % context['artifact_id'],
+                      dry_run=context['dry_run'])
+
+
+def step_verify(context):
+    print('  check artifacts on S3 -- dry_run: %s' % context['dry_run'])
+    verify_published_artifacts(context['artifact_and_checksums'], base='elasticsearch/%s' % context['artifact_id'],
+                               dry_run=context['dry_run'])
+
+
+def step_prepare_email(context):
+    print('  preparing email (from github issues)')
+    context['email'] = prepare_email(context['artifact_id'], context['release_version'], context['repository'],
+                                     context['artifact_name'], context['artifact_description'],
+                                     context['project_url'])
+
+
+def step_send_email(context):
+    ask('Press Enter to send email...')
+    print('  sending email -- dry_run: %s, mail: %s' % (context['dry_run'], context['mail']))
+    send_email(context['email'], dry_run=context['dry_run'], mail=context['mail'])
+
+
+# The steps of a release. Steps changing the working tree run one after
+# the other, while the GitHub checks, checksums and S3 upload run as soon
+# as what they need is there. Artifacts are only published once the
+# release is pushed, so a failed push never leaves them on S3. In worktree mode, the master branch is
+# updated in its own worktree, at the same time as the build, its git commands
+# taking turns with those of the working tree (see GIT_LOCK_FILE). With
+# skip_master, the master branch is left to the caller.
+def release_steps(worktree=False, skip_master=False):
+    if worktree:
+        master_documentation = step('master_documentation', step_master_documentation, resources=[MASTER_WORKTREE])
+        merge_master = step('merge_master', step_merge_master, depends=['confirm'], resources=[MASTER_WORKTREE])
+    else:
+        master_documentation = step('master_documentation', step_master_documentation, depends=['build'],
+                                    resources=[WORKING_TREE])
+        merge_master = step('merge_master', step_merge_master, depends=['next_snapshot'], resources=[WORKING_TREE])
+    steps = [
+        step('release_commit', step_release_commit, resources=[WORKING_TREE]),
+        step('github', step_github),
+        step('open_issues', step_open_issues, depends=['github']),
+        step('test', step_test, depends=['release_commit'], resources=[WORKING_TREE]),
+        step('build', step_build, depends=['test'], resources=[WORKING_TREE]),
+        step('checksums', step_checksums, depends=['build']),
+        master_documentation,
+        step('confirm', step_confirm, depends=['build', 'master_documentation', 'open_issues']),
+        step('merge_release', step_merge_release, depends=['confirm'], resources=[WORKING_TREE]),
+        step('next_snapshot', step_next_snapshot, depends=['merge_release'], resources=[WORKING_TREE]),
+        merge_master,
+        step('push', step_push, depends=['next_snapshot', 'merge_master']),
+        step('publish', step_publish, depends=['checksums', 'push']),
+        step('prepare_email', step_prepare_email, depends=['github', 'open_issues']),
+        step('verify', step_verify, depends=['publish']),
+        step('send_email', step_send_email, depends=['prepare_email', 'push', 'verify']),
+    ]
+    if skip_master:
+        steps = [s._replace(depends=tuple(name for name in s.depends if name not in MASTER_STEPS))
+                 for s in steps if s.name not in MASTER_STEPS]
+    return steps
+
+
+##########################################################
+#
+# Release journal
+#
+##########################################################
+# Steps run again when resuming a release: their results (the github
+# repository, the email) can not be saved in the journal
+RESUME_RERUN_STEPS = ('github', 'prepare_email')
+
+
+# The git directory of ROOT_DIR. Each worktree has its own.
+def git_dir():
+    path = os.popen('git -C %s rev-parse --absolute-git-dir 2>/dev/null' % ROOT_DIR).read().strip()
+    return path or os.path.join(ROOT_DIR, '.git')
+
+
+# The journal is kept in the git directory of ROOT_DIR so it is never committed
+def journal_file():
+    return os.path.join(git_dir(), 'release_journal.json')
+
+
+# Returns the journal of the release in progress or None
+def load_journal():
+    try:
+        with open(journal_file(), encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def remove_journal():
+    try:
+        os.remove(journal_file())
+    except FileNotFoundError:
+        pass
+
+
+# Branches and tag changed by the release
+def journal_refs(context):
+    release_version = context['release_version']
+    refs = [context['src_branch'], release_branch(context['src_branch'], release_version),
+            'refs/tags/v%s' % release_version]
+    if not context.get('skip_master'):
+        refs += ['master', release_branch('master', release_version)]
+    return refs
+
+
+# Artifacts built by the release
+def journal_artifacts(context):
+    if 'artifact_and_checksums' in context:
+        return context['artifact_and_checksums']
+    if 'artifact' in context:
+        return [context['artifact']]
+    return []
+
+
+# Save the steps done, the release context and the state of the repository:
+# hashes of the release refs, branch checked out and digests of the artifacts
+def save_journal(journal, context, done):
+    saved_context = {}
+    # steps still running may add to the context
+    for key, value in list(context.items()):
+        if hasattr(value, '_asdict'):
+            # namedtuples, like the github repository, are saved by field name
+            value = value._asdict()
+        try:
+            json.dumps(value)
+            saved_context[key] = value
+        except TypeError:
+            pass
+    journal.update(steps=sorted(done), context=saved_context, head=get_current_branch(),
+                   refs=dict((ref, get_ref_hash(ref)) for ref in journal_refs(context)),
+                   artifacts=dict((file, compute_digests(file, ['sha1'])['sha1'])
+                                  for file in journal_artifacts(context)))
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(journal_file()), prefix='.release_journal.')
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+        json.dump(journal, file, indent=2)
+    os.replace(tmp_file, journal_file())
+    log('journal saved: steps %s' % sorted(done))
+
+
+# Check that the repository and the artifacts are still in the state
+# recorded by the journal
+def check_journal(journal):
+    context = journal['context']
+    for ref, ref_hash in journal['refs'].items():
+        if get_ref_hash(ref) != ref_hash:
+            raise RuntimeError('%s changed since the release stopped: expected [%s] but was [%s]'
+                               % (ref, ref_hash, get_ref_hash(ref)))
+    for file, sha1 in journal['artifacts'].items():
+        if not os.path.isfile(file) or compute_digests(file, ['sha1'])['sha1'] != sha1:
+            raise RuntimeError('Artifact %s changed since the release stopped' % file)
+    master_worktree = context.get('master_worktree')
+    if master_worktree and not os.path.isdir(master_worktree):
+        raise RuntimeError('Worktree %s was removed since the release stopped' % master_worktree)
+
+
+# Reset the branches to their state before the release and delete its tag
+def rollback_release(journal):
+    context = journal['context']
+    master_worktree = context.get('master_worktree')
+    if master_worktree and not os.path.isdir(master_worktree):
+        run('git worktree prune')
+        master_worktree = None
+    if not context.get('skip_master'):
+        git_checkout('master', cwd=master_worktree)
+        run('git reset --hard %s' % journal['master_hash'], cwd=master_worktree)
+    git_checkout(context['src_branch'])
+    run('git reset --hard %s' % journal['version_hash'])
+    try:
+        run('git tag -d v%s' % context['release_version'])
     except RuntimeError:
-        print(FAIL + 'NOT OK' + ENDC)
+        pass
+
+
+# Delete the worktree and the release branches, then checkout the branch
+# the release started from
+def cleanup_release(journal):
+    context = journal['context']
+    master_worktree = context.get('master_worktree')
+    if master_worktree:
+        if os.path.isdir(master_worktree):
+            remove_worktree(master_worktree)
+        else:
+            run('git worktree prune')
 
-def check_env_var(text, env_var):
+    # we delete this one anyways
+    if not context.get('skip_master'):
+        run('git branch -D %s' % (release_branch('master', context['release_version'])))
+    run('git branch -D %s' % (release_branch(context['src_branch'], context['release_version'])))
+
+    # Checkout the branch we started from
+    git_checkout(context['src_branch'])
+
+
+##########################################################
+#
+# Batch releases
+#
+##########################################################
+# Release processes running at the same time by default: each one runs
+# Maven builds using several cores already
+BATCH_WORKERS = min(2, os.cpu_count() or 1)
+
+
+# Build the arguments given to each release process of a batch
+def batch_release_args(branch, remote, run_tests, dry_run, resync_issues=False):
+    release_args = ['--remote', remote, '--non_interactive']
+    if branch:
+        release_args += ['--branch', branch]
+    if resync_issues:
+        release_args.append('--resync_issues')
+    if not run_tests:
+        release_args.append('--skiptests')
+    if not dry_run:
+        release_args.append('--publish')
+    # the emails of the releases are sent at the end of the batch
+    release_args.append('--disable_mail')
+    return release_args
+
+
+# Release one repository in its own process. Logs, console output and
+# result of the release are written next to the main LOG file, named
+# after the repository directory (unless a name is given) and a hash of
+# its path: checkouts in directories of the same name get their own files.
+# extra_env is added to the environment of the process.
+def release_repository(repository, release_args, name=None, extra_env=None):
+    root_dir = abspath(repository)
+    name = name or os.path.basename(root_dir)
+    path_hash = hashlib.sha1(root_dir.encode('utf-8')).hexdigest()[:8]
+    prefix = '%s-%s-%s' % (os.path.splitext(LOG)[0], re.sub(r'[^\w.-]', '_', name), path_hash)
+    result_file = prefix + '.json'
+    output_file = prefix + '.out'
     try:
-        print(text, end='')
-        env[env_var]
-        print(OKGREEN + 'OK' + ENDC)
-    except KeyError:
-        print(FAIL + 'NOT OK' + ENDC)
+        os.remove(result_file)
+    except FileNotFoundError:
+        pass
 
+    child_env = dict(env, **(extra_env or {}))
+    child_env['ES_RELEASE_ROOT_DIR'] = root_dir
+    child_env['ES_RELEASE_LOG'] = prefix + '.log'
+    command = [sys.executable, os.path.realpath(__file__)] + release_args + ['--result_file', result_file]
+    start = time.time()
+    with open(output_file, 'w', encoding='utf-8') as output:
+        exit_code = subprocess.call(command, cwd=root_dir, env=child_env, stdin=subprocess.DEVNULL,
+                                    stdout=output, stderr=subprocess.STDOUT)
+    result = {'repository': name, 'root_dir': root_dir, 'exit_code': exit_code, 'duration': time.time() - start,
+              'output': output_file, 'log': child_env['ES_RELEASE_LOG']}
+    if os.path.isfile(result_file):
+        with open(result_file, encoding='utf-8') as file:
+            result.update(json.load(file))
+    return result
+
+
+# Print a summary table of a batch release
+def print_batch_summary(results):
+    print(''.join(['-' for _ in range(80)]))
+    line = '%-35s %-15s %s %6s  %s'
+    print(line % ('Repository', 'Version', 'Status', 'Time', 'Output'))
+    for result in results:
+        status = OKGREEN + 'OK    ' + ENDC if result['exit_code'] == 0 else FAIL + 'FAILED' + ENDC
+        print(line % (result['repository'], result.get('release_version', '?'), status,
+                      '%.0fs' % result['duration'], result['output']))
+    print(''.join(['-' for _ in range(80)]))
 
-def check_environment_and_commandline_tools():
-    check_env_var('Checking for AWS env configuration AWS_SECRET_ACCESS_KEY_ID...     ', 'AWS_SECRET_ACCESS_KEY')
-    check_env_var('Checking for AWS env configuration AWS_ACCESS_KEY_ID...            ', 'AWS_ACCESS_KEY_ID')
-    # check_env_var('Checking for SONATYPE env configuration SONATYPE_USERNAME...       ', 'SONATYPE_USERNAME')
-    # check_env_var('Checking for SONATYPE env configuration SONATYPE_PASSWORD...       ', 'SONATYPE_PASSWORD')
-    # check_env_var('Checking for GPG env configuration GPG_KEY_ID...                   ', 'GPG_KEY_ID')
-    # check_env_var('Checking for GPG env configuration GPG_PASSPHRASE...               ', 'GPG_PASSPHRASE')
-    # check_env_var('Checking for S3 repo upload env configuration S3_BUCKET_SYNC_TO... ', 'S3_BUCKET_SYNC_TO')
-    # check_env_var('Checking for git env configuration GIT_AUTHOR_NAME...              ', 'GIT_AUTHOR_NAME')
-    # check_env_var('Checking for git env configuration GIT_AUTHOR_EMAIL...             ', 'GIT_AUTHOR_EMAIL')
-
-    run_and_print('Checking command: gpg...            ', partial(check_command_exists, 'gpg', 'gpg --version'))
-    run_and_print('Checking command: expect...         ', partial(check_command_exists, 'expect', 'expect -v'))
-    # run_and_print('Checking c
-    # ommand: createrepo...     ', partial(check_command_exists, 'createrepo', 'createrepo --version'))
-    run_and_print('Checking command: s3cmd...          ', partial(check_command_exists, 's3cmd', 's3cmd --version'))
-    # run_and_print('Checking command: apt-ftparchive... ', partial(check_command_exists, 'apt-ftparchive', 'apt-ftparchive --version'))
-
-    # boto, check error code being returned
-    location = os.path.dirname(os.path.realpath(__file__))
-    command = 'python %s/upload-s3.py' % location
-    run_and_print('Testing boto python dependency...   ', partial(check_command_exists, 'python-boto', command))
-
-    run_and_print('Checking java version...            ', partial(verify_java_version, '1.7'))
-    run_and_print('Checking java mvn version...        ', partial(verify_mvn_java_version, '1.7', MVN))
+
+# Print, for each failed release, the command continuing or rolling it back
+def print_recover_commands(results):
+    for result in results:
+        if result['exit_code'] != 0:
+            print('The release of %s stopped: to continue it (or roll it back) run\n'
+                  '  cd %s && ES_RELEASE_ROOT_DIR=%s %s %s --resume (or --abort)'
+                  % (result['repository'], result['root_dir'], result['root_dir'], sys.executable,
+                     os.path.realpath(__file__)))
+
+
+# Run the given releases, each one the arguments of release_repository,
+# at most workers at the same time. Returns their results
+def run_releases(releases, workers):
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(release_repository, *release) for release in releases]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print('[%s/%s] %s %s in %.0fs' % (len(results), len(releases), result['repository'],
+                                             'done' if result['exit_code'] == 0 else 'FAILED', result['duration']))
+    results.sort(key=lambda r: r['repository'])
+    print_batch_summary(results)
+    return results
+
+
+# Release all the given repositories, running at most workers
+# release processes at the same time. Returns True if all succeeded
+def batch_release(repositories, release_args, workers, send_emails=False):
+    results = run_releases([(repository, release_args, None) for repository in repositories], workers)
+    if send_emails:
+        send_batch_emails(results)
+    print_recover_commands(results)
+    return all(result['exit_code'] == 0 for result in results)
+
+
+# Send the emails of the released repositories, all over one connection
+def send_batch_emails(results):
+    messages = []
+    for result in results:
+        if result['exit_code'] == 0:
+            with open(os.path.join(result['root_dir'], 'target', 'email.txt'), 'rb') as email_file:
+                messages.append(email_file.read())
+    if messages:
+        print('Sending %s release emails' % len(messages))
+        dispatch_emails(messages, mail_recipients(env.get('MAIL_TO', 'discuss%2Bannouncements@elastic.co')),
+                        env.get('MAIL_SENDER'))
+
+
+##########################################################
+#
+# Matrix releases
+#
+##########################################################
+# Update the compatibility table and the installation instructions of the
+# master README with all the given releases, in one commit. It is pushed
+# when publishing, else master is reset after it is shown.
+@traced
+def update_master_documentation(results, remote, dry_run):
+    git_checkout('master')
+    master_hash = get_head_hash()
+    run('git pull --rebase %s master' % remote)
+    readme = FileRewrite(README_FILE)
+    for result in results:
+        update_documentation_to_released_version(readme, result['project_url'], result['release_version'],
+                                                 result['branch'], result['elasticsearch_version'])
+    latest = max(results, key=lambda r: split_version_to_digits(r['release_version']))
+    set_install_instructions(readme, latest['artifact_id'], latest['release_version'])
+    readme.commit()
+    versions = ', '.join(result['release_version'] for result in results)
+    add_pending_files(README_FILE)
+    run('git commit -m "update documentation with releases %s"' % versions)
+    print('  Updated master documentation with releases %s' % versions)
+    if not dry_run:
+        run('git push %s master' % remote)
+    else:
+        print('  dryrun [True] -- skipping push to remote %s master' % remote)
+        run('git reset --hard %s' % master_hash)
+
+
+# Release several branches of this repository at the same time, each one
+# from its own worktree by its own process, at most workers at the same
+# time. The master documentation is updated once all are done, with the
+# releases that succeeded. Worktrees of the failed releases are kept so
+# they can be resumed or rolled back. The branch checked out at the start
+# is checked out again at the end, unless its release stopped. Returns
+# True if all succeeded
+def matrix_release(branches, release_args, workers, remote, dry_run, send_emails=False):
+    start_branch = get_current_branch()
+    git_checkout('master')
+    stopped = []
+    try:
+        results = release_matrix_branches(branches, release_args, workers, remote, dry_run, send_emails)
+        stopped = [result['repository'] for result in results if result['exit_code'] != 0]
+        return not stopped
+    finally:
+        if start_branch in stopped:
+            # its worktree must be able to checkout it to resume or roll back
+            print('  [%s] is left to its stopped release: master stays checked out' % start_branch)
+        else:
+            git_checkout(start_branch)
+
+
+# Maven local repository of the release of a branch of this repository
+def matrix_maven_repository(branch):
+    name = '%s-%s' % (os.path.basename(ROOT_DIR), branch)
+    return os.path.join(CACHE_DIR, 'maven', re.sub(r'[^\w.-]', '_', name))
+
+
+# Release the branches of a matrix release. Returns their results
+def release_matrix_branches(branches, release_args, workers, remote, dry_run, send_emails):
+    worktrees = []
+    try:
+        for branch in branches:
+            worktrees.append(add_worktree(branch))
+            print('  Created worktree [%s] for [%s]' % (worktrees[-1], branch))
+    except RuntimeError:
+        for worktree in worktrees:
+            remove_worktree(worktree)
+        raise
+
+    # the git commands of the releases run one at a time, and each release
+    # has its own maven repository, kept for its next release
+    lock_file = os.path.join(git_dir(), 'release_git.lock')
+    results = run_releases([(worktree, release_args + ['--branch', branch, '--skip_master'], branch,
+                             {'ES_RELEASE_GIT_LOCK': lock_file,
+                              'ES_RELEASE_MAVEN_REPO_LOCAL': matrix_maven_repository(branch)})
+                            for worktree, branch in zip(worktrees, branches)], workers)
+    released = [result for result in results if result['exit_code'] == 0]
+    # the releases are done: master is updated in the working tree alone
+    if released:
+        update_master_documentation(released, remote, dry_run)
+    if send_emails:
+        send_batch_emails(results)
+
+    for result in results:
+        if result['exit_code'] == 0:
+            remove_worktree(result['root_dir'])
+    print_recover_commands(results)
+    return results
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Builds and publishes a Elasticsearch Plugin Release')
-    parser.add_argument('--branch', '-b', metavar='master', default=get_current_branch(),
+    parser.add_argument('--branch', '-b', metavar='master', default=None,
                         help='The branch to release from. Defaults to the current branch.')
     parser.add_argument('--skiptests', '-t', dest='tests', action='store_false',
                         help='Skips tests before release. Tests are run by default.')
@@ -747,13 +2744,53 @@ if __name__ == '__main__':
     parser.add_argument('--disable_mail', '-dm', dest='mail', action='store_false',
                         help='Do not send a release email. Email is sent by default.')
     parser.add_argument('--check', dest='check', action='store_true',
-                        help='Checks and reports for all requirements and then exits')
+                        help='Checks and reports for all requirements and then exits, with a non-zero status if one is missing')
+    parser.add_argument('--check_report', metavar='report.json', default=None,
+                        help='Writes the results of --check to the given JSON file.')
+    parser.add_argument('--batch', metavar='path', nargs='+', default=None,
+                        help='Releases all the given plugin repositories, each one in its own process.')
+    parser.add_argument('--matrix', metavar='branch', nargs='+', default=None,
+                        help='Releases all the given branches, each one in its own worktree and process, then'
+                             ' updates the documentation of master once for all of them.')
+    parser.add_argument('--workers', '-w', metavar='2', type=int, default=BATCH_WORKERS,
+                        help='Maximum number of repositories (or branches) released at the same time in batch'
+                             ' (or matrix) mode. Defaults to %s.' % BATCH_WORKERS)
+    parser.add_argument('--non_interactive', dest='non_interactive', action='store_true',
+                        help='Never wait for the user and use default answers.')
+    parser.add_argument('--result_file', metavar='path', default=None,
+                        help='Writes the outcome of the release to the given JSON file.')
+    parser.add_argument('--trace', metavar='out.json', default=None,
+                        help='Exports the time spent in each phase, function and command in Chrome trace format.')
+    parser.add_argument('--worktree', dest='worktree', action='store_true',
+                        help='Updates the master branch in a temporary git worktree, leaving the working tree'
+                             ' (and target/) untouched.')
+    parser.set_defaults(worktree=False)
+    parser.add_argument('--skip_master', dest='skip_master', action='store_true',
+                        help='Leaves the master branch and its documentation untouched.')
+    parser.set_defaults(skip_master=False)
+    parser.add_argument('--resume', dest='resume', action='store_true',
+                        help='Continues the stopped release from its last completed step.')
+    parser.add_argument('--abort', dest='abort', action='store_true',
+                        help='Rolls back the stopped release.')
+    parser.add_argument('--changelog', metavar='version', nargs='*', default=None,
+                        help='Prints the release notes of the given versions, or of all the versions, from'
+                             ' the issue index and then exits.')
+    parser.add_argument('--resync_issues', dest='resync_issues', action='store_true',
+                        help='Downloads all the Github issues again, dropping the deleted and transferred'
+                             ' ones from the issue index.')
+    parser.set_defaults(resume=False)
+    parser.set_defaults(abort=False)
+    parser.set_defaults(resync_issues=False)
 
     parser.set_defaults(dryrun=True)
     parser.set_defaults(mail=True)
     parser.set_defaults(check=False)
+    parser.set_defaults(non_interactive=NON_INTERACTIVE)
     args = parser.parse_args()
+    purge_log()
 
+    NON_INTERACTIVE = args.non_interactive
+    RESYNC_ISSUES = args.resync_issues
     src_branch = args.branch
     remote = args.remote
     run_tests = args.tests
@@ -761,9 +2798,67 @@ if __name__ == '__main__':
     mail = args.mail
 
     if args.check:
-        check_environment_and_commandline_tools()
+        results = check_environment_and_commandline_tools()
+        if args.check_report:
+            with open(args.check_report, 'w', encoding='utf-8') as report:
+                json.dump({'ok': all(result['ok'] for result in results), 'checks': results}, report, indent=2)
+        sys.exit(0 if all(result['ok'] for result in results) else 1)
+
+    if args.changelog is not None:
+        check_github_credentials()
+        print(generate_changelog(get_github_repository(find_from_pom('artifactId')), args.changelog), end='')
         sys.exit(0)
 
+    journal = load_journal()
+    if args.resume or args.abort:
+        if journal is None:
+            raise RuntimeError('No stopped release found in %s' % journal_file())
+        src_branch = journal['args']['branch']
+        remote = journal['args']['remote']
+        run_tests = journal['args']['tests']
+        dry_run = journal['args']['dryrun']
+        mail = journal['args']['mail']
+        args.worktree = journal['args'].get('worktree', False)
+        args.skip_master = journal['args'].get('skip_master', False)
+    elif journal is not None and not (args.batch or args.matrix):
+        raise RuntimeError('The release of version %s stopped: run with --resume to continue it or --abort to'
+                           ' roll it back' % journal['context']['release_version'])
+
+    if args.abort:
+        set_phase('abort')
+        print('Rolling back the release of version %s' % journal['context']['release_version'])
+        rollback_release(journal)
+        cleanup_release(journal)
+        remove_journal()
+        sys.exit(0)
+
+    if args.batch and args.matrix:
+        parser.error('--batch and --matrix can not be used together')
+
+    if args.batch or args.matrix:
+        if not dry_run:
+            check_s3_credentials()
+            if mail:
+                check_email_settings()
+            print('WARNING: dryrun is set to "false" - this will push and publish %s releases'
+                  % len(args.batch or args.matrix))
+            ask('Press Enter to continue...')
+    if args.batch:
+        if len(set(abspath(repository) for repository in args.batch)) != len(args.batch):
+            parser.error('A repository can only be released once in a batch')
+        release_args = batch_release_args(src_branch, remote, run_tests, dry_run, args.resync_issues)
+        sys.exit(0 if batch_release(args.batch, release_args, max(1, args.workers),
+                                    send_emails=mail and not dry_run) else 1)
+    if args.matrix:
+        if 'master' in args.matrix:
+            parser.error('Can not release the master branch')
+        if len(set(args.matrix)) != len(args.matrix):
+            parser.error('A branch can only be released once in a matrix')
+        release_args = batch_release_args(None, remote, run_tests, dry_run, args.resync_issues)
+        sys.exit(0 if matrix_release(args.matrix, release_args, max(1, args.workers), remote, dry_run,
+                                     send_emails=mail and not dry_run) else 1)
+
+    src_branch = src_branch or get_current_branch()
     if src_branch == 'master':
         raise RuntimeError('Can not release the master branch. You need to create another branch before a release')
 
@@ -777,125 +2872,109 @@ if __name__ == '__main__':
             check_email_settings()
             print('An email to %s will be sent after the release'
                   % env.get('MAIL_TO', 'discuss%2Bannouncements@elastic.co'))
-        input('Press Enter to continue...')
+        ask('Press Enter to continue...')
 
     check_github_credentials()
 
     print(''.join(['-' for _ in range(80)]))
     print('Preparing Release from branch [%s] running tests: [%s] dryrun: [%s]' % (src_branch, run_tests, dry_run))
-    print('  JAVA_HOME is [%s]' % JAVA_HOME)
-    print('  Running with maven command: [%s] ' % (MVN))
-
-    release_version = find_release_version(src_branch)
-    artifact_id = find_from_pom('artifactId')
-    artifact_name = find_from_pom('name')
-    artifact_description = find_from_pom('description')
-    project_url = find_from_pom('url')
-
-    try:
-        elasticsearch_version = find_from_pom('elasticsearch.version')
-    except RuntimeError:
-        # With projects using elasticsearch-parent project, we need to consider elasticsearch version
-        # to be after <artifactId>elasticsearch-parent</artifactId>
-        elasticsearch_version = find_from_pom('version', '<artifactId>elasticsearch-parent</artifactId>')
-
-    print('  Artifact Id: [%s]' % artifact_id)
-    print('  Release version: [%s]' % release_version)
-    print('  Elasticsearch: [%s]' % elasticsearch_version)
-    if elasticsearch_version.find('-SNAPSHOT') != -1:
-        raise RuntimeError('Can not release with a SNAPSHOT elasticsearch dependency: %s' % elasticsearch_version)
-
-    # extract snapshot
-    default_snapshot_version = guess_snapshot(release_version)
-    snapshot_version = input('Enter next snapshot version [%s]:' % default_snapshot_version)
-    snapshot_version = snapshot_version or default_snapshot_version
-
-    print('  Next version: [%s-SNAPSHOT]' % snapshot_version)
-    print('  Artifact Name: [%s]' % artifact_name)
-    print('  Artifact Description: [%s]' % artifact_description)
-    print('  Project URL: [%s]' % project_url)
-
-    if not dry_run:
-        smoke_test_version = release_version
+    print('  JAVA_HOME is [%s]' % java_home())
+    print('  Running with maven command: [%s] ' % maven_command())
+
+    if args.resume:
+        set_phase('resume')
+        check_journal(journal)
+        context = journal['context']
+        if journal['head'] != get_current_branch():
+            git_checkout(journal['head'])
+        print('Resuming the release of version %s after steps %s' % (context['release_version'], journal['steps']))
+    else:
+        set_phase('prepare')
+        release_version = find_release_version(src_branch)
+        artifact_id = find_from_pom('artifactId')
+        artifact_name = find_from_pom('name')
+        artifact_description = find_from_pom('description')
+        project_url = find_from_pom('url')
+
+        try:
+            elasticsearch_version = find_from_pom('elasticsearch.version')
+        except RuntimeError:
+            # With projects using elasticsearch-parent project, we need to consider elasticsearch version
+            # to be after <artifactId>elasticsearch-parent</artifactId>
+            elasticsearch_version = find_from_pom('version', '<artifactId>elasticsearch-parent</artifactId>')
+
+        print('  Artifact Id: [%s]' % artifact_id)
+        print('  Release version: [%s]' % release_version)
+        print('  Elasticsearch: [%s]' % elasticsearch_version)
+        if elasticsearch_version.find('-SNAPSHOT') != -1:
+            raise RuntimeError('Can not release with a SNAPSHOT elasticsearch dependency: %s' % elasticsearch_version)
+
+        # extract snapshot
+        default_snapshot_version = guess_snapshot(release_version)
+        snapshot_version = ask('Enter next snapshot version [%s]:' % default_snapshot_version)
+        snapshot_version = snapshot_version or default_snapshot_version
+
+        print('  Next version: [%s-SNAPSHOT]' % snapshot_version)
+        print('  Artifact Name: [%s]' % artifact_name)
+        print('  Artifact Description: [%s]' % artifact_description)
+        print('  Project URL: [%s]' % project_url)
+        write_result(args.result_file, artifact_id=artifact_id, release_version=release_version,
+                     snapshot_version=snapshot_version, branch=src_branch, dry_run=dry_run,
+                     project_url=project_url, elasticsearch_version=elasticsearch_version)
 
-    try:
-        git_checkout('master')
-        master_hash = get_head_hash()
-        git_checkout(src_branch)
-        version_hash = get_head_hash()
-        run_mvn('clean')  # clean the env!
-        create_release_branch(remote, 'master', release_version)
-        print('  Created release branch [%s]' % (release_branch('master', release_version)))
-        create_release_branch(remote, src_branch, release_version)
-        print('  Created release branch [%s]' % (release_branch(src_branch, release_version)))
-    except RuntimeError:
-        print('Logs:')
-        with open(LOG, 'r') as log_file:
-            print(log_file.read())
-        sys.exit(-1)
+        if not dry_run:
+            smoke_test_version = release_version
+
+        set_phase('branches')
+        master_worktree = None
+        try:
+            if args.worktree or args.skip_master:
+                master_hash = get_branch_hash('master')
+            else:
+                git_checkout('master')
+                master_hash = get_head_hash()
+            git_checkout(src_branch)
+            version_hash = get_head_hash()
+            run_mvn('clean')  # clean the env!
+            if not args.skip_master:
+                if args.worktree:
+                    master_worktree = add_worktree('master')
+                    print('  Created worktree [%s]' % master_worktree)
+                create_release_branch(remote, 'master', release_version, cwd=master_worktree)
+                print('  Created release branch [%s]' % (release_branch('master', release_version)))
+            create_release_branch(remote, src_branch, release_version)
+            print('  Created release branch [%s]' % (release_branch(src_branch, release_version)))
+        except RuntimeError:
+            print('Logs:')
+            print_log()
+            if master_worktree:
+                remove_worktree(master_worktree)
+            sys.exit(-1)
+
+        context = {'src_branch': src_branch, 'remote': remote, 'run_tests': run_tests, 'dry_run': dry_run,
+                   'mail': mail, 'release_version': release_version, 'snapshot_version': snapshot_version,
+                   'artifact_id': artifact_id, 'artifact_name': artifact_name,
+                   'artifact_description': artifact_description, 'project_url': project_url,
+                   'elasticsearch_version': elasticsearch_version, 'master_worktree': master_worktree,
+                   'skip_master': args.skip_master}
+        journal = {'args': {'branch': src_branch, 'remote': remote, 'tests': run_tests, 'dryrun': dry_run,
+                            'mail': mail, 'worktree': args.worktree, 'skip_master': args.skip_master},
+                   'master_hash': master_hash, 'version_hash': version_hash}
+        save_journal(journal, context, ())
+
+    done = set(journal['steps']).difference(RESUME_RERUN_STEPS)
+
+    # in worktree mode, the master worktree is updated at the same time
+    # as the working tree: their git commands share the refs and run one
+    # at a time, as in a matrix release
+    if args.worktree and GIT_LOCK_FILE is None:
+        GIT_LOCK_FILE = os.path.join(git_dir(), 'release_git.lock')
 
     success = False
     try:
-        ########################################
-        # Start update process in version branch
-        ########################################
-        pending_files = [POM_FILE, README_FILE]
-        remove_maven_snapshot(POM_FILE, release_version)
-        update_documentation_in_released_branch(README_FILE, release_version, elasticsearch_version)
-        print('  Done removing snapshot version')
-        add_pending_files(*pending_files)  # expects var args use * to expand
-        commit_release(artifact_id, release_version)
-        print('  Committed release version [%s]' % release_version)
-        print(''.join(['-' for _ in range(80)]))
-        print('Building Release candidate')
-        input('Press Enter to continue...')
-        print('  Checking github issues')
-        repository = get_github_repository(artifact_id)
-        check_opened_issues(release_version, repository, artifact_id)
-        if not dry_run:
-            print('  Running maven builds now and publish to sonatype - run-tests [%s]' % run_tests)
-        else:
-            print('  Running maven builds now run-tests [%s]' % run_tests)
-        build_release(run_tests=run_tests, dry_run=dry_run)
-        artifact = get_artifacts(artifact_id, release_version)
-        artifact_and_checksums = generate_checksums(artifact)
-        print(''.join(['-' for _ in range(80)]))
-
-        ########################################
-        # Start update process in master branch
-        ########################################
-        git_checkout(release_branch('master', release_version))
-        update_documentation_to_released_version(README_FILE, project_url, release_version, src_branch,
-                                                 elasticsearch_version)
-        set_install_instructions(README_FILE, artifact_id, release_version)
-        add_pending_files(*pending_files)  # expects var args use * to expand
-        commit_master(release_version)
-
-        print('Finish Release -- dry_run: %s' % dry_run)
-        input('Press Enter to continue...')
-
-        print('  merge release branch')
-        git_merge(src_branch, release_version)
-        print('  tag')
-        tag_release(release_version)
-
-        add_maven_snapshot(POM_FILE, release_version, snapshot_version)
-        update_documentation_in_released_branch(README_FILE, '%s-SNAPSHOT' % snapshot_version, elasticsearch_version)
-        add_pending_files(*pending_files)
-        commit_snapshot()
-
-        print('  merge master branch')
-        git_merge('master', release_version)
-
-        print('  push to %s %s -- dry_run: %s' % (remote, src_branch, dry_run))
-        git_push(remote, src_branch, release_version, dry_run)
-        print('  publish artifacts to S3 -- dry_run: %s' % dry_run)
-        publish_artifacts(artifact_and_checksums, base='elasticsearch/%s' % (artifact_id) , dry_run=dry_run)
-        print('  preparing email (from github issues)')
-        msg = prepare_email(artifact_id, release_version, repository, artifact_name, artifact_description, project_url)
-        input('Press Enter to send email...')
-        print('  sending email -- dry_run: %s, mail: %s' % (dry_run, mail))
-        send_email(msg, dry_run=dry_run, mail=mail)
+        set_phase('release')
+        run_pipeline(release_steps(worktree=args.worktree, skip_master=args.skip_master), context, done=done,
+                     on_step_done=partial(save_journal, journal, context))
 
         pending_msg = """
 Release successful pending steps:
@@ -903,35 +2982,28 @@ Release successful pending steps:
     * check if the release is there https://oss.sonatype.org/content/repositories/releases/org/elasticsearch/%(artifact_id)s/%(version)s
     * tweet about the release
 """
-        print(pending_msg % {'version': release_version,
-                             'artifact_id': artifact_id,
-                             'project_url': project_url})
+        print(pending_msg % {'version': context['release_version'],
+                             'artifact_id': context['artifact_id'],
+                             'project_url': context['project_url']})
         success = True
     finally:
+        set_phase('cleanup')
+        write_result(args.result_file, success=success)
         if not success:
             print('Logs:')
-            with open(LOG, 'r') as log_file:
-                print(log_file.read())
-            git_checkout('master')
-            run('git reset --hard %s' % master_hash)
-            git_checkout(src_branch)
-            run('git reset --hard %s' % version_hash)
-            try:
-                run('git tag -d v%s' % release_version)
-            except RuntimeError:
-                pass
-        elif dry_run:
-            print('End of dry_run')
-            input('Press Enter to reset changes...')
-            git_checkout('master')
-            run('git reset --hard %s' % master_hash)
-            git_checkout(src_branch)
-            run('git reset --hard %s' % version_hash)
-            run('git tag -d v%s' % release_version)
-
-        # we delete this one anyways
-        run('git branch -D %s' % (release_branch('master', release_version)))
-        run('git branch -D %s' % (release_branch(src_branch, release_version)))
-
-        # Checkout the branch we started from
-        git_checkout(src_branch)
+            print_log()
+            # the steps done are kept: the release can be resumed or rolled back
+            save_journal(journal, context, journal['steps'])
+            print('The release stopped: run with --resume to continue it or --abort to roll it back')
+        else:
+            if dry_run:
+                print('End of dry_run')
+                ask('Press Enter to reset changes...')
+                rollback_release(journal)
+            cleanup_release(journal)
+            remove_journal()
+
+        print_trace_summary()
+        if args.trace:
+            export_trace(args.trace)
+            print('Trace exported to %s' % args.trace)
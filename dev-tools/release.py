@@ -15,7 +15,9 @@
 # language governing permissions and limitations under the License.
 
 import datetime
+import json
 import os
+import runpy
 import shutil
 import sys
 import time
@@ -54,6 +56,8 @@ env = os.environ
 # Change this if the source repository for your scripts is at a different location
 SOURCE_REPO = 'elasticsearch/elasticsearch-plugins-script'
 # We define that we should download again the script after 1 days
+# This only applies if the server gave us no ETag or Last-Modified header,
+# otherwise we check for a new version on each run
 SCRIPT_OBSOLETE_DAYS = 1
 # We ignore in master.zip file the following files
 IGNORED_FILES = ['.gitignore', 'README.md']
@@ -64,71 +68,126 @@ TARGET_TOOLS_DIR = ROOT_DIR + '/plugin_tools'
 DEV_TOOLS_DIR = ROOT_DIR + '/dev-tools'
 BUILD_RELEASE_FILENAME = 'release.zip'
 BUILD_RELEASE_FILE = TARGET_TOOLS_DIR + '/' + BUILD_RELEASE_FILENAME
-SOURCE_URL = 'https://github.com/%s/archive/master.zip' % SOURCE_REPO
+SOURCE_URL = env.get('ES_PLUGIN_TOOLS_URL', 'https://github.com/%s/archive/master.zip' % SOURCE_REPO)
+# Validators (ETag and Last-Modified) of the last downloaded archive
+VALIDATORS_FILE = BUILD_RELEASE_FILE + '.json'
 
-# Download a recent version of the release plugin tool
-try:
-    os.mkdir(TARGET_TOOLS_DIR)
-    print('directory %s created' % TARGET_TOOLS_DIR)
-except FileExistsError:
-    pass
 
+# Reads the validators saved with the last download
+def read_validators(validators_file):
+    try:
+        with open(validators_file, encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
 
-try:
-    # we check latest update. If we ran an update recently, we
-    # are not going to check it again
-    download = True
 
+# Checks if the last download, done without any validator, is too old. Its
+# time is the one of the validators file, written once the download is used
+def is_obsolete(validators_file):
     try:
-        last_download_time = datetime.datetime.fromtimestamp(os.path.getmtime(BUILD_RELEASE_FILE))
-        if (datetime.datetime.now()-last_download_time).days < SCRIPT_OBSOLETE_DAYS:
-            download = False
+        last_download_time = datetime.datetime.fromtimestamp(os.path.getmtime(validators_file))
+        return (datetime.datetime.now() - last_download_time).days >= SCRIPT_OBSOLETE_DAYS
     except FileNotFoundError:
+        return True
+
+
+# Downloads url to target_file unless the server tells us our copy is
+# still up to date (304 Not Modified) when sending the validators
+# saved with the previous download. A downloaded file is given to
+# on_download, ie. to extract it, before its validators are saved: if
+# on_download fails, the file is downloaded again by the next call.
+# Returns True if the file was downloaded.
+def download_if_modified(url, target_file, validators_file, on_download=None):
+    validators = {}
+    if os.path.isfile(target_file) and os.path.isfile(validators_file):
+        validators = read_validators(validators_file)
+        if not validators and not is_obsolete(validators_file):
+            return False
+
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+            download_file = target_file + '.download'
+            with open(download_file, 'wb') as file:
+                shutil.copyfileobj(response, file)
+            # the validators of the previous download do not match our copy anymore
+            try:
+                os.remove(validators_file)
+            except FileNotFoundError:
+                pass
+            os.replace(download_file, target_file)
+            validators = dict((name, response.headers.get(header))
+                              for name, header in [('etag', 'ETag'), ('last_modified', 'Last-Modified')]
+                              if response.headers.get(header))
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            raise
+        # not modified: we keep our copy
+        os.utime(validators_file)
+        return False
+
+    if on_download is not None:
+        on_download(target_file)
+    with open(validators_file, 'w', encoding='utf-8') as file:
+        json.dump(validators, file)
+    return True
+
+
+# Extracts the files of the tools archive in target_dir, except the IGNORED_FILES
+def extract_tools(archive_file, target_dir=TARGET_TOOLS_DIR):
+    with zipfile.ZipFile(archive_file) as myzip:
+        for member in myzip.infolist():
+            filename = os.path.basename(member.filename)
+            # skip directories
+            if not filename:
+                continue
+            if filename in IGNORED_FILES:
+                continue
+
+            # copy file (taken from zipfile's extract)
+            source = myzip.open(member.filename)
+            target = open(os.path.join(target_dir, filename), "wb")
+            with source, target:
+                shutil.copyfileobj(source, target)
+                # We keep the original date
+                date_time = time.mktime(member.date_time + (0, 0, -1))
+                os.utime(os.path.join(target_dir, filename), (date_time, date_time))
+
+
+# Runs build_release.py in this interpreter with the given arguments.
+# Its exit status, from sys.exit() or an uncaught exception, becomes ours.
+def launch_build_release(args):
+    script = TARGET_TOOLS_DIR + '/build_release.py'
+    sys.argv = [script] + args
+    runpy.run_path(script, run_name='__main__')
+
+
+if __name__ == '__main__':
+    # Download a recent version of the release plugin tool
+    try:
+        os.mkdir(TARGET_TOOLS_DIR)
+        print('directory %s created' % TARGET_TOOLS_DIR)
+    except FileExistsError:
         pass
 
-    if download:
-        urllib.request.urlretrieve(SOURCE_URL, BUILD_RELEASE_FILE)
-        with zipfile.ZipFile(BUILD_RELEASE_FILE) as myzip:
-            for member in myzip.infolist():
-                filename = os.path.basename(member.filename)
-                # skip directories
-                if not filename:
-                    continue
-                if filename in IGNORED_FILES:
-                    continue
-
-                # copy file (taken from zipfile's extract)
-                source = myzip.open(member.filename)
-                target = open(os.path.join(TARGET_TOOLS_DIR, filename), "wb")
-                with source, target:
-                    shutil.copyfileobj(source, target)
-                    # We keep the original date
-                    date_time = time.mktime(member.date_time + (0, 0, -1))
-                    os.utime(os.path.join(TARGET_TOOLS_DIR, filename), (date_time, date_time))
-        print('plugin-tools updated from %s' % SOURCE_URL)
-except urllib.error.HTTPError:
-    pass
-
-
-# Let see if we need to update the release.py script itself
-source_time = os.path.getmtime(TARGET_TOOLS_DIR + '/release.py')
-repo_time = os.path.getmtime(DEV_TOOLS_DIR + '/release.py')
-if source_time > repo_time:
-    input('release.py needs an update. Press a key to update it...')
-    shutil.copyfile(TARGET_TOOLS_DIR + '/release.py', DEV_TOOLS_DIR + '/release.py')
-
-# We can launch the build process
-try:
-    PYTHON = 'python'
-    # make sure python3 is used if python3 is available
-    # some systems use python 2 as default
-    os.system('python3 --version > /dev/null 2>&1')
-    PYTHON = 'python3'
-except RuntimeError:
-    pass
-
-release_args = ''
-for x in range(1, len(sys.argv)):
-    release_args += ' ' + sys.argv[x]
-
-os.system('%s %s/build_release.py %s' % (PYTHON, TARGET_TOOLS_DIR, release_args))
+    try:
+        if download_if_modified(SOURCE_URL, BUILD_RELEASE_FILE, VALIDATORS_FILE, on_download=extract_tools):
+            print('plugin-tools updated from %s' % SOURCE_URL)
+    except urllib.error.URLError:
+        pass
+
+    # Let see if we need to update the release.py script itself
+    source_time = os.path.getmtime(TARGET_TOOLS_DIR + '/release.py')
+    repo_time = os.path.getmtime(DEV_TOOLS_DIR + '/release.py')
+    if source_time > repo_time:
+        input('release.py needs an update. Press a key to update it...')
+        shutil.copyfile(TARGET_TOOLS_DIR + '/release.py', DEV_TOOLS_DIR + '/release.py')
+
+    # We can launch the build process: we are already running with python 3
+    launch_build_release(sys.argv[1:])
@@ -0,0 +1,953 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import sys
+import glob
+import json
+import time
+import uuid
+import shutil
+import socketserver
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.server
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+
+from email.utils import formatdate
+from xml.sax.saxutils import escape
+
+"""
+ Local stand-ins for the services used by a release, to benchmark and try
+ the release tools offline:
+
+  - an S3 compatible server, storing objects in a local directory. It supports
+    what upload-s3.py uses: buckets, PUT, GET, HEAD and DELETE of objects,
+    user metadata and multipart uploads. Signatures are not checked.
+  - a Github API serving repositories and their issues, with ETags, pagination
+    and a rate limit.
+  - an SMTP sink keeping the messages it receives. It accepts any credentials
+    and can refuse recipients with transient or permanent errors to test retries.
+  - a server of the release tools archive downloaded by release.py, with an
+    ETag and a Last-Modified date.
+  - a plugin repository, with its origin and fake maven and java commands,
+    to run build_release.py on.
+
+ Run one from the command line:
+
+   $ python3 dev-tools/standins.py s3 --port 9000 --dir /tmp/s3
+   $ S3_ENDPOINT=http://127.0.0.1:9000 python3 dev-tools/build_release.py --publish
+   $ python3 dev-tools/standins.py github --port 8000 --data issues.json
+   $ GITHUB_API_URL=http://127.0.0.1:8000 python3 dev-tools/build_release.py
+   $ python3 dev-tools/standins.py smtp --port 2525
+   $ SMTP_SERVER=127.0.0.1 SMTP_PORT=2525 python3 dev-tools/build_release.py --publish
+   $ python3 dev-tools/standins.py archive --port 8080 --file master.zip
+   $ ES_PLUGIN_TOOLS_URL=http://127.0.0.1:8080/master.zip python3 dev-tools/release.py
+
+ where issues.json gives the issues of each repository:
+
+   {"elastic/elasticsearch-cloud-azure": [{"number": 1, "title": "Fix", "state": "closed", "labels": ["bug", "v2.5.0"]}]}
+
+ or start one in a thread from python:
+
+   server = S3StandIn().start()
+   ...
+   server.stop()
+"""
+
+S3_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+# Size of the chunks of request and response bodies
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+# Base of the stand-in servers: a threaded http server that can be
+# started in a thread, and records the requests it received
+class StandInServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, latency=0):
+        super().__init__(address, handler)
+        # seconds waited before answering each request, to simulate the network
+        self.latency = latency
+        self.requests = []
+        self.requests_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def endpoint(self):
+        return 'http://%s:%s' % self.server_address[:2]
+
+    def record(self, method, path):
+        with self.requests_lock:
+            self.requests.append((method, path))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+##########################################################
+#
+# S3
+#
+##########################################################
+class S3Handler(http.server.BaseHTTPRequestHandler):
+    # keep alive, as S3 does
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def parse(self):
+        url = urllib.parse.urlsplit(self.path)
+        bucket, _, key = urllib.parse.unquote(url.path).lstrip('/').partition('/')
+        self.bucket = bucket
+        self.key = key
+        self.query = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+        self.server.record(self.command, url.path)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def send(self, status, body=b'', headers=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_xml(self, status, element, content):
+        self.send(status, '<?xml version="1.0" encoding="UTF-8"?>\n<%s xmlns="%s">%s</%s>'
+                  % (element, S3_NAMESPACE, content, element), {'Content-Type': 'application/xml'})
+
+    def send_error_code(self, status, code, message):
+        self.send_xml(status, 'Error', '<Code>%s</Code><Message>%s</Message><Resource>%s</Resource>'
+                      % (code, escape(message), escape(self.path)))
+
+    # Reads the request body into target (a file) if given, returns its md5 digest
+    def read_body(self, target=None):
+        remaining = int(self.headers.get('Content-Length', 0))
+        md5 = hashlib.md5()
+        while remaining > 0:
+            chunk = self.rfile.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            md5.update(chunk)
+            if target is not None:
+                target.write(chunk)
+            remaining -= len(chunk)
+        return md5
+
+    def do_GET(self):
+        self.parse()
+        if not self.bucket:
+            buckets = ''.join('<Bucket><Name>%s</Name><CreationDate>%s</CreationDate></Bucket>'
+                              % (escape(name), iso_date(time.time())) for name in self.server.bucket_names())
+            self.send_xml(200, 'ListAllMyBucketsResult', '<Owner><ID>standin</ID><DisplayName>standin</DisplayName>'
+                                                         '</Owner><Buckets>%s</Buckets>' % buckets)
+        elif not self.server.has_bucket(self.bucket):
+            self.send_error_code(404, 'NoSuchBucket', 'The specified bucket does not exist')
+        elif not self.key:
+            self.list_objects()
+        elif 'uploadId' in self.query:
+            self.list_parts()
+        else:
+            self.get_object()
+
+    def do_HEAD(self):
+        self.parse()
+        if not self.server.has_bucket(self.bucket):
+            self.send(404)
+        elif not self.key:
+            self.send(200)
+        else:
+            self.get_object()
+
+    def list_objects(self):
+        prefix = self.query.get('prefix', [''])[0]
+        max_keys = int(self.query.get('max-keys', ['1000'])[0])
+        keys = [key for key in self.server.object_keys(self.bucket) if key.startswith(prefix)][:max_keys]
+        contents = ''
+        for key in keys:
+            meta = self.server.object_meta(self.bucket, key)
+            contents += ('<Contents><Key>%s</Key><LastModified>%s</LastModified><ETag>&quot;%s&quot;</ETag>'
+                         '<Size>%s</Size><StorageClass>STANDARD</StorageClass></Contents>'
+                         % (escape(key), iso_date(meta['modified']), meta['etag'], meta['size']))
+        self.send_xml(200, 'ListBucketResult', '<Name>%s</Name><Prefix>%s</Prefix><MaxKeys>%s</MaxKeys>'
+                                               '<IsTruncated>false</IsTruncated>%s'
+                      % (escape(self.bucket), escape(prefix), max_keys, contents))
+
+    def list_parts(self):
+        upload_id = self.query['uploadId'][0]
+        upload_dir = self.server.upload_dir(upload_id)
+        if not os.path.isdir(upload_dir):
+            self.send_error_code(404, 'NoSuchUpload', 'The specified upload does not exist')
+            return
+        parts = ''
+        for name in sorted(os.listdir(upload_dir)):
+            if not name.endswith('.md5'):
+                continue
+            part = os.path.join(upload_dir, name[:-len('.md5')])
+            with open(part + '.md5') as file:
+                etag = file.read()
+            parts += ('<Part><PartNumber>%s</PartNumber><LastModified>%s</LastModified><ETag>&quot;%s&quot;</ETag>'
+                      '<Size>%s</Size></Part>' % (int(name[:-len('.md5')]), iso_date(os.path.getmtime(part)), etag,
+                                                  os.path.getsize(part)))
+        self.send_xml(200, 'ListPartsResult', '<Bucket>%s</Bucket><Key>%s</Key><UploadId>%s</UploadId>'
+                                              '<IsTruncated>false</IsTruncated>%s'
+                      % (escape(self.bucket), escape(self.key), upload_id, parts))
+
+    def get_object(self):
+        meta = self.server.object_meta(self.bucket, self.key)
+        if meta is None:
+            if self.command == 'HEAD':
+                self.send(404)
+            else:
+                self.send_error_code(404, 'NoSuchKey', 'The specified key does not exist.')
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(meta['size']))
+        self.send_header('ETag', '"%s"' % meta['etag'])
+        self.send_header('Last-Modified', formatdate(meta['modified'], usegmt=True))
+        self.send_header('Content-Type', meta.get('content_type') or 'application/octet-stream')
+        for name, value in meta['metadata'].items():
+            self.send_header('x-amz-meta-%s' % name, value)
+        self.end_headers()
+        if self.command == 'GET':
+            with open(self.server.object_file(self.bucket, self.key), 'rb') as file:
+                shutil.copyfileobj(file, self.wfile, COPY_CHUNK_SIZE)
+
+    def do_PUT(self):
+        self.parse()
+        if not self.key:
+            self.read_body()
+            self.server.create_bucket(self.bucket)
+            self.send(200)
+        elif not self.server.has_bucket(self.bucket):
+            self.read_body()
+            self.send_error_code(404, 'NoSuchBucket', 'The specified bucket does not exist')
+        elif 'uploadId' in self.query:
+            self.upload_part()
+        else:
+            self.put_object()
+
+    def put_object(self):
+        with tempfile.NamedTemporaryFile(dir=self.server.tmp_dir(), delete=False) as file:
+            md5 = self.read_body(file)
+        etag = md5.hexdigest()
+        self.server.store_object(self.bucket, self.key, file.name, etag, self.request_metadata(),
+                                 self.headers.get('Content-Type'))
+        self.send(200, headers={'ETag': '"%s"' % etag})
+
+    # User metadata of the request, from its x-amz-meta-* headers
+    def request_metadata(self):
+        return dict((name[len('x-amz-meta-'):].lower(), value) for name, value in self.headers.items()
+                    if name.lower().startswith('x-amz-meta-'))
+
+    def upload_part(self):
+        upload_dir = self.server.upload_dir(self.query['uploadId'][0])
+        if not os.path.isdir(upload_dir):
+            self.read_body()
+            self.send_error_code(404, 'NoSuchUpload', 'The specified upload does not exist')
+            return
+        part = os.path.join(upload_dir, '%05d' % int(self.query['partNumber'][0]))
+        with tempfile.NamedTemporaryFile(dir=upload_dir, delete=False) as file:
+            md5 = self.read_body(file)
+        os.replace(file.name, part)
+        with open(part + '.md5', 'w') as file:
+            file.write(md5.hexdigest())
+        self.send(200, headers={'ETag': '"%s"' % md5.hexdigest()})
+
+    def do_POST(self):
+        self.parse()
+        if 'uploads' in self.query:
+            upload_id = self.server.create_upload(self.bucket, self.key, self.request_metadata())
+            self.send_xml(200, 'InitiateMultipartUploadResult', '<Bucket>%s</Bucket><Key>%s</Key><UploadId>%s</UploadId>'
+                          % (escape(self.bucket), escape(self.key), upload_id))
+        elif 'uploadId' in self.query:
+            self.complete_upload()
+        else:
+            self.send_error_code(400, 'InvalidRequest', 'Unsupported request')
+
+    # The ETag of a multipart object is the md5 of the md5 of its parts,
+    # followed by the number of parts. It gets the metadata given when
+    # the upload was initiated.
+    def complete_upload(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        upload_dir = self.server.upload_dir(self.query['uploadId'][0])
+        if not os.path.isdir(upload_dir):
+            self.send_error_code(404, 'NoSuchUpload', 'The specified upload does not exist')
+            return
+        numbers = [int(element.text) for element in ElementTree.fromstring(body).iter()
+                   if element.tag.endswith('PartNumber')]
+        digests = hashlib.md5()
+        with tempfile.NamedTemporaryFile(dir=self.server.tmp_dir(), delete=False) as target:
+            for number in sorted(numbers):
+                part = os.path.join(upload_dir, '%05d' % number)
+                if not os.path.isfile(part):
+                    os.remove(target.name)
+                    self.send_error_code(400, 'InvalidPart', 'Part %s was not uploaded' % number)
+                    return
+                with open(part, 'rb') as file:
+                    shutil.copyfileobj(file, target, COPY_CHUNK_SIZE)
+                with open(part + '.md5') as file:
+                    digests.update(bytes.fromhex(file.read()))
+        etag = '%s-%s' % (digests.hexdigest(), len(numbers))
+        with open(os.path.join(upload_dir, 'metadata.json'), encoding='utf-8') as file:
+            metadata = json.load(file)
+        self.server.store_object(self.bucket, self.key, target.name, etag, metadata, None)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        self.send_xml(200, 'CompleteMultipartUploadResult', '<Location>%s/%s/%s</Location><Bucket>%s</Bucket>'
+                                                            '<Key>%s</Key><ETag>&quot;%s&quot;</ETag>'
+                      % (self.server.endpoint, escape(self.bucket), escape(self.key), escape(self.bucket),
+                         escape(self.key), etag))
+
+    def do_DELETE(self):
+        self.parse()
+        if 'uploadId' in self.query:
+            shutil.rmtree(self.server.upload_dir(self.query['uploadId'][0]), ignore_errors=True)
+        elif self.key:
+            self.server.delete_object(self.bucket, self.key)
+        self.send(204)
+
+
+def iso_date(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(timestamp))
+
+
+# S3 compatible server. Objects are stored in root_dir, a temporary
+# directory removed when the server stops if none is given.
+class S3StandIn(StandInServer):
+    def __init__(self, address=('127.0.0.1', 0), root_dir=None, latency=0):
+        super().__init__(address, S3Handler, latency)
+        self.owns_root_dir = root_dir is None
+        self.root_dir = root_dir or tempfile.mkdtemp(prefix='s3_standin_')
+        for name in ('objects', 'meta', 'uploads', 'tmp'):
+            os.makedirs(os.path.join(self.root_dir, name), exist_ok=True)
+
+    def stop(self):
+        super().stop()
+        if self.owns_root_dir:
+            shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def tmp_dir(self):
+        return os.path.join(self.root_dir, 'tmp')
+
+    def bucket_names(self):
+        return sorted(os.listdir(os.path.join(self.root_dir, 'objects')))
+
+    def has_bucket(self, bucket):
+        return bool(bucket) and os.path.isdir(os.path.join(self.root_dir, 'objects', bucket))
+
+    def create_bucket(self, bucket):
+        os.makedirs(os.path.join(self.root_dir, 'objects', bucket), exist_ok=True)
+        os.makedirs(os.path.join(self.root_dir, 'meta', bucket), exist_ok=True)
+
+    def object_file(self, bucket, key):
+        return os.path.join(self.root_dir, 'objects', bucket, key)
+
+    def meta_file(self, bucket, key):
+        return os.path.join(self.root_dir, 'meta', bucket, key + '.json')
+
+    def object_keys(self, bucket):
+        bucket_dir = os.path.join(self.root_dir, 'objects', bucket)
+        keys = []
+        for dir_path, _, file_names in os.walk(bucket_dir):
+            for file_name in file_names:
+                keys.append(os.path.relpath(os.path.join(dir_path, file_name), bucket_dir))
+        return sorted(keys)
+
+    # Size, ETag, modification time, content type and user metadata of an
+    # object, or None if it does not exist
+    def object_meta(self, bucket, key):
+        try:
+            with open(self.meta_file(bucket, key), encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    # Move the uploaded file to its key, the metadata first: an object is
+    # never seen with the metadata of its previous version
+    def store_object(self, bucket, key, uploaded_file, etag, metadata, content_type):
+        meta = {'size': os.path.getsize(uploaded_file), 'etag': etag, 'modified': time.time(),
+                'metadata': metadata, 'content_type': content_type}
+        for path in (self.object_file(bucket, key), self.meta_file(bucket, key)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=self.tmp_dir(), delete=False, encoding='utf-8') as file:
+            json.dump(meta, file)
+        os.replace(file.name, self.meta_file(bucket, key))
+        os.replace(uploaded_file, self.object_file(bucket, key))
+
+    def delete_object(self, bucket, key):
+        for path in (self.meta_file(bucket, key), self.object_file(bucket, key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def upload_dir(self, upload_id):
+        return os.path.join(self.root_dir, 'uploads', os.path.basename(upload_id))
+
+    def create_upload(self, bucket, key, metadata):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self.upload_dir(upload_id))
+        with open(os.path.join(self.upload_dir(upload_id), 'metadata.json'), 'w', encoding='utf-8') as file:
+            json.dump(metadata, file)
+        return upload_id
+
+    # Bytes of an object, ie. to check what was uploaded
+    def read_object(self, bucket, key):
+        with open(self.object_file(bucket, key), 'rb') as file:
+            return file.read()
+
+
+##########################################################
+#
+# Github
+#
+##########################################################
+# Update time of the issues not giving one
+DEFAULT_UPDATED_AT = '2015-01-01T00:00:00Z'
+
+
+class GithubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        self.server.record('GET', self.path)
+        self.server.record_authorization(self.headers.get('Authorization'))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        parts = url.path.strip('/').split('/')
+        if len(parts) < 3 or parts[0] != 'repos' or '/'.join(parts[1:3]) not in self.server.repositories:
+            self.send_json(404, {'message': 'Not Found'})
+        elif len(parts) == 3:
+            self.send_json(200, self.server.repository('/'.join(parts[1:3])))
+        elif len(parts) == 4 and parts[3] == 'issues':
+            self.list_issues('/'.join(parts[1:3]), url.path, query)
+        else:
+            self.send_json(404, {'message': 'Not Found'})
+
+    def list_issues(self, full_name, path, query):
+        labels = [label for label in query.get('labels', '').split(',') if label]
+        state = query.get('state', 'open')
+        per_page = int(query.get('per_page', 30))
+        page = int(query.get('page', 1))
+        since = query.get('since', '')
+        issues = [issue for issue in self.server.issues(full_name)
+                  if (state == 'all' or issue['state'] == state) and issue['updated_at'] >= since
+                  and all(label in [l['name'] for l in issue['labels']] for label in labels)]
+        if query.get('sort', 'created') == 'updated':
+            issues.sort(key=lambda i: i['updated_at'], reverse=query.get('direction', 'desc') == 'desc')
+        elif query.get('direction') == 'asc':
+            issues.reverse()
+        last_page = max(1, (len(issues) + per_page - 1) // per_page)
+        links = []
+        for rel, number in (('next', page + 1), ('last', last_page)):
+            if page < last_page:
+                link_query = urllib.parse.urlencode(dict(query, page=number))
+                links.append('<%s%s?%s>; rel="%s"' % (self.server.endpoint, path, link_query, rel))
+        headers = {'Link': ', '.join(links)} if links else {}
+        self.send_json(200, issues[(page - 1) * per_page:page * per_page], headers)
+
+    # Responses have an ETag: requests with a matching If-None-Match get a
+    # 304, which does not count in the rate limit
+    def send_json(self, status, body, headers=None):
+        body = json.dumps(body).encode('utf-8')
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        headers = dict(headers or {}, ETag=etag)
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            status, body = 304, b''
+        elif not self.server.take_request():
+            status, body = 403, json.dumps({'message': 'API rate limit exceeded'}).encode('utf-8')
+            headers = {}
+        remaining, reset = self.server.rate_limit_state()
+        headers.update({'X-RateLimit-Limit': str(self.server.rate_limit), 'X-RateLimit-Remaining': str(remaining),
+                        'X-RateLimit-Reset': str(reset)})
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Github API stand-in. repositories gives the issues of each repository by
+# its full name (owner/name); an issue needs a number, a title, a state and
+# the names of its labels, and may have an updated_at time (ie.
+# 2015-04-01T12:00:00Z). Each window seconds, rate_limit requests are allowed.
+class GithubStandIn(StandInServer):
+    def __init__(self, repositories, address=('127.0.0.1', 0), rate_limit=5000, window=3600, latency=0):
+        super().__init__(address, GithubHandler, latency)
+        self.repositories = repositories
+        self.rate_limit = rate_limit
+        self.window = window
+        self.rate_limit_lock = threading.Lock()
+        self.used = 0
+        self.reset = int(time.time()) + window
+        # Authorization header of each request, None if anonymous
+        self.authorizations = []
+
+    def record_authorization(self, authorization):
+        with self.requests_lock:
+            self.authorizations.append(authorization)
+
+    def repository(self, full_name):
+        owner, name = full_name.split('/')
+        return {'name': name, 'full_name': full_name, 'owner': {'login': owner},
+                'html_url': 'https://github.com/%s' % full_name}
+
+    def issues(self, full_name):
+        issues = []
+        for issue in sorted(self.repositories[full_name], key=lambda i: i['number'], reverse=True):
+            issues.append(dict(issue, html_url='https://github.com/%s/issues/%s' % (full_name, issue['number']),
+                               labels=[{'name': label} for label in issue.get('labels', [])],
+                               updated_at=issue.get('updated_at', DEFAULT_UPDATED_AT)))
+        return issues
+
+    # Count a request in the rate limit. Returns False if it is exceeded.
+    def take_request(self):
+        with self.rate_limit_lock:
+            if time.time() >= self.reset:
+                self.used = 0
+                self.reset = int(time.time()) + self.window
+            if self.used >= self.rate_limit:
+                return False
+            self.used += 1
+            return True
+
+    def rate_limit_state(self):
+        with self.rate_limit_lock:
+            return self.rate_limit - self.used, self.reset
+
+
+##########################################################
+#
+# Tools archive
+#
+##########################################################
+class ArchiveHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    # The archive is served at any path, with an ETag and a Last-Modified
+    # date: requests with a matching If-None-Match get a 304
+    def do_GET(self):
+        self.server.record('GET', self.path)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        content, etag, modified = self.server.archive()
+        if self.headers.get('If-None-Match') == etag:
+            status, body = 304, b''
+        else:
+            status, body = 200, content
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', modified)
+        if status == 200:
+            self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Stand-in of the server of the release tools archive (ES_PLUGIN_TOOLS_URL).
+# Its content can be replaced with update(), which changes its ETag.
+class ArchiveStandIn(StandInServer):
+    def __init__(self, content, address=('127.0.0.1', 0), latency=0):
+        super().__init__(address, ArchiveHandler, latency)
+        self.archive_lock = threading.Lock()
+        self.update(content)
+
+    def update(self, content):
+        with self.archive_lock:
+            self.content = content
+            self.etag = '"%s"' % hashlib.sha1(content).hexdigest()
+            self.modified = formatdate(usegmt=True)
+
+    def archive(self):
+        with self.archive_lock:
+            return self.content, self.etag, self.modified
+
+
+##########################################################
+#
+# SMTP
+#
+##########################################################
+# Address of a MAIL FROM:<address> or RCPT TO:<address> command,
+# without the ESMTP parameters following it, like SIZE=1024
+def mail_address(argument):
+    path = argument.partition(':')[2].strip()
+    if path.startswith('<'):
+        return path[1:].partition('>')[0]
+    return path.partition(' ')[0]
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        self.server.count_connection()
+        self.reply('220 standin ESMTP')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, argument = line.decode('utf-8').strip().partition(' ')
+            command = command.upper()
+            self.server.record(command, argument)
+            if command == 'EHLO':
+                self.wfile.write(b'250-standin\r\n250-AUTH PLAIN LOGIN\r\n250-8BITMIME\r\n')
+                self.reply('250 SIZE 52428800')
+            elif command == 'HELO':
+                self.reply('250 standin')
+            elif command == 'AUTH':
+                self.authenticate(argument)
+            elif command == 'MAIL':
+                sender, recipients = mail_address(argument), []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                recipient = mail_address(argument)
+                refusal = self.server.refuse(recipient)
+                if refusal:
+                    self.reply(refusal)
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                self.server.deliver(sender, recipients, self.read_data())
+                self.reply('250 OK queued')
+            elif command == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif command == 'NOOP':
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+    # Any credentials are accepted
+    def authenticate(self, argument):
+        mechanism, _, initial = argument.partition(' ')
+        if mechanism.upper() == 'LOGIN':
+            if not initial:
+                self.reply('334 VXNlcm5hbWU6')
+                self.rfile.readline()
+            self.reply('334 UGFzc3dvcmQ6')
+            self.rfile.readline()
+        elif not initial:
+            self.reply('334 ')
+            self.rfile.readline()
+        self.reply('235 Authentication successful')
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b'.\r\n', b'.\n'):
+                break
+            # remove the dot stuffing
+            lines.append(line[1:] if line.startswith(b'..') else line)
+        return b''.join(lines)
+
+
+# SMTP server keeping the messages it receives in messages: sender,
+# recipients and data of each. The recipients of permanent_failures are
+# always refused with a 550 answer, and the first transient_failures
+# other recipients with a 451 answer.
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), transient_failures=0, permanent_failures=()):
+        super().__init__(address, SmtpHandler)
+        self.transient_failures = transient_failures
+        self.permanent_failures = set(permanent_failures)
+        self.messages = []
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count_connection(self):
+        with self.lock:
+            self.connections += 1
+
+    def record(self, command, argument):
+        with self.lock:
+            self.requests.append((command, argument))
+
+    # The answer refusing a recipient, or None if accepted
+    def refuse(self, recipient):
+        with self.lock:
+            if recipient in self.permanent_failures:
+                return '550 No such user here'
+            if self.transient_failures > 0:
+                self.transient_failures -= 1
+                return '451 Try again later'
+            return None
+
+    def deliver(self, sender, recipients, data):
+        with self.lock:
+            self.messages.append({'sender': sender, 'recipients': recipients, 'data': data})
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+##########################################################
+#
+# Plugin repository
+#
+##########################################################
+PLUGIN_POM = """<?xml version="1.0" encoding="UTF-8"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0">
+    <modelVersion>4.0.0</modelVersion>
+    <groupId>org.elasticsearch</groupId>
+    <artifactId>%(artifact_id)s</artifactId>
+    <version>%(version)s-SNAPSHOT</version>
+    <name>Elasticsearch Azure cloud plugin</name>
+    <description>Azure plugin</description>
+    <url>https://github.com/elastic/%(artifact_id)s/</url>
+    <properties>
+        <elasticsearch.version>%(es_version)s.0</elasticsearch.version>
+    </properties>
+</project>
+"""
+
+PLUGIN_README = """Azure Cloud Plugin
+## Version %(version)s-SNAPSHOT for Elasticsearch: %(es_version)s
+
+%(rows)s
+bin/plugin -install elasticsearch/%(artifact_id)s/2.4.0
+"""
+
+PLUGIN_README_ROW = ("|    %(branch)s              | Build from source | [%(version)s-SNAPSHOT]"
+                     "(https://github.com/elastic/%(artifact_id)s/tree/%(branch)s/#version-%(anchor)s-snapshot"
+                     "-for-elasticsearch-%(es_anchor)s)     |\n")
+
+# Records its command line in FAKE_MVN_LOG. Packages the plugin zip, with a
+# different content for each build, or fails to if FAKE_MVN_FAIL is set
+FAKE_MVN = """#!/bin/sh
+case "$*" in *--version*) echo "Apache Maven 3.0.5"; echo "Java version: 1.7.0_80"; exit 0;; esac
+[ -n "$FAKE_MVN_LOG" ] && echo "$*" >> "$FAKE_MVN_LOG"
+pom=$2
+dir=$(dirname $pom)
+case "$*" in *deploy:deploy-file*)
+  cp $(echo "$*" | sed -n 's|.*-Dfile=\\([^ ]*\\).*|\\1|p') $FAKE_MVN_REPOSITORY/
+  exit 0;;
+esac
+case "$*" in *clean*) rm -rf $dir/target;; esac
+case "$*" in *package*|*deploy*)
+  [ -n "$FAKE_MVN_FAIL" ] && exit 1
+  artifact=$(sed -n 's|.*<artifactId>\\(.*\\)</artifactId>.*|\\1|p' $pom | head -1)
+  version=$(sed -n 's|.*<version>\\(.*\\)</version>.*|\\1|p' $pom | head -1)
+  mkdir -p $dir/target/releases
+  echo "plugin $$ $(date +%s%N)" > $dir/target/releases/$artifact-$version.zip
+  case "$*" in *deploy*) cp $dir/target/releases/$artifact-$version.zip $FAKE_MVN_REPOSITORY/;; esac;;
+esac
+exit 0
+"""
+
+FAKE_JAVA = """#!/bin/sh
+echo 'java version "1.7.0_80"' >&2
+"""
+
+
+def write_script(path, content):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(content)
+    os.chmod(path, 0o755)
+
+
+# A plugin repository cloned from a bare origin, with a branch per entry of
+# branches giving its snapshot version and elasticsearch version, like
+# {'es-1.4': ('2.5.0', '1.4')}. The release tools are copied in its
+# plugin_tools directory. Maven and java are fake commands, and env gives
+# them to the release along with the other stand-ins it should use.
+class PluginRepository(object):
+    def __init__(self, branches, artifact_id='elasticsearch-cloud-azure', env=None):
+        self.dir = tempfile.mkdtemp(prefix='plugin-repository-')
+        self.repo = os.path.join(self.dir, 'repo')
+        self.artifact_id = artifact_id
+        self.mvn_log = os.path.join(self.dir, 'mvn.log')
+        # the artifacts maven deployed
+        self.sonatype = os.path.join(self.dir, 'sonatype')
+        os.makedirs(self.sonatype)
+        os.makedirs(os.path.join(self.dir, 'bin'))
+        os.makedirs(os.path.join(self.dir, 'jdk', 'bin'))
+        write_script(os.path.join(self.dir, 'bin', 'mvn'), FAKE_MVN)
+        write_script(os.path.join(self.dir, 'jdk', 'bin', 'java'), FAKE_JAVA)
+
+        origin = os.path.join(self.dir, 'origin.git')
+        self.git('init', '-q', '--bare', origin, cwd=self.dir)
+        self.git('clone', '-q', origin, self.repo, cwd=self.dir)
+        self.git('config', 'user.email', 'release@example.com')
+        self.git('config', 'user.name', 'Release')
+        rows = ''.join(PLUGIN_README_ROW % self.values(branch, version, es_version)
+                       for branch, (version, es_version) in sorted(branches.items(), reverse=True))
+        for index, (branch, (version, es_version)) in enumerate(sorted(branches.items(), reverse=True)):
+            values = dict(self.values(branch, version, es_version), rows=rows)
+            self.write('pom.xml', PLUGIN_POM % values)
+            self.write('README.md', PLUGIN_README % values)
+            self.write('.gitignore', 'target/\nplugin_tools/\n')
+            self.git('add', '.')
+            self.git('commit', '-q', '-m', 'init %s' % branch)
+            if index == 0:
+                self.git('push', '-q', 'origin', 'master')
+            self.git('checkout', '-q', '-b', branch)
+            self.git('push', '-q', 'origin', branch)
+            self.git('checkout', '-q', 'master')
+        self.git('checkout', '-q', sorted(branches)[-1])
+
+        # the release script runs from the plugin_tools directory of the repository
+        tools_dir = os.path.join(self.repo, 'plugin_tools')
+        os.makedirs(tools_dir)
+        tools = os.path.dirname(os.path.realpath(__file__))
+        for file in glob.glob(os.path.join(tools, '*.py')) + glob.glob(os.path.join(tools, 'email_template.*')):
+            shutil.copy(file, tools_dir)
+
+        self.env = dict((name, value) for name, value in os.environ.items()
+                        if not name.startswith(('GITHUB_', 'ES_RELEASE_', 'S3_', 'SMTP_', 'MAIL_')))
+        self.env.update(PATH='%s:%s' % (os.path.join(self.dir, 'bin'), os.environ.get('PATH', '')),
+                        JAVA_HOME=os.path.join(self.dir, 'jdk'),
+                        FAKE_MVN_LOG=self.mvn_log, FAKE_MVN_REPOSITORY=self.sonatype,
+                        ES_RELEASE_LOG=os.path.join(self.dir, 'release.log'),
+                        ES_RELEASE_CACHE_DIR=os.path.join(self.dir, 'cache'))
+        self.env.update(env or {})
+
+    def values(self, branch, version, es_version):
+        return {'artifact_id': self.artifact_id, 'branch': branch, 'version': version, 'es_version': es_version,
+                'anchor': version.replace('.', ''), 'es_anchor': es_version.replace('.', '')}
+
+    def write(self, name, content):
+        with open(os.path.join(self.repo, name), 'w', encoding='utf-8') as file:
+            file.write(content)
+
+    def git(self, *args, cwd=None):
+        return subprocess.check_output(['git'] + list(args), cwd=cwd or self.repo, stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+
+    # Run build_release.py non interactively with the given arguments
+    def release(self, *args, **env):
+        return subprocess.run([sys.executable, os.path.join('plugin_tools', 'build_release.py'),
+                               '--non_interactive'] + list(args), cwd=self.repo, env=dict(self.env, **env),
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+    # The command lines maven ran with
+    def mvn_calls(self):
+        if not os.path.isfile(self.mvn_log):
+            return []
+        with open(self.mvn_log, encoding='utf-8') as file:
+            return [line.strip() for line in file]
+
+    def remove(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs a local stand-in of a service used by the release')
+    subparsers = parser.add_subparsers(dest='service', required=True)
+    s3_parser = subparsers.add_parser('s3', help='S3 compatible server')
+    s3_parser.add_argument('--port', '-p', metavar='9000', type=int, default=9000,
+                           help='The port to listen to')
+    s3_parser.add_argument('--dir', '-d', metavar='path', default=None,
+                           help='The directory storing the objects. Defaults to a temporary directory')
+    s3_parser.add_argument('--latency', metavar='0.0', type=float, default=0,
+                           help='Seconds waited before answering each request')
+    github_parser = subparsers.add_parser('github', help='Github API')
+    github_parser.add_argument('--port', '-p', metavar='8000', type=int, default=8000,
+                               help='The port to listen to')
+    github_parser.add_argument('--data', '-d', metavar='issues.json', required=True,
+                               help='JSON file with the issues of each repository')
+    github_parser.add_argument('--rate_limit', metavar='60', type=int, default=60,
+                               help='Number of requests allowed per hour, as for anonymous Github API users')
+    github_parser.add_argument('--latency', metavar='0.0', type=float, default=0,
+                               help='Seconds waited before answering each request')
+    smtp_parser = subparsers.add_parser('smtp', help='SMTP sink')
+    smtp_parser.add_argument('--port', '-p', metavar='2525', type=int, default=2525,
+                             help='The port to listen to')
+    smtp_parser.add_argument('--transient_failures', metavar='0', type=int, default=0,
+                             help='Number of recipients refused with a transient error')
+    smtp_parser.add_argument('--permanent_failures', metavar='address', nargs='+', default=(),
+                             help='Recipients always refused with a permanent error')
+    archive_parser = subparsers.add_parser('archive', help='Server of the release tools archive')
+    archive_parser.add_argument('--port', '-p', metavar='8080', type=int, default=8080,
+                                help='The port to listen to')
+    archive_parser.add_argument('--file', '-f', metavar='master.zip', required=True,
+                                help='The archive to serve')
+    args = parser.parse_args()
+
+    if args.service == 'archive':
+        with open(args.file, 'rb') as archive:
+            server = ArchiveStandIn(archive.read(), ('127.0.0.1', args.port))
+        print('Archive stand-in listening on %s' % server.endpoint)
+    elif args.service == 'smtp':
+        server = SmtpSink(('127.0.0.1', args.port), transient_failures=args.transient_failures,
+                          permanent_failures=args.permanent_failures)
+        print('SMTP sink listening on 127.0.0.1:%s' % server.port)
+    elif args.service == 's3':
+        server = S3StandIn(('127.0.0.1', args.port), root_dir=args.dir, latency=args.latency)
+        print('S3 stand-in listening on %s, storing objects in %s' % (server.endpoint, server.root_dir))
+    else:
+        with open(args.data, encoding='utf-8') as data:
+            server = GithubStandIn(json.load(data), ('127.0.0.1', args.port), rate_limit=args.rate_limit,
+                                   latency=args.latency)
+        print('Github stand-in listening on %s' % server.endpoint)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
@@ -0,0 +1,79 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from contextlib import redirect_stdout
+from io import StringIO
+
+"""
+ Smoke tests of the batch mode: each repository is released by its own
+ process, writing its own log, output and result files.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import build_release
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='batch-test-')
+        self.saved_log = build_release.LOG
+        build_release.LOG = os.path.join(self.tmp_dir, 'release.log')
+
+    def tearDown(self):
+        build_release.LOG = self.saved_log
+        shutil.rmtree(self.tmp_dir)
+
+    def test_repositories_with_the_same_name(self):
+        repositories = [os.path.join(self.tmp_dir, owner, 'repo') for owner in ('a', 'b')]
+        for repository in repositories:
+            os.makedirs(repository)
+        # there is no release to resume: each process fails right away
+        release_args = build_release.batch_release_args(None, 'origin', False, True) + ['--resume']
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            results = build_release.run_releases([(repository, release_args, None) for repository in repositories],
+                                                 workers=2)
+
+        self.assertEqual(['repo', 'repo'], [result['repository'] for result in results])
+        self.assertEqual(2, len(set(result['output'] for result in results)))
+        self.assertEqual(2, len(set(result['log'] for result in results)))
+        for result in results:
+            self.assertNotEqual(0, result['exit_code'])
+            with open(result['output'], encoding='utf-8') as output:
+                self.assertIn('No stopped release found in %s' % result['root_dir'], output.read())
+
+    def test_failed_releases_show_how_to_recover(self):
+        repository = os.path.join(self.tmp_dir, 'repo')
+        os.makedirs(repository)
+        release_args = build_release.batch_release_args(None, 'origin', False, True) + ['--resume']
+        output = StringIO()
+        with redirect_stdout(output):
+            self.assertFalse(build_release.batch_release([repository], release_args, workers=1))
+
+        self.assertIn('The release of repo stopped', output.getvalue())
+        self.assertIn('cd %s && ES_RELEASE_ROOT_DIR=%s ' % (repository, repository), output.getvalue())
+        self.assertIn('--resume (or --abort)', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import sys
+import glob
+import unittest
+import importlib.util
+
+"""
+ Tests of the build and test caches: a release run on the same sources as a
+ previous dry run publishes the build of the dry run instead of compiling it
+ again, and tests passed on the same sources are not run again.
+ Releases run on the plugin repository stand-in of standins.py, against
+ its Github and S3 stand-ins.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import standins
+
+BRANCH = 'es-1.4'
+BUCKET = 'download.elasticsearch.org'
+ARTIFACT = 'elasticsearch-cloud-azure-2.5.0.zip'
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.github = standins.GithubStandIn({'elastic/elasticsearch-cloud-azure': []}).start()
+        self.s3 = standins.S3StandIn().start()
+        self.s3.create_bucket(BUCKET)
+        self.plugin = standins.PluginRepository({BRANCH: ('2.5.0', '1.4')},
+                                                env={'GITHUB_API_URL': self.github.endpoint,
+                                                     'S3_ENDPOINT': self.s3.endpoint, 'S3_BUCKET': BUCKET,
+                                                     'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test'})
+
+    def tearDown(self):
+        self.github.stop()
+        self.s3.stop()
+        self.plugin.remove()
+
+    def release(self, *args):
+        process = self.plugin.release('--skiptests', '--disable_mail', *args)
+        self.assertEqual(0, process.returncode, process.stdout)
+        return process.stdout
+
+    # The goals of the maven commands run, from the first one
+    def mvn_goals(self, first=0):
+        return [call.split(' ', 2)[2] for call in self.plugin.mvn_calls()[first:]]
+
+    def cached_artifacts(self):
+        return glob.glob(os.path.join(self.plugin.dir, 'cache', 'artifacts', '*', 'target', 'releases', ARTIFACT))
+
+    @unittest.skipIf(importlib.util.find_spec('boto') is None,
+                     'boto is not installed: pip3 install -r dev-tools/requirements.txt')
+    def test_publish_promotes_the_dry_run_build(self):
+        self.release()
+        self.assertEqual(['clean', 'clean package -DskipTests'], self.mvn_goals())
+        [cached_artifact] = self.cached_artifacts()
+        with open(cached_artifact, 'rb') as file:
+            dry_run_build = file.read()
+
+        calls = len(self.plugin.mvn_calls())
+        output = self.release('--publish')
+        self.assertIn('Reusing verified build', output)
+        # nothing is built again: the cached build is deployed as is
+        goals = self.mvn_goals(calls)
+        self.assertEqual(2, len(goals))
+        self.assertEqual('clean', goals[0])
+        self.assertTrue(goals[1].startswith('deploy:deploy-file '), goals[1])
+        # sonatype and S3 get the bytes of the dry run
+        with open(os.path.join(self.plugin.sonatype, ARTIFACT), 'rb') as file:
+            self.assertEqual(dry_run_build, file.read())
+        self.assertEqual(dry_run_build,
+                         self.s3.read_object(BUCKET, 'elasticsearch/elasticsearch-cloud-azure/%s' % ARTIFACT))
+        self.assertIn('refs/tags/v2.5.0', self.plugin.git('ls-remote', '--tags', 'origin'))
+
+    def test_changed_sources_are_built_again(self):
+        self.release()
+        self.plugin.write('NOTICE.txt', 'Copyright')
+        self.plugin.git('add', 'NOTICE.txt')
+        self.plugin.git('commit', '-q', '-m', 'notice')
+        self.release()
+        self.assertEqual(2, len(self.cached_artifacts()))
+        self.assertEqual(2, self.mvn_goals().count('clean package -DskipTests'))
+
+
+    def test_tests_run_once_per_tree_in_forks(self):
+        # the build fails after the tests passed: the release is retried
+        process = self.plugin.release('--disable_mail', ES_RELEASE_TEST_FORKS='3', FAKE_MVN_FAIL='true')
+        self.assertNotEqual(0, process.returncode, process.stdout)
+        self.assertEqual(['clean', 'clean test -Dtests.jvms=3 -DforkCount=3 -DreuseForks=true', 'package -DskipTests'],
+                         self.mvn_goals())
+        process = self.plugin.release('--abort')
+        self.assertEqual(0, process.returncode, process.stdout)
+
+        calls = len(self.plugin.mvn_calls())
+        process = self.plugin.release('--disable_mail', ES_RELEASE_TEST_FORKS='3')
+        self.assertEqual(0, process.returncode, process.stdout)
+        self.assertIn('Tests already passed on this tree', process.stdout)
+        self.assertEqual(['clean', 'clean package -DskipTests'], self.mvn_goals(calls))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import sys
+import json
+import unittest
+import importlib.util
+
+"""
+ Tests of --check on the plugin repository stand-in of standins.py, with
+ fake gpg, expect and s3cmd commands.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import standins
+
+FAKE_COMMAND = """#!/bin/sh
+echo "$(basename $0) 1.0"
+"""
+
+
+@unittest.skipIf(importlib.util.find_spec('boto') is None,
+                 'boto is not installed: pip3 install -r dev-tools/requirements.txt')
+class CheckTest(unittest.TestCase):
+    def setUp(self):
+        self.plugin = standins.PluginRepository({'es-1.4': ('2.5.0', '1.4')},
+                                                env={'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test'})
+        for command in ('gpg', 'expect', 's3cmd'):
+            standins.write_script(os.path.join(self.plugin.dir, 'bin', command), FAKE_COMMAND)
+        self.report_file = os.path.join(self.plugin.dir, 'report.json')
+
+    def tearDown(self):
+        self.plugin.remove()
+
+    def check(self):
+        process = self.plugin.release('--check', '--check_report', self.report_file)
+        with open(self.report_file, encoding='utf-8') as file:
+            return process.returncode, json.load(file)
+
+    def test_check(self):
+        returncode, report = self.check()
+        self.assertEqual(0, returncode, report)
+        self.assertTrue(report['ok'])
+
+    def test_check_fails_if_a_probe_fails(self):
+        del self.plugin.env['AWS_ACCESS_KEY_ID']
+        returncode, report = self.check()
+        self.assertEqual(1, returncode)
+        self.assertFalse(report['ok'])
+        self.assertEqual(['aws_access_key_id'], [check['name'] for check in report['checks'] if not check['ok']])
+
+
+if __name__ == '__main__':
+    unittest.main()
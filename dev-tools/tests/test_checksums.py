@@ -0,0 +1,80 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+"""
+ Tests of the checksum files generated next to the release artifacts.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import build_release
+
+
+class ChecksumsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='checksums-test-')
+        self.saved_log = build_release.LOG
+        build_release.LOG = os.path.join(self.tmp_dir, 'release.log')
+        # more than a chunk, and not a multiple of it
+        self.content = os.urandom(2 * build_release.CHECKSUM_CHUNK_SIZE + 12345)
+        self.artifacts = []
+        for name in ('plugin-2.0.0.zip', 'plugin-2.0.0.tar.gz'):
+            self.artifacts.append(os.path.join(self.tmp_dir, name))
+            with open(self.artifacts[-1], 'wb') as file:
+                file.write(self.content + name.encode('utf-8'))
+
+    def tearDown(self):
+        build_release.close_log()
+        build_release.LOG = self.saved_log
+        shutil.rmtree(self.tmp_dir)
+
+    def expected_digest(self, artifact, algorithm):
+        with open(artifact, 'rb') as file:
+            return hashlib.new(algorithm, file.read()).hexdigest()
+
+    def test_digests_match_hashlib(self):
+        digests = build_release.compute_digests(self.artifacts[0])
+        self.assertEqual(['md5', 'sha1', 'sha512'], sorted(digests))
+        for algorithm, digest in digests.items():
+            self.assertEqual(self.expected_digest(self.artifacts[0], algorithm), digest)
+
+    def test_checksum_files_use_the_shasum_format(self):
+        files = build_release.generate_checksums(*self.artifacts)
+
+        for artifact in self.artifacts:
+            for algorithm in build_release.CHECKSUM_ALGORITHMS:
+                with open('%s.%s.txt' % (artifact, algorithm), encoding='utf-8') as file:
+                    self.assertEqual('%s  %s\n' % (self.expected_digest(artifact, algorithm),
+                                                   os.path.basename(artifact)), file.read())
+        # the checksums of each artifact come first, then the artifact
+        expected = []
+        for artifact in self.artifacts:
+            expected += ['%s.%s.txt' % (artifact, algorithm) for algorithm in build_release.CHECKSUM_ALGORITHMS]
+            expected.append(artifact)
+        self.assertEqual(expected, files)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import urllib.parse
+
+"""
+ Smoke tests of the Github client and of the issue index against the Github
+ stand-in of standins.py: responses are revalidated with their ETag and the
+ index only downloads the issues updated since its last sync.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import standins
+import build_release
+
+REPOSITORY = 'elastic/elasticsearch-cloud-azure'
+
+
+def issue(number, labels, updated_at, state='closed'):
+    return {'number': number, 'title': 'Issue %s' % number, 'state': state, 'labels': labels,
+            'updated_at': updated_at}
+
+
+class GithubTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='github-test-')
+        self.issues = [issue(1, ['bug', 'v2.5.0'], '2015-04-01T12:00:00Z'),
+                       issue(2, ['enhancement', 'v2.5.0'], '2015-04-02T12:00:00Z'),
+                       issue(3, ['bug', 'v2.4.0'], '2015-04-03T12:00:00Z')]
+        self.github = standins.GithubStandIn({REPOSITORY: self.issues}).start()
+        self.saved = dict((name, getattr(build_release, name))
+                          for name in ('GITHUB_API_URL', 'GITHUB_CACHE_DIR', 'ISSUE_INDEX_DIR', 'GITHUB_PAGE_SIZE',
+                                       'LOG', 'RESYNC_ISSUES'))
+        build_release.GITHUB_API_URL = self.github.endpoint
+        build_release.GITHUB_CACHE_DIR = os.path.join(self.tmp_dir, 'github')
+        build_release.ISSUE_INDEX_DIR = os.path.join(self.tmp_dir, 'issues')
+        build_release.LOG = os.path.join(self.tmp_dir, 'release.log')
+        build_release.synced_issue_indexes.clear()
+        self.repository = build_release.Repository('elastic', 'elasticsearch-cloud-azure',
+                                                   'https://github.com/%s' % REPOSITORY)
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(build_release, name, value)
+        build_release.synced_issue_indexes.clear()
+        build_release.github_credentials.clear()
+        self.github.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def issue_requests(self):
+        return [urllib.parse.parse_qs(urllib.parse.urlsplit(path).query)
+                for method, path in self.github.requests if urllib.parse.urlsplit(path).path.endswith('/issues')]
+
+    def test_revalidates_with_etag(self):
+        body, headers = build_release.github_get('/repos/%s' % REPOSITORY)
+        self.assertEqual(REPOSITORY, body['full_name'])
+        remaining = build_release.github_rate_limit['remaining']
+
+        # the second response is a 304: not counted in the rate limit
+        self.assertEqual((body, headers), build_release.github_get('/repos/%s' % REPOSITORY))
+        self.assertEqual(2, len(self.github.requests))
+        self.assertEqual(remaining, build_release.github_rate_limit['remaining'])
+
+    def test_sync_only_downloads_updated_issues(self):
+        self.assertEqual([2, 1], [i.number for i in build_release.collect_issues(self.repository, 'v2.5.0')])
+        self.assertEqual(['v2.5.0', 'v2.4.0'], build_release.indexed_versions(self.repository))
+        self.assertNotIn('since', self.issue_requests()[0])
+
+        # already synced during this run
+        build_release.collect_issues(self.repository, 'v2.4.0')
+        self.assertEqual(1, len(self.issue_requests()))
+
+        self.issues.append(issue(4, ['bug', 'v2.5.0'], '2015-04-04T12:00:00Z', state='open'))
+        self.issues[0]['labels'] = ['bug', 'v2.4.0']
+        self.issues[0]['updated_at'] = '2015-04-05T12:00:00Z'
+        issues = build_release.collect_issues(self.repository, 'v2.5.0', refresh=True)
+        self.assertEqual([(4, 'open'), (2, 'closed')], [(i.number, i.state) for i in issues])
+        self.assertEqual([3, 1], [i.number for i in build_release.indexed_issues(self.repository, 'v2.4.0')])
+        self.assertEqual(['2015-04-03T12:00:00Z'], self.issue_requests()[1]['since'])
+
+    def test_sync_fetches_all_pages(self):
+        build_release.GITHUB_PAGE_SIZE = 1
+        self.assertEqual([2, 1], [i.number for i in build_release.collect_issues(self.repository, 'v2.5.0')])
+        self.assertEqual(['1', '2', '3'], sorted(request['page'][0] for request in self.issue_requests()))
+
+    def test_resync_drops_deleted_issues(self):
+        self.assertEqual([3], [i.number for i in build_release.collect_issues(self.repository, 'v2.4.0')])
+        # issue 3 is transferred to another repository
+        del self.issues[2]
+        self.issues[0]['updated_at'] = '2015-04-05T12:00:00Z'
+        build_release.collect_issues(self.repository, 'v2.4.0', refresh=True)
+        self.assertEqual([3], [i.number for i in build_release.indexed_issues(self.repository, 'v2.4.0')])
+
+        # a new run with --resync_issues
+        build_release.synced_issue_indexes.clear()
+        build_release.RESYNC_ISSUES = True
+        self.assertEqual([], build_release.collect_issues(self.repository, 'v2.4.0'))
+        self.assertEqual([2, 1], [i.number for i in build_release.indexed_issues(self.repository, 'v2.5.0')])
+        self.assertNotIn('since', self.issue_requests()[-1])
+        # the next syncs of the run only download the updated issues
+        build_release.collect_issues(self.repository, 'v2.4.0', refresh=True)
+        self.assertEqual(['2015-04-05T12:00:00Z'], self.issue_requests()[-1]['since'])
+
+    def test_repository_credentials(self):
+        repository = build_release.get_github_repository('elasticsearch-cloud-azure', login=None, password=None,
+                                                         key='secret')
+        self.assertEqual(self.repository, repository)
+        build_release.collect_issues(repository, 'v2.5.0')
+        self.assertEqual(['token secret', 'token secret'], self.github.authorizations)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+from contextlib import redirect_stdout
+from io import StringIO
+
+"""
+ Tests of the release log: one JSON record per line, printed back as
+ plain text, and of the trace of the phases, functions and commands.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import build_release
+
+
+class LogTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='log-test-')
+        self.saved = (build_release.LOG, build_release.log_phase, build_release.current_phase,
+                      list(build_release.trace_spans))
+        build_release.LOG = os.path.join(self.tmp_dir, 'release.log')
+        build_release.current_phase = None
+        del build_release.trace_spans[:]
+
+    def tearDown(self):
+        build_release.close_log()
+        build_release.LOG, build_release.log_phase, build_release.current_phase, spans = self.saved
+        build_release.trace_spans[:] = spans
+        shutil.rmtree(self.tmp_dir)
+
+    # Run commands in two phases, the last one failing
+    def run_release(self):
+        build_release.set_phase('build')
+        build_release.run('echo building')
+        build_release.set_phase('publish')
+        with self.assertRaises(RuntimeError):
+            build_release.run('echo uploading; exit 3', quiet=True)
+
+    def records(self):
+        build_release.flush_log()
+        with open(build_release.LOG, encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def test_one_record_per_line(self):
+        self.run_release()
+
+        results = [record for record in self.records() if record['event'] == 'result']
+        self.assertEqual([('build', 'echo building', 0), ('publish', 'echo uploading; exit 3', 3)],
+                         [(r['phase'], r['command'], r['exit_code']) for r in results])
+        for record in results:
+            self.assertIn('timestamp', record)
+            self.assertGreaterEqual(record['duration'], 0)
+        outputs = [(r['phase'], r['line']) for r in self.records() if r['event'] == 'output']
+        self.assertEqual([('build', 'building'), ('publish', 'uploading')], outputs)
+
+    def test_print_log(self):
+        self.run_release()
+        output = StringIO()
+        with redirect_stdout(output):
+            build_release.print_log()
+
+        # the output lines of the commands have no timestamp
+        lines = [line.split(': ', 1)[-1] for line in output.getvalue().splitlines()]
+        self.assertEqual(['PHASE: build', 'RUN: echo building', 'building'], lines[:3])
+        self.assertRegex(lines[3], r'^exit code 0 in \d+\.\ds$')
+        self.assertEqual(['PHASE: publish', 'RUN: echo uploading; exit 3', 'uploading'], lines[4:7])
+        self.assertRegex(lines[7], r'^exit code 3 in \d+\.\ds$')
+        self.assertEqual(8, len(lines))
+    def test_export_trace(self):
+        @build_release.traced
+        def package():
+            build_release.run('echo building')
+
+        build_release.set_phase('build')
+        package()
+        build_release.set_phase('publish')
+        build_release.run('true')
+        trace_file = os.path.join(self.tmp_dir, 'trace.json')
+        build_release.export_trace(trace_file)
+
+        with open(trace_file, encoding='utf-8') as file:
+            events = dict((event['name'], event) for event in json.load(file)['traceEvents'])
+        self.assertEqual(['build', 'echo building', 'package', 'publish', 'true'], sorted(events))
+        self.assertEqual({'X'}, set(event['ph'] for event in events.values()))
+        self.assertEqual(['phase', 'command', 'function'],
+                         [events[name]['cat'] for name in ('build', 'true', 'package')])
+        # the command runs in the function, which runs in the phase
+        phase, function, command = events['build'], events['package'], events['echo building']
+        for outer, inner in ((phase, function), (function, command)):
+            self.assertLessEqual(outer['ts'], inner['ts'])
+            self.assertLessEqual(inner['ts'] + inner['dur'], outer['ts'] + outer['dur'])
+        self.assertLessEqual(events['build']['ts'] + events['build']['dur'], events['publish']['ts'])
+
+    def test_print_trace_summary(self):
+        build_release.set_phase('build')
+        for _ in range(3):
+            build_release.run('true')
+        output = StringIO()
+        with redirect_stdout(output):
+            build_release.print_trace_summary()
+
+        self.assertRegex(output.getvalue(), r'\ncommand +true +3 +\d+\.\ds\n')
+        self.assertRegex(output.getvalue(), r'\nphase +build +1 +\d+\.\ds\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
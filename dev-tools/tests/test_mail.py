@@ -0,0 +1,129 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import sys
+import email
+import shutil
+import tempfile
+import unittest
+
+from contextlib import redirect_stdout
+from email.mime.text import MIMEText
+
+"""
+ Tests of the delivery of the release emails to the SMTP sink of standins.py:
+ one connection for all recipients, retries of transient errors only, and
+ a copy of each message addressed to each recipient.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import standins
+import build_release
+
+SENDER = 'release@example.com'
+RECIPIENTS = ['announce@example.com', 'team@example.com']
+
+
+def message(subject):
+    msg = MIMEText('Released', 'plain', 'utf-8')
+    msg['Subject'] = subject
+    return msg
+
+
+class MailTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mail-test-')
+        self.saved = dict((name, getattr(build_release, name))
+                          for name in ('SMTP_SERVER', 'SMTP_PORT', 'SMTP_RETRY_DELAY', 'ROOT_DIR', 'LOG'))
+        build_release.SMTP_SERVER = '127.0.0.1'
+        build_release.SMTP_RETRY_DELAY = 0.01
+        build_release.ROOT_DIR = self.tmp_dir
+        build_release.LOG = os.path.join(self.tmp_dir, 'release.log')
+        os.makedirs(os.path.join(self.tmp_dir, 'target'))
+        self.devnull = open(os.devnull, 'w')
+        self.sink = None
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(build_release, name, value)
+        build_release.close_log()
+        self.devnull.close()
+        if self.sink is not None:
+            self.sink.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def start_sink(self, **failures):
+        self.sink = standins.SmtpSink(**failures).start()
+        build_release.SMTP_PORT = self.sink.port
+        return self.sink
+
+    def dispatch(self, messages, recipients=RECIPIENTS):
+        with redirect_stdout(self.devnull):
+            return build_release.dispatch_emails([msg.as_bytes() for msg in messages], recipients, SENDER)
+
+    def test_one_connection_for_all_recipients(self):
+        self.start_sink()
+        results = self.dispatch([message('Release 2.5.0'), message('Release 2.4.1')])
+        self.assertEqual(1, self.sink.connections)
+        self.assertEqual(RECIPIENTS * 2, [result['recipient'] for result in results])
+        self.assertEqual([[recipient] for recipient in RECIPIENTS * 2],
+                         [delivered['recipients'] for delivered in self.sink.messages])
+        self.assertEqual(['Release 2.5.0'] * 2 + ['Release 2.4.1'] * 2,
+                         [email.message_from_bytes(delivered['data'])['Subject']
+                          for delivered in self.sink.messages])
+
+    def test_each_copy_is_addressed_to_its_recipient(self):
+        self.start_sink()
+        with redirect_stdout(self.devnull):
+            build_release.send_email(message('Release 2.5.0'), dry_run=False, sender=SENDER, to=','.join(RECIPIENTS))
+        for recipient, delivered in zip(RECIPIENTS, self.sink.messages):
+            self.assertEqual(['Elasticsearch Announcement List <%s>' % recipient],
+                             email.message_from_bytes(delivered['data']).get_all('To'))
+        # the copies only differ by their To line
+        self.assertEqual(1, len(set(delivered['data'].split(b'\n', 1)[1] for delivered in self.sink.messages)))
+
+    def test_transient_errors_are_retried(self):
+        self.start_sink(transient_failures=2)
+        results = self.dispatch([message('Release 2.5.0')])
+        self.assertEqual([(3, None), (1, None)], [(result['attempts'], result['error']) for result in results])
+        self.assertEqual(2, len(self.sink.messages))
+
+    def test_transient_errors_are_retried_a_few_times(self):
+        self.start_sink(transient_failures=10)
+        with build_release.MailDispatcher(SENDER) as dispatcher:
+            result = dispatcher.send(message('Release 2.5.0').as_bytes(), RECIPIENTS[0])
+        self.assertEqual(build_release.SMTP_ATTEMPTS, result['attempts'])
+        self.assertIn('451', result['error'])
+
+    def test_permanent_errors_are_not_retried(self):
+        self.start_sink(permanent_failures=[RECIPIENTS[0]])
+        with build_release.MailDispatcher(SENDER) as dispatcher:
+            results = [dispatcher.send(message('Release 2.5.0').as_bytes(), recipient) for recipient in RECIPIENTS]
+        self.assertEqual(1, results[0]['attempts'])
+        self.assertIn('550', results[0]['error'])
+        self.assertEqual((1, None), (results[1]['attempts'], results[1]['error']))
+
+        with self.assertRaisesRegex(RuntimeError, 'Failed to send email to %s' % RECIPIENTS[0]):
+            self.dispatch([message('Release 2.5.0')])
+        # the other recipient still gets its copy
+        self.assertEqual([[RECIPIENTS[1]]] * 2, [delivered['recipients'] for delivered in self.sink.messages])
+
+
+if __name__ == '__main__':
+    unittest.main()
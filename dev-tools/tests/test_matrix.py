@@ -0,0 +1,91 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import sys
+import shutil
+import unittest
+
+"""
+ Tests of --matrix: two branches of the plugin repository stand-in of
+ standins.py are released at the same time, in their own worktrees. Their
+ git commands changing the repository must not run at the same time, and
+ each build has its own maven repository.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import standins
+
+# Runs git, recording in GIT_OVERLAPS the commands changing the repository
+# started while another one is running
+FAKE_GIT = """#!/bin/sh
+case "$1" in add|branch|checkout|commit|merge|pull|push|reset|tag|worktree)
+  if mkdir "$GIT_OVERLAPS.running" 2>/dev/null; then
+    sleep 0.05
+    %(git)s "$@"
+    code=$?
+    rmdir "$GIT_OVERLAPS.running"
+    exit $code
+  fi
+  echo "$*" >> "$GIT_OVERLAPS";;
+esac
+exec %(git)s "$@"
+"""
+
+BRANCHES = {'es-1.3': ('2.4.1', '1.3'), 'es-1.4': ('2.5.0', '1.4')}
+
+
+class MatrixTest(unittest.TestCase):
+    def setUp(self):
+        self.github = standins.GithubStandIn({'elastic/elasticsearch-cloud-azure': []}).start()
+        self.plugin = standins.PluginRepository(BRANCHES, env={'GITHUB_API_URL': self.github.endpoint})
+        self.overlaps = os.path.join(self.plugin.dir, 'git-overlaps')
+        standins.write_script(os.path.join(self.plugin.dir, 'bin', 'git'), FAKE_GIT % {'git': shutil.which('git')})
+        self.plugin.env['GIT_OVERLAPS'] = self.overlaps
+
+    def tearDown(self):
+        self.github.stop()
+        self.plugin.remove()
+
+    def test_matrix(self):
+        start_branch = self.plugin.git('rev-parse', '--abbrev-ref', 'HEAD')
+        process = self.plugin.release('--skiptests', '--matrix', 'es-1.3', 'es-1.4', '--workers', '2')
+        self.assertEqual(0, process.returncode, process.stdout)
+        self.assertIn('Updated master documentation with releases', process.stdout)
+        self.assertEqual(start_branch, self.plugin.git('rev-parse', '--abbrev-ref', 'HEAD'))
+        self.assertEqual(1, len(self.plugin.git('worktree', 'list').splitlines()))
+
+        if os.path.exists(self.overlaps):
+            with open(self.overlaps, encoding='utf-8') as file:
+                self.fail('git commands ran at the same time:\n%s' % file.read())
+
+        # pom.xml of each worktree: maven repository
+        repositories = {}
+        for call in self.plugin.mvn_calls():
+            pom, repository = call.split()[1:3]
+            self.assertTrue(repository.startswith('-Dmaven.repo.local='), call)
+            repositories.setdefault(pom, set()).add(repository.split('=', 1)[1])
+        self.assertEqual(2, len(repositories))
+        self.assertEqual(2, len(set(repository for used in repositories.values() for repository in used)))
+        for used in repositories.values():
+            self.assertEqual(1, len(used))
+            self.assertTrue(next(iter(used)).startswith(os.path.join(self.plugin.dir, 'cache', 'maven')))
+
+
+if __name__ == '__main__':
+    unittest.main()
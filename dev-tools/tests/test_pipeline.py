@@ -0,0 +1,101 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+"""
+ Tests of the release pipeline of build_release.py: the order of the
+ steps of a release and how run_pipeline schedules them.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import build_release
+
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='pipeline-test-')
+        self.saved_log = build_release.LOG
+        build_release.LOG = os.path.join(self.tmp_dir, 'release.log')
+        self.events = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        build_release.close_log()
+        build_release.LOG = self.saved_log
+        shutil.rmtree(self.tmp_dir)
+
+    def record(self, name):
+        def function(context):
+            with self.lock:
+                self.events.append(('start', name))
+            # long enough for a step running at the same time to start
+            time.sleep(0.01)
+            with self.lock:
+                self.events.append(('end', name))
+        return function
+
+    # Run the steps with functions recording when they start and end
+    def run_steps(self, steps, done=()):
+        steps = [s._replace(function=self.record(s.name)) for s in steps]
+        return build_release.run_pipeline(steps, {}, done=done)
+
+    def test_release_steps_publish_after_push(self):
+        for options in ({}, {'worktree': True}, {'skip_master': True}):
+            self.events = []
+            steps = build_release.release_steps(**options)
+            self.assertEqual(set(s.name for s in steps), self.run_steps(steps))
+            self.assertLess(self.events.index(('end', 'push')), self.events.index(('start', 'publish')), options)
+            self.assertLess(self.events.index(('end', 'verify')), self.events.index(('start', 'send_email')),
+                            options)
+
+    def test_independent_steps_run_at_the_same_time(self):
+        barrier = threading.Barrier(2, timeout=5)
+        steps = [build_release.step('a', lambda context: barrier.wait()),
+                 build_release.step('b', lambda context: barrier.wait())]
+        self.assertEqual({'a', 'b'}, build_release.run_pipeline(steps, {}))
+
+    def test_steps_sharing_a_resource_run_one_after_the_other(self):
+        steps = [build_release.step(name, None, resources=[build_release.WORKING_TREE]) for name in 'abc']
+        self.run_steps(steps)
+        for index in range(0, len(self.events), 2):
+            self.assertEqual(self.events[index][1], self.events[index + 1][1])
+
+    def test_failed_step_stops_the_pipeline(self):
+        def fail(context):
+            raise RuntimeError('build failed')
+        steps = [build_release.step('build', fail),
+                 build_release.step('publish', self.record('publish'), depends=['build'])]
+        with self.assertRaisesRegex(RuntimeError, 'build failed'):
+            build_release.run_pipeline(steps, {})
+        self.assertEqual([], self.events)
+
+    def test_resumed_pipeline_skips_done_steps(self):
+        steps = [build_release.step('build', None), build_release.step('publish', None, depends=['build'])]
+        self.assertEqual({'build', 'publish'}, self.run_steps(steps, done=['build']))
+        self.assertEqual([('start', 'publish'), ('end', 'publish')], self.events)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+"""
+ Tests of the pom.xml model of build_release.py and of the values the
+ release reads from it.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import build_release
+
+POM = """<?xml version="1.0" encoding="UTF-8"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0">
+    <modelVersion>4.0.0</modelVersion>
+    <parent>
+        <groupId>org.elasticsearch</groupId>
+        <artifactId>elasticsearch-parent</artifactId>
+        <version>2.0.0-SNAPSHOT</version>
+    </parent>
+    <artifactId>elasticsearch-cloud-azure</artifactId>
+    <version>${elasticsearch.version}</version>
+    <name>Elasticsearch Azure cloud plugin</name>
+    <properties>
+        <elasticsearch.version>2.0.0-SNAPSHOT</elasticsearch.version>
+    </properties>
+    <build>
+        <plugins>
+            <plugin>
+                <artifactId>maven-compiler-plugin</artifactId>
+                <version>3.1</version>
+            </plugin>
+        </plugins>
+    </build>
+</project>
+"""
+
+
+class PomTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='pom-test-')
+        self.saved_pom_file = build_release.POM_FILE
+        build_release.POM_FILE = self.write_pom('pom.xml', POM)
+
+    def tearDown(self):
+        build_release.POM_FILE = self.saved_pom_file
+        build_release.pom_cache.clear()
+        shutil.rmtree(self.tmp_dir)
+
+    def write_pom(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def test_find_from_pom(self):
+        self.assertEqual('elasticsearch-cloud-azure', build_release.find_from_pom('artifactId'))
+        self.assertEqual('2.0.0-SNAPSHOT', build_release.find_from_pom('version'))
+        self.assertEqual('2.0.0-SNAPSHOT', build_release.find_from_pom('elasticsearch.version'))
+        with self.assertRaisesRegex(RuntimeError, 'Could not find url in pom.xml file'):
+            build_release.find_from_pom('url')
+
+    def test_find_from_pom_after_a_line(self):
+        self.assertEqual('2.0.0-SNAPSHOT',
+                         build_release.find_from_pom('version', '<artifactId>elasticsearch-parent</artifactId>'))
+        # outside of the parent, the first tag after the matching line
+        self.assertEqual('3.1', build_release.find_from_pom('version', 'maven-compiler-plugin'))
+        with self.assertRaisesRegex(RuntimeError, 'Could not find url in pom.xml file after maven'):
+            build_release.find_from_pom('url', 'maven')
+
+    def test_read_pom_defaults_to_the_current_pom_file(self):
+        self.assertEqual('elasticsearch-cloud-azure', build_release.read_pom().artifact_id)
+        build_release.POM_FILE = self.write_pom('other.xml', POM.replace('cloud-azure', 'cloud-aws'))
+        self.assertEqual('elasticsearch-cloud-aws', build_release.read_pom().artifact_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import io
+import os
+import sys
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+"""
+ Smoke tests of the conditional download of the release tools by release.py,
+ against the archive stand-in of standins.py.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import standins
+import release
+
+
+# A tools archive, as Github serves it: files are in a top level directory
+def tools_archive(files):
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w') as archive:
+        for name, data in files.items():
+            archive.writestr('elasticsearch-plugins-script-master/dev-tools/%s' % name, data)
+    return content.getvalue()
+
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='release-tools-test-')
+        self.tools_dir = os.path.join(self.tmp_dir, 'plugin_tools')
+        os.makedirs(self.tools_dir)
+        self.archive_file = os.path.join(self.tools_dir, 'release.zip')
+        self.validators_file = self.archive_file + '.json'
+        self.server = standins.ArchiveStandIn(tools_archive({'build_release.py': 'v1', 'README.md': 'doc'})).start()
+        self.url = self.server.endpoint + '/master.zip'
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def download(self):
+        return release.download_if_modified(self.url, self.archive_file, self.validators_file,
+                                            on_download=lambda archive: release.extract_tools(archive, self.tools_dir))
+
+    def tool(self, name):
+        with open(os.path.join(self.tools_dir, name), encoding='utf-8') as file:
+            return file.read()
+
+    def test_downloads_only_modified_archive(self):
+        self.assertTrue(self.download())
+        self.assertEqual('v1', self.tool('build_release.py'))
+        self.assertFalse(os.path.exists(os.path.join(self.tools_dir, 'README.md')))
+        self.assertEqual(self.server.etag, release.read_validators(self.validators_file)['etag'])
+
+        # not modified: the server answers with a 304
+        self.assertFalse(self.download())
+        self.assertEqual(2, len(self.server.requests))
+
+        self.server.update(tools_archive({'build_release.py': 'v2'}))
+        self.assertTrue(self.download())
+        self.assertEqual('v2', self.tool('build_release.py'))
+        self.assertEqual(self.server.etag, release.read_validators(self.validators_file)['etag'])
+
+    def test_downloads_again_after_failed_extraction(self):
+        def fail(archive):
+            raise KeyboardInterrupt()
+
+        self.assertRaises(KeyboardInterrupt, release.download_if_modified, self.url, self.archive_file,
+                          self.validators_file, on_download=fail)
+        self.assertFalse(os.path.exists(self.validators_file))
+
+        self.assertTrue(self.download())
+        self.assertEqual('v1', self.tool('build_release.py'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+"""
+ Tests of --resume and --abort: a dry run release of a plugin repository
+ stops when maven fails to build it, then is resumed or rolled back.
+ Releases run on the plugin repository stand-in of standins.py, against
+ its Github stand-in.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import standins
+import build_release
+
+BRANCH = 'es-1.4'
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.github = standins.GithubStandIn({'elastic/elasticsearch-cloud-azure': []}).start()
+        self.plugin = standins.PluginRepository({BRANCH: ('2.5.0', '1.4')},
+                                                env={'GITHUB_API_URL': self.github.endpoint})
+        self.journal_file = os.path.join(self.plugin.repo, '.git', 'release_journal.json')
+
+    def tearDown(self):
+        self.github.stop()
+        self.plugin.remove()
+
+    def release(self, *args, **env):
+        return self.plugin.release('--skiptests', *args, **env)
+
+    def journal(self):
+        if not os.path.isfile(self.journal_file):
+            return None
+        with open(self.journal_file, encoding='utf-8') as file:
+            return json.load(file)
+
+    def stop_release(self):
+        process = self.release(FAKE_MVN_FAIL='true')
+        self.assertNotEqual(0, process.returncode, process.stdout)
+        self.assertIn('The release stopped', process.stdout)
+        journal = self.journal()
+        self.assertIsNotNone(journal)
+        self.assertIn('release_commit', journal['steps'])
+        self.assertNotIn('build', journal['steps'])
+        # the github repository is saved by field name
+        self.assertEqual({'owner': 'elastic', 'name': 'elasticsearch-cloud-azure',
+                          'html_url': 'https://github.com/elastic/elasticsearch-cloud-azure'},
+                         journal['context']['repository'])
+        return journal
+
+    def test_resume(self):
+        self.stop_release()
+        process = self.release()
+        self.assertNotEqual(0, process.returncode, process.stdout)
+        self.assertIn('run with --resume to continue it or --abort', process.stdout)
+
+        process = self.release('--resume')
+        self.assertEqual(0, process.returncode, process.stdout)
+        self.assertIn('Resuming the release of version 2.5.0 after steps', process.stdout)
+        self.assertIsNone(self.journal())
+        self.assertEqual(BRANCH, self.plugin.git('rev-parse', '--abbrev-ref', 'HEAD'))
+        self.assertEqual('', self.plugin.git('branch', '--list', 'release_branch_*'))
+
+    def test_abort(self):
+        start_hash = self.plugin.git('rev-parse', BRANCH)
+        master_hash = self.plugin.git('rev-parse', 'master')
+        self.stop_release()
+        self.assertNotEqual(start_hash, self.plugin.git('rev-parse', 'HEAD'))
+
+        process = self.release('--abort')
+        self.assertEqual(0, process.returncode, process.stdout)
+        self.assertIsNone(self.journal())
+        self.assertEqual(BRANCH, self.plugin.git('rev-parse', '--abbrev-ref', 'HEAD'))
+        self.assertEqual(start_hash, self.plugin.git('rev-parse', BRANCH))
+        self.assertEqual(master_hash, self.plugin.git('rev-parse', 'master'))
+        self.assertEqual('', self.plugin.git('branch', '--list', 'release_branch_*'))
+        self.assertEqual('', self.plugin.git('tag', '--list'))
+
+    def test_abort_journal_without_worktree(self):
+        start_hash = self.plugin.git('rev-parse', BRANCH)
+        journal = self.stop_release()
+        del journal['context']['master_worktree']
+        with open(self.journal_file, 'w', encoding='utf-8') as file:
+            json.dump(journal, file)
+
+        process = self.release('--abort')
+        self.assertEqual(0, process.returncode, process.stdout)
+        self.assertIsNone(self.journal())
+        self.assertEqual(start_hash, self.plugin.git('rev-parse', BRANCH))
+
+    def test_resume_without_stopped_release(self):
+        process = self.release('--resume')
+        self.assertNotEqual(0, process.returncode)
+        self.assertIn('No stopped release found', process.stdout)
+
+    # The journal follows ROOT_DIR, wherever the release runs from
+    def test_journal_file(self):
+        saved_root_dir, saved_cwd = build_release.ROOT_DIR, os.getcwd()
+        other_dir = tempfile.mkdtemp(prefix='release-cwd-')
+        try:
+            os.chdir(other_dir)
+            build_release.ROOT_DIR = self.plugin.repo
+            self.assertEqual(os.path.realpath(self.journal_file), os.path.realpath(build_release.journal_file()))
+
+            worktree = os.path.join(self.plugin.dir, 'worktree')
+            self.plugin.git('worktree', 'add', '-q', worktree, 'master')
+            build_release.ROOT_DIR = worktree
+            self.assertEqual(os.path.realpath(os.path.join(self.plugin.repo, '.git', 'worktrees', 'worktree',
+                                                           'release_journal.json')),
+                             os.path.realpath(build_release.journal_file()))
+        finally:
+            os.chdir(saved_cwd)
+            build_release.ROOT_DIR = saved_root_dir
+            shutil.rmtree(other_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+
+import os
+import sys
+import stat
+import shutil
+import tempfile
+import unittest
+
+"""
+ Tests of FileRewrite, which applies the rewrites of the release to
+ the files of the repository.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import build_release
+
+README = """# Script Plugin
+
+    bin/plugin install elasticsearch/elasticsearch-plugins-script/2.0.0-SNAPSHOT
+
+| Plugin | Elasticsearch |
+| 2.0.0-SNAPSHOT | 2.0 |
+"""
+
+
+class FileRewriteTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='rewrite-test-')
+        self.saved_log = build_release.LOG
+        build_release.LOG = os.path.join(self.tmp_dir, 'release.log')
+        self.file = os.path.join(self.tmp_dir, 'README.md')
+        with open(self.file, 'w', encoding='utf-8') as file:
+            file.write(README)
+
+    def tearDown(self):
+        build_release.close_log()
+        build_release.LOG = self.saved_log
+        shutil.rmtree(self.tmp_dir)
+
+    def read(self):
+        with open(self.file, encoding='utf-8') as file:
+            return file.read()
+
+    def test_rules_apply_in_order(self):
+        rewrite = build_release.FileRewrite(self.file)
+        rewrite.replace('2.0.0-SNAPSHOT', '2.0.0')
+        # sees the output of the previous rule only
+        rewrite.sub(r'script/2\.0\.0$', 'script/2.0.0-final')
+        rewrite.replace_line_containing('| 2.0.0 |', '| 2.0.0 | 2.0.1 |\n')
+        matches = rewrite.commit()
+
+        self.assertEqual([('replace 2.0.0-SNAPSHOT', 2), (r'sub script/2\.0\.0$', 1),
+                          ('replace line containing | 2.0.0 |', 1)], matches)
+        self.assertEqual(README.replace('2.0.0-SNAPSHOT', '2.0.0-final', 1)
+                         .replace('| 2.0.0-SNAPSHOT | 2.0 |', '| 2.0.0 | 2.0.1 |'), self.read())
+        # a committed rewrite returns the same matches
+        self.assertIs(matches, rewrite.commit())
+
+    def test_file_untouched_without_match(self):
+        before = os.stat(self.file)
+        os.utime(self.file, ns=(before.st_atime_ns, before.st_mtime_ns - 10 ** 9))
+        before = os.stat(self.file)
+        rewrite = build_release.FileRewrite(self.file)
+        rewrite.replace('1.7.0-SNAPSHOT', '1.7.0')
+        self.assertEqual([('replace 1.7.0-SNAPSHOT', 0)], rewrite.commit())
+
+        after = os.stat(self.file)
+        self.assertEqual(before.st_ino, after.st_ino)
+        self.assertEqual(before.st_mtime_ns, after.st_mtime_ns)
+        self.assertEqual(['README.md', 'release.log'], sorted(os.listdir(self.tmp_dir)))
+
+    def test_no_rule_after_commit(self):
+        rewrite = build_release.FileRewrite(self.file)
+        rewrite.replace('2.0.0-SNAPSHOT', '2.0.0').commit()
+        with self.assertRaises(RuntimeError):
+            rewrite.replace('2.0.0', '2.0.1')
+
+    def test_mode_kept(self):
+        os.chmod(self.file, 0o640)
+        rewrite = build_release.FileRewrite(self.file)
+        rewrite.replace('2.0.0-SNAPSHOT', '2.0.0').commit()
+
+        self.assertTrue(rewrite.modified)
+        self.assertEqual(0o640, stat.S_IMODE(os.stat(self.file).st_mode))
+        self.assertNotIn('SNAPSHOT', self.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
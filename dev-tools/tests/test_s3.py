@@ -0,0 +1,213 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import importlib.util
+
+from contextlib import redirect_stdout
+
+"""
+ Smoke tests of the S3 uploads against the S3 stand-in of standins.py:
+ unchanged artifacts are skipped, uploads are verified and interrupted
+ multipart uploads are resumed. They need boto and are skipped without it.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import standins
+import build_release
+
+BUCKET = 'download.elasticsearch.org'
+BASE = 'elasticsearch/elasticsearch-cloud-azure'
+MB = 1024 * 1024
+
+
+@unittest.skipIf(importlib.util.find_spec('boto') is None,
+                 'boto is not installed: pip3 install -r dev-tools/requirements.txt')
+class S3Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='s3-test-')
+        self.s3 = standins.S3StandIn().start()
+        # the stand-in does not check signatures, but boto needs credentials
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+        self.saved = dict((name, getattr(build_release, name))
+                          for name in ('S3_ENDPOINT', 'S3_BUCKET', 'S3_SKIP_UNCHANGED', 'LOG'))
+        build_release.S3_ENDPOINT = self.s3.endpoint
+        build_release.S3_BUCKET = BUCKET
+        build_release.S3_SKIP_UNCHANGED = True
+        build_release.LOG = os.path.join(self.tmp_dir, 'release.log')
+        self.tool = build_release.load_s3_tool()
+        self.s3.create_bucket(BUCKET)
+        self.artifact = self.write_file('elasticsearch-cloud-azure-2.5.0.zip', b'plugin' * 1024)
+        self.devnull = open(os.devnull, 'w')
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(build_release, name, value)
+        self.devnull.close()
+        self.s3.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as file:
+            file.write(content)
+        return path
+
+    # A connection to the stand-in, closed at the end of the test
+    def connect(self):
+        conn = self.tool.connect(self.s3.endpoint)
+        self.addCleanup(self.tool.close_connection, conn)
+        return conn
+
+    def read_file(self, path):
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def publish(self, files):
+        with redirect_stdout(self.devnull):
+            return build_release.publish_artifacts(files, BASE, dry_run=False)
+
+    def verify(self, files):
+        with redirect_stdout(self.devnull):
+            return build_release.verify_published_artifacts(files, BASE, dry_run=False)
+
+    def puts(self):
+        return [path for method, path in self.s3.requests if method == 'PUT']
+
+    def test_publish_skips_unchanged_files(self):
+        files = build_release.generate_checksums(self.artifact)
+        results = self.publish(files)
+        self.assertEqual([False] * len(files), [result['skipped'] for result in results])
+        key = '%s/%s' % (BASE, os.path.basename(self.artifact))
+        self.assertEqual(self.read_file(self.artifact), self.s3.read_object(BUCKET, key))
+        self.assertEqual(build_release.local_digest(self.artifact, 'sha1'),
+                         self.s3.object_meta(BUCKET, key)['metadata']['sha1'])
+
+        puts = len(self.puts())
+        results = self.publish(files)
+        self.assertEqual([True] * len(files), [result['skipped'] for result in results])
+        self.assertEqual(puts, len(self.puts()))
+
+        # a changed artifact is uploaded again
+        self.write_file(os.path.basename(self.artifact), b'changed' * 1024)
+        results = self.publish([self.artifact])
+        self.assertEqual([False], [result['skipped'] for result in results])
+        self.assertEqual(self.read_file(self.artifact), self.s3.read_object(BUCKET, key))
+
+    def test_publish_uploads_big_files_in_parts(self):
+        big_file = self.write_file('big.zip', os.urandom(6 * MB))
+        files = [(self.artifact, os.path.basename(self.artifact)), (big_file, 'big.zip')]
+        with redirect_stdout(self.devnull):
+            results = self.tool.publish(self.connect(), BASE, files, BUCKET, threads=2, part_size=5 * MB)
+        self.assertEqual([None, None], [result['error'] for result in results])
+        self.assertEqual([file for file, _ in files], [result['file'] for result in results])
+        self.assertEqual(2, len(self.uploaded_parts('%s/big.zip' % BASE)))
+        for file, key in files:
+            self.assertEqual(self.read_file(file), self.s3.read_object(BUCKET, '%s/%s' % (BASE, key)))
+
+    def test_verify(self):
+        files = build_release.generate_checksums(self.artifact)
+        self.publish(files)
+        self.assertEqual(len(files), len(self.verify(files)))
+
+        # the object on S3 is not the local artifact anymore
+        conn = self.connect()
+        conn.get_bucket(BUCKET).new_key('%s/%s' % (BASE, os.path.basename(self.artifact))) \
+            .set_contents_from_string('truncated')
+        with self.assertRaisesRegex(RuntimeError, 'do not match the local ones'):
+            self.verify([self.artifact])
+
+    def test_verify_never_creates_the_bucket(self):
+        build_release.S3_BUCKET = 'missing.elasticsearch.org'
+        with self.assertRaisesRegex(RuntimeError, 'missing.elasticsearch.org does not exist'):
+            self.verify([self.artifact])
+        self.assertEqual([BUCKET], self.s3.bucket_names())
+
+    def test_publish_never_creates_the_bucket(self):
+        build_release.S3_BUCKET = 'missing.elasticsearch.org'
+        with self.assertRaisesRegex(RuntimeError, 'missing.elasticsearch.org does not exist'):
+            self.publish([self.artifact])
+        with self.assertRaisesRegex(RuntimeError, 'missing.elasticsearch.org does not exist'):
+            self.multipart_upload(self.artifact, bucket='missing.elasticsearch.org')
+        self.assertEqual([BUCKET], self.s3.bucket_names())
+
+    def multipart_upload(self, file, bucket=BUCKET):
+        with redirect_stdout(self.devnull):
+            self.tool.multipart_upload_s3(self.connect(), BASE, os.path.basename(file), file,
+                                          bucket, part_size=5 * MB, threads=2)
+
+    # the parts of a multipart upload are the only PUTs of its key
+    def uploaded_parts(self, key_name):
+        return [path for path in self.puts() if path == '/%s/%s' % (BUCKET, key_name)]
+
+    # an upload of big_file interrupted after its first part, recorded with the given md5
+    def interrupted_upload(self, big_file, key_name, md5=None):
+        conn = self.connect()
+        bucket = self.tool.existing_bucket(conn, BUCKET)
+        mp = bucket.initiate_multipart_upload(key_name)
+        with open(big_file, 'rb') as fp:
+            part = mp.upload_part_from_file(fp, 1, size=5 * MB)
+        stat = os.stat(big_file)
+        with open(self.tool.journal_file(big_file), 'w', encoding='utf-8') as file:
+            json.dump({'bucket': BUCKET, 'key': key_name, 'part_size': 5 * MB, 'size': stat.st_size,
+                       'mtime': stat.st_mtime, 'upload_id': mp.id,
+                       'parts': {'1': {'etag': part.etag, 'md5': md5 or part.etag.strip('"')}}}, file)
+
+    def test_multipart_upload_resumes(self):
+        big_file = self.write_file('big.zip', os.urandom(12 * MB))
+        key_name = '%s/big.zip' % BASE
+        self.interrupted_upload(big_file, key_name)
+
+        parts = len(self.uploaded_parts(key_name))
+        self.multipart_upload(big_file)
+        self.assertEqual(2, len(self.uploaded_parts(key_name)) - parts)
+        self.assertEqual(self.read_file(big_file), self.s3.read_object(BUCKET, key_name))
+        self.assertFalse(os.path.exists(self.tool.journal_file(big_file)))
+
+    def test_multipart_upload_uploads_again_parts_not_matching_the_journal(self):
+        big_file = self.write_file('big.zip', os.urandom(12 * MB))
+        key_name = '%s/big.zip' % BASE
+        self.interrupted_upload(big_file, key_name, md5='0' * 32)
+
+        parts = len(self.uploaded_parts(key_name))
+        self.multipart_upload(big_file)
+        self.assertEqual(3, len(self.uploaded_parts(key_name)) - parts)
+        self.assertEqual(self.read_file(big_file), self.s3.read_object(BUCKET, key_name))
+
+    def test_multipart_upload_restarts_expired_upload(self):
+        big_file = self.write_file('big.zip', os.urandom(6 * MB))
+        stat = os.stat(big_file)
+        with open(self.tool.journal_file(big_file), 'w', encoding='utf-8') as file:
+            json.dump({'bucket': BUCKET, 'key': '%s/big.zip' % BASE, 'part_size': 5 * MB, 'size': stat.st_size,
+                       'mtime': stat.st_mtime, 'upload_id': 'expired',
+                       'parts': {'1': {'etag': '"etag"', 'md5': 'etag'}}}, file)
+
+        self.multipart_upload(big_file)
+        self.assertEqual(2, len(self.uploaded_parts('%s/big.zip' % BASE)))
+        self.assertEqual(self.read_file(big_file), self.s3.read_object(BUCKET, '%s/big.zip' % BASE))
+        self.assertFalse(os.path.exists(self.tool.journal_file(big_file)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# Licensed to Elasticsearch under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance  with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on
+# an 'AS IS' BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import sys
+import unittest
+
+"""
+ Tests of the --worktree mode: a dry run release of a plugin repository
+ updates the master branch in its own worktree, and never checks it out
+ in the working tree of the build. Github is the stand-in of standins.py.
+
+   $ python3 -m unittest discover dev-tools/tests
+"""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import standins
+
+BRANCH = 'es-1.4'
+
+
+class WorktreeTest(unittest.TestCase):
+    def setUp(self):
+        self.github = standins.GithubStandIn({'elastic/elasticsearch-cloud-azure': []}).start()
+        self.plugin = standins.PluginRepository({BRANCH: ('2.5.0', '1.4')},
+                                                env={'GITHUB_API_URL': self.github.endpoint})
+
+    def tearDown(self):
+        self.github.stop()
+        self.plugin.remove()
+
+    # The checkouts of the working tree done by a release changing
+    # its branch, oldest first
+    def release_checkouts(self, *args):
+        before = len(self.plugin.git('reflog', '--format=%gs').splitlines())
+        process = self.plugin.release('--skiptests', *args)
+        self.assertEqual(0, process.returncode, process.stdout)
+        entries = self.plugin.git('reflog', '--format=%gs').splitlines()
+        checkouts = [entry.split() for entry in reversed(entries[:len(entries) - before])
+                     if entry.startswith('checkout:')]
+        return [(entry[3], entry[5]) for entry in checkouts if entry[3] != entry[5]]
+
+    def test_worktree(self):
+        checkouts = self.release_checkouts('--worktree')
+        self.assertEqual([(BRANCH, 'release_branch_%s_2.5.0' % BRANCH),
+                          ('release_branch_%s_2.5.0' % BRANCH, BRANCH)], checkouts)
+        # master was updated in the worktree, then reset by the dry run
+        self.assertIn('merge release_branch_master_2.5.0', self.plugin.git('reflog', 'master', '--format=%gs'))
+        self.assertEqual(1, len(self.plugin.git('worktree', 'list').splitlines()))
+        self.assertEqual('', self.plugin.git('branch', '--list', 'release_branch_*'))
+        self.assertEqual(BRANCH, self.plugin.git('rev-parse', '--abbrev-ref', 'HEAD'))
+        # the git commands of both trees took turns
+        self.assertTrue(os.path.isfile(os.path.join(self.plugin.repo, '.git', 'release_git.lock')))
+
+    def test_without_worktree(self):
+        checkouts = self.release_checkouts()
+        self.assertIn((BRANCH, 'master'), checkouts)
+        self.assertIn(('master', 'release_branch_master_2.5.0'), checkouts)
+        self.assertEqual(BRANCH, self.plugin.git('rev-parse', '--abbrev-ref', 'HEAD'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+#!/usr/bin/env python3
 # Licensed to Elasticsearch under one or more contributor
 # license agreements. See the NOTICE file distributed with
 # this work for additional information regarding copyright
@@ -14,36 +15,403 @@
 # either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+# Requires Python 3, with boto installed for it. It is loaded by
+# build_release.py in its own interpreter, or run on its own:
+#
+#   $ python3 dev-tools/upload-s3.py --file target/releases/plugin.zip --path elasticsearch/plugin
+
+import io
 import os
 import sys
+import json
+import hashlib
+import time
 import argparse
+import threading
+import urllib.parse
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 try:
   import boto.s3
+  import boto.s3.bucket
+  import boto.s3.connection
+  import boto.s3.multipart
+  import boto.exception
 except:
   raise RuntimeError("""
-  S3 upload requires boto to be installed
+  S3 upload requires boto to be installed for Python 3
     Use one of:
-      'pip install -U boto'
-      'apt-get install python-boto'
-      'easy_install boto'
+      'pip3 install -U boto'
+      'apt-get install python3-boto'
   """)
 
+# S3 does not accept parts smaller than 5mb (but the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+DEFAULT_THREADS = 4
+# User metadata of the uploaded objects holding the sha1 of their content
+DIGEST_METADATA = 'sha1'
+
+
+# Connect to Amazon S3, or to any S3 compatible server
+# when an endpoint like http://localhost:9000 is given
+def connect(endpoint=None):
+  if not endpoint:
+    return boto.connect_s3()
+  url = urllib.parse.urlparse(endpoint)
+  return boto.connect_s3(host=url.hostname, port=url.port, is_secure=url.scheme == 'https',
+                         calling_format=boto.s3.connection.OrdinaryCallingFormat())
+
+
+# A new connection with the settings and credentials of conn. boto
+# connections are not thread safe: each thread sending requests at the
+# same time as others needs its own.
+def clone_connection(conn):
+  return type(conn)(host=conn.host, port=conn.port, is_secure=conn.is_secure, calling_format=conn.calling_format,
+                    provider=conn.provider, anon=conn.anon)
+
+
+# Close the http connections kept in the pool of a connection: the
+# close() of boto connections only forgets the current one
+def close_connection(conn):
+  conn.close()
+  pool = conn._pool
+  with pool.mutex:
+    for host_pool in pool.host_to_pool.values():
+      for http_connection, _ in host_pool.queue:
+        http_connection.close()
+    pool.host_to_pool.clear()
+
+
+# Gives a function returning a connection of the calling thread, cloned
+# from conn. The cloned connections are closed on exit.
+@contextmanager
+def thread_connections(conn):
+  local = threading.local()
+  connections = []
+  lock = threading.Lock()
+
+  def connection():
+    if not hasattr(local, 'conn'):
+      local.conn = clone_connection(conn)
+      with lock:
+        connections.append(local.conn)
+    return local.conn
+  try:
+    yield connection
+  finally:
+    for cloned in connections:
+      close_connection(cloned)
+
 
 def list_buckets(conn):
   return conn.get_all_buckets()
 
 
-def upload_s3(conn, path, key, file, bucket):
-  print('Uploading %s to Amazon S3 bucket %s/%s') % \
-        (file, bucket,  os.path.join(path, key))
+# Get a bucket by its name, failing if it does not exist.
+# Bucket instances are returned as is.
+def existing_bucket(conn, bucket):
+  if isinstance(bucket, boto.s3.bucket.Bucket):
+    return bucket
+  try:
+    return conn.get_bucket(bucket)
+  except boto.exception.S3ResponseError as e:
+    if e.status != 404:
+      raise
+    raise RuntimeError('Amazon S3 bucket %s does not exist' % bucket)
+
+
+def upload_s3(conn, path, key, file, bucket, metadata=None):
+  print('Uploading %s to Amazon S3 bucket %s/%s' % \
+        (file, bucket,  os.path.join(path, key)))
   def percent_cb(complete, total):
     sys.stdout.write('.')
     sys.stdout.flush()
-  bucket = conn.create_bucket(bucket)
+  bucket = existing_bucket(conn, bucket)
   k = bucket.new_key(os.path.join(path, key))
+  k.update_metadata(metadata or {})
   k.set_contents_from_filename(file, cb=percent_cb, num_cb=100)
 
 
+# sha1 of a file, stored in the DIGEST_METADATA of its object
+def file_sha1(file):
+  digest = hashlib.sha1()
+  with open(file, 'rb') as fp:
+    chunk = fp.read(DEFAULT_PART_SIZE)
+    while chunk:
+      digest.update(chunk)
+      chunk = fp.read(DEFAULT_PART_SIZE)
+  return digest.hexdigest()
+
+
+# md5 of the part of a file starting at offset, as S3 gives it as ETag
+def part_md5(file, offset, size):
+  with open(file, 'rb') as fp:
+    fp.seek(offset)
+    return hashlib.md5(fp.read(size)).hexdigest()
+
+
+# The resume journal of a multipart upload lives next to the uploaded file
+def journal_file(file):
+  return '%s.s3upload.json' % file
+
+
+# Load the journal of a previous upload of the same file to the same key.
+# Returns None if there is none or if the file changed since.
+def load_journal(file, bucket, key_name, part_size):
+  try:
+    with open(journal_file(file), encoding='utf-8') as f:
+      journal = json.load(f)
+  except (FileNotFoundError, ValueError):
+    return None
+  stat = os.stat(file)
+  expected = {'bucket': bucket, 'key': key_name, 'part_size': part_size,
+              'size': stat.st_size, 'mtime': stat.st_mtime}
+  for name, value in expected.items():
+    if journal.get(name) != value:
+      return None
+  return journal
+
+
+def save_journal(file, journal):
+  tmp_file = journal_file(file) + '.tmp'
+  with open(tmp_file, 'w', encoding='utf-8') as f:
+    json.dump(journal, f)
+  os.replace(tmp_file, journal_file(file))
+
+
+# Whether S3 still has a multipart upload: it forgets the uploads that
+# were aborted or not completed in time
+def upload_exists(bucket, key_name, upload_id):
+  response = bucket.connection.make_request('GET', bucket.name, key_name, query_args='uploadId=%s' % upload_id)
+  body = response.read()
+  if response.status == 404:
+    return False
+  if response.status != 200:
+    raise bucket.connection.provider.storage_response_error(response.status, response.reason, body)
+  return True
+
+
+# Upload a file in parts of part_size bytes, several parts at the same time,
+# each thread with its own connection. Completed parts are recorded in a
+# journal next to the file with their md5: if the upload is interrupted,
+# running it again only uploads the parts missing or whose content is not
+# the one recorded. The object gets the given user metadata, if any.
+def multipart_upload_s3(conn, path, key, file, bucket, part_size=DEFAULT_PART_SIZE, threads=DEFAULT_THREADS,
+                        metadata=None):
+  if part_size < MIN_PART_SIZE:
+    raise ValueError('part size must be at least %s bytes' % MIN_PART_SIZE)
+  key_name = os.path.join(path, key)
+  size = os.path.getsize(file)
+  part_count = max(1, (size + part_size - 1) // part_size)
+  bucket = existing_bucket(conn, bucket)
+
+  journal = load_journal(file, bucket.name, key_name, part_size)
+  mp = None
+  if journal:
+    mp = boto.s3.multipart.MultiPartUpload(bucket)
+    mp.key_name = key_name
+    mp.id = journal['upload_id']
+    if upload_exists(bucket, key_name, mp.id):
+      print('Resuming upload of %s to Amazon S3 bucket %s/%s: %s/%s parts already uploaded' %
+            (file, bucket.name, key_name, len(journal['parts']), part_count))
+    else:
+      print('Upload %s of %s is no longer on Amazon S3: uploading it again' % (mp.id, file))
+      os.remove(journal_file(file))
+      mp = None
+  if mp is None:
+    mp = bucket.initiate_multipart_upload(key_name, metadata=metadata)
+    stat = os.stat(file)
+    journal = {'bucket': bucket.name, 'key': key_name, 'part_size': part_size, 'size': stat.st_size,
+               'mtime': stat.st_mtime, 'upload_id': mp.id, 'parts': {}}
+    save_journal(file, journal)
+    print('Uploading %s to Amazon S3 bucket %s/%s in %s parts' % (file, bucket.name, key_name, part_count))
+
+  lock = threading.Lock()
+
+  def part_range(part_num):
+    offset = (part_num - 1) * part_size
+    return offset, min(part_size, size - offset)
+
+  def uploaded(part_num):
+    part = journal['parts'].get(str(part_num))
+    return isinstance(part, dict) and part.get('md5') == part_md5(file, *part_range(part_num))
+
+  def upload_part(part_num):
+    offset, length = part_range(part_num)
+    thread_mp = boto.s3.multipart.MultiPartUpload(connection().get_bucket(bucket.name, validate=False))
+    thread_mp.key_name = key_name
+    thread_mp.id = mp.id
+    with open(file, 'rb') as fp:
+      fp.seek(offset)
+      data = fp.read(length)
+    md5 = hashlib.md5(data).hexdigest()
+    part = thread_mp.upload_part_from_file(io.BytesIO(data), part_num, size=length)
+    if part.etag.strip('"') != md5:
+      raise RuntimeError('part %s of %s has ETag %s on Amazon S3 instead of %s' % (part_num, file, part.etag, md5))
+    with lock:
+      journal['parts'][str(part_num)] = {'etag': part.etag, 'md5': md5}
+      save_journal(file, journal)
+      sys.stdout.write('.')
+      sys.stdout.flush()
+
+  with thread_connections(conn) as connection, ThreadPoolExecutor(max_workers=threads) as executor:
+    missing = [n for n, done in zip(range(1, part_count + 1), executor.map(uploaded, range(1, part_count + 1)))
+               if not done]
+    # consume the results so that any failure is raised here
+    list(executor.map(upload_part, missing))
+  mp.complete_upload()
+  os.remove(journal_file(file))
+
+
+# Files already in the bucket with the same content: same size and same
+# digest metadata, recorded when they were uploaded. A single request
+# lists the objects under path, then the metadata of the objects of the
+# right size is read with a HEAD request each, several at the same time,
+# each thread over its own connection. files is a list of (file, key)
+# tuples, digests gives the sha1 of each file.
+def unchanged_files(bucket, path, files, digests, threads=DEFAULT_THREADS):
+  sizes = dict((key.name, key.size) for key in bucket.list(prefix=path.rstrip('/') + '/'))
+  candidates = [(file, key) for file, key in files
+                if file in digests and sizes.get(os.path.join(path, key)) == os.path.getsize(file)]
+
+  with thread_connections(bucket.connection) as connection, ThreadPoolExecutor(max_workers=threads) as executor:
+    def unchanged(item):
+      file, key = item
+      existing = connection().get_bucket(bucket.name, validate=False).get_key(os.path.join(path, key))
+      return existing is not None and existing.get_metadata(DIGEST_METADATA) == digests[file]
+
+    return set(file for (file, _), same in zip(candidates, executor.map(unchanged, candidates)) if same)
+
+
+# Upload several files at the same time, each thread over its own
+# connection. files is a list of (file, key) tuples. Files bigger than
+# part_size, if set, are uploaded in parts once the others are done, one
+# after the other: each one already sends threads parts at the same time.
+# digests, if given, has the sha1 of the files: it is stored in the
+# metadata of their objects and, with skip_unchanged, files already in the
+# bucket with the same digest are not uploaded again.
+# Returns, in the same order, a result per file with its key, size, upload
+# time in seconds, whether it was skipped and the error that made it fail if any.
+def publish(conn, path, files, bucket, threads=DEFAULT_THREADS, part_size=None, digests=None, skip_unchanged=False):
+  bucket = existing_bucket(conn, bucket)
+  digests = digests or {}
+  unchanged = set()
+  if skip_unchanged and digests:
+    try:
+      unchanged = unchanged_files(bucket, path, files, digests, threads=threads)
+    except boto.exception.S3ResponseError as e:
+      print('Could not check the files already in Amazon S3 bucket %s/%s, uploading all of them: %s'
+            % (bucket.name, path, e))
+
+  def upload(item, connection):
+    file, key = item
+    result = {'file': file, 'key': os.path.join(path, key), 'size': os.path.getsize(file),
+              'skipped': file in unchanged, 'error': None}
+    if result['skipped']:
+      result['seconds'] = 0
+      return result
+    metadata = {DIGEST_METADATA: digests[file]} if file in digests else {}
+    start = time.time()
+    try:
+      if part_size and result['size'] > part_size:
+        multipart_upload_s3(conn, path, key, file, bucket, part_size=part_size, threads=threads, metadata=metadata)
+      else:
+        new_key = connection().get_bucket(bucket.name, validate=False).new_key(result['key'])
+        new_key.update_metadata(metadata)
+        new_key.set_contents_from_filename(file)
+    except Exception as e:
+      result['error'] = '%s: %s' % (type(e).__name__, e)
+    result['seconds'] = time.time() - start
+    return result
+
+  in_parts = [bool(part_size) and os.path.getsize(file) > part_size for file, _ in files]
+  results = [None] * len(files)
+  with thread_connections(conn) as connection:
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+      futures = dict((executor.submit(upload, item, connection), index)
+                     for index, item in enumerate(files) if not in_parts[index])
+      for future, index in futures.items():
+        results[index] = future.result()
+    for index, item in enumerate(files):
+      if in_parts[index]:
+        results[index] = upload(item, connection)
+  return results
+
+
+# The ETag S3 gives to a file uploaded in parts of part_size bytes:
+# the md5 of the md5 of its parts, followed by the number of parts
+def multipart_etag(file, part_size):
+  digests = hashlib.md5()
+  parts = 0
+  with open(file, 'rb') as fp:
+    part = fp.read(part_size)
+    while part or parts == 0:
+      digests.update(hashlib.md5(part).digest())
+      parts += 1
+      part = fp.read(part_size)
+  return '%s-%s' % (digests.hexdigest(), parts)
+
+
+# Check an uploaded object against its file, from the response to a HEAD
+# request: its size, then its ETag, which is the md5 of the file for a
+# single upload. For an upload in parts, the file is hashed again in parts
+# of part_size bytes. Returns what does not match or None.
+def check_object(key, file, md5, part_size):
+  if key is None:
+    return 'missing'
+  size = os.path.getsize(file)
+  if key.size != size:
+    return 'size is %s bytes instead of %s' % (key.size, size)
+  etag = key.etag.strip('"')
+  if '-' not in etag:
+    expected = md5
+  else:
+    parts = int(etag.split('-')[1])
+    if parts != max(1, (size + part_size - 1) // part_size):
+      return 'uploaded in %s parts: can not be checked with parts of %s bytes' % (parts, part_size)
+    expected = multipart_etag(file, part_size)
+  if etag != expected:
+    return 'ETag is %s instead of %s' % (etag, expected)
+  return None
+
+
+# Check that uploaded files are in the bucket as they are locally, with a
+# HEAD request per file: nothing is downloaded. files is a list of
+# (file, key, md5) tuples. Requests are sent several at the same time, each
+# thread over its own connection, and unless fail_fast is False, no other
+# is sent once a file does not match.
+# Returns a result per file checked with its key, size in the bucket, ETag
+# and what does not match if anything.
+def verify(conn, path, files, bucket, threads=DEFAULT_THREADS, part_size=DEFAULT_PART_SIZE, fail_fast=True):
+  bucket = existing_bucket(conn, bucket)
+  failed = threading.Event()
+
+  def check(item, connection):
+    file, key_name, md5 = item
+    result = {'file': file, 'key': os.path.join(path, key_name), 'size': None, 'etag': None, 'error': None}
+    if fail_fast and failed.is_set():
+      return None
+    try:
+      key = connection().get_bucket(bucket.name, validate=False).get_key(result['key'])
+      if key is not None:
+        result['size'] = key.size
+        result['etag'] = key.etag.strip('"')
+      result['error'] = check_object(key, file, md5, part_size)
+    except Exception as e:
+      result['error'] = '%s: %s' % (type(e).__name__, e)
+    if result['error']:
+      failed.set()
+    return result
+
+  with thread_connections(conn) as connection, ThreadPoolExecutor(max_workers=threads) as executor:
+    futures = [executor.submit(check, item, connection) for item in files]
+    results = [future.result() for future in futures]
+  return [result for result in results if result is not None]
+
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Uploads files to Amazon S3')
   parser.add_argument('--file', '-f', metavar='path to file',
@@ -54,12 +422,25 @@ if __name__ == '__main__':
                       help='The key path to use')
   parser.add_argument('--key', '-k', metavar='key', default=None,
                       help='The key - uses the file name as default key')
+  parser.add_argument('--endpoint', '-e', metavar='http://localhost:9000', default=None,
+                      help='The endpoint of a S3 compatible server to use instead of Amazon S3')
+  parser.add_argument('--multipart', '-m', action='store_true', default=False,
+                      help='Uploads the file in parts, several at the same time. Resumes interrupted uploads')
+  parser.add_argument('--part_size', metavar='16', type=int, default=DEFAULT_PART_SIZE // (1024 * 1024),
+                      help='The size of each part in mb when uploading in parts')
+  parser.add_argument('--threads', '-t', metavar='4', type=int, default=DEFAULT_THREADS,
+                      help='The number of parts uploaded at the same time')
   args = parser.parse_args()
   if args.key:
     key = args.key
   else:
     key = os.path.basename(args.file)
 
-  connection = boto.connect_s3()
-  upload_s3(connection, args.path, key, args.file, args.bucket);
+  connection = connect(args.endpoint)
+  metadata = {DIGEST_METADATA: file_sha1(args.file)}
+  if args.multipart:
+    multipart_upload_s3(connection, args.path, key, args.file, args.bucket,
+                        part_size=args.part_size * 1024 * 1024, threads=args.threads, metadata=metadata)
+  else:
+    upload_s3(connection, args.path, key, args.file, args.bucket, metadata=metadata);
 